@@ -0,0 +1,187 @@
+"""
+Shared HTTP client for the Divar Open API and OAuth endpoints.
+
+All apps talk to Divar through one keep-alive connection pool per process,
+with per-endpoint timeouts, bounded retries with jittered backoff and latency
+counters per endpoint.
+
+Only requests that cannot be applied twice are retried: idempotent ones on
+429/5xx responses and connection errors, and POSTs (chat messages, addons,
+OAuth code exchange) only when Divar never received them, i.e. on 429 and on
+errors while connecting.
+"""
+
+import random
+import threading
+import time
+from typing import Dict, Optional
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Responses of requests Divar did not process, retried for any method
+UNPROCESSED_STATUS_CODES = {429}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def _failed_to_connect(error: requests.ConnectionError) -> bool:
+    """Whether a connection error happened before any of the request was sent"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class DivarClient:
+    """Pooled Divar API client shared by all apps of the project"""
+
+    def __init__(self):
+        self.timeouts = settings.DIVAR_CLIENT_TIMEOUTS
+        self.max_retries = settings.DIVAR_CLIENT_MAX_RETRIES
+        self.backoff_base = settings.DIVAR_CLIENT_BACKOFF_BASE
+        self.backoff_max = settings.DIVAR_CLIENT_BACKOFF_MAX
+
+        pool_size = settings.DIVAR_CLIENT_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _timeout(self, endpoint: str):
+        """(connect, read) timeout for an endpoint"""
+        return self.timeouts.get(endpoint, self.timeouts['default'])
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        """
+        Seconds to wait before the next attempt (full jitter, honouring Retry-After)
+        """
+        if response is not None and response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, endpoint: str, elapsed: float, failed: bool = False, retried: bool = False):
+        """Update the latency counters of an endpoint"""
+        elapsed_ms = elapsed * 1000
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+            })
+            stats['requests'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            if failed:
+                stats['errors'] += 1
+            if retried:
+                stats['retries'] += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Latency counters per endpoint
+
+        Returns:
+            Dictionary of endpoint -> requests, errors, retries, total_ms, max_ms, avg_ms
+        """
+        with self._stats_lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                result[endpoint] = dict(stats)
+                result[endpoint]['avg_ms'] = stats['total_ms'] / stats['requests'] if stats['requests'] else 0.0
+            return result
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        endpoint: str = 'default',
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> requests.Response:
+        """
+        Send a request through the shared connection pool
+
+        Args:
+            method: HTTP method
+            url: Full request URL
+            endpoint: Endpoint name used for timeouts and counters (see DIVAR_CLIENT_TIMEOUTS)
+            idempotent: Whether the request may be applied twice (e.g. a POST with an
+                idempotency key); defaults to True for GET, HEAD, OPTIONS, PUT and DELETE
+            **kwargs: Passed to requests.Session.request
+
+        Returns:
+            The final requests.Response (which may still be an error response)
+
+        Raises:
+            requests.RequestException: if the request could not be completed
+        """
+        kwargs.setdefault('timeout', self._timeout(endpoint))
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else UNPROCESSED_STATUS_CODES
+
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError as e:
+                # A connection dropped after sending may have been processed by Divar,
+                # so only requests that failed to connect are resent unless idempotent
+                should_retry = (idempotent or _failed_to_connect(e)) and not is_last
+                self._record(endpoint, time.monotonic() - start, failed=True, retried=should_retry)
+                if not should_retry:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            except requests.RequestException:
+                self._record(endpoint, time.monotonic() - start, failed=True)
+                raise
+
+            should_retry = response.status_code in retry_status_codes and not is_last
+            self._record(
+                endpoint,
+                time.monotonic() - start,
+                failed=response.status_code >= 400,
+                retried=should_retry
+            )
+            if not should_retry:
+                return response
+
+            time.sleep(self._backoff(attempt, response))
+
+    def get(self, url: str, endpoint: str = 'default', **kwargs) -> requests.Response:
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str = 'default', **kwargs) -> requests.Response:
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+
+# Global Divar client instance
+_divar_client = None
+_divar_client_lock = threading.Lock()
+
+def get_divar_client() -> DivarClient:
+    """
+    Get or create the global Divar client instance
+
+    Returns:
+        DivarClient instance
+    """
+    global _divar_client
+    if _divar_client is None:
+        with _divar_client_lock:
+            if _divar_client is None:
+                _divar_client = DivarClient()
+    return _divar_client
@@ -110,6 +110,23 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', '5432'),
     }
 }
+# Cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'data-line',
+    },
+    # Chatbot rate limit buckets; shared across processes when REDIS_URL is set
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'data-line-ratelimit',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -221,10 +238,109 @@ DIVAR_COMPLETION_URL = 'https://open-platform-redirect.divar.ir/completion'
 DIVAR_CHAT_API_URL = 'https://open-api.divar.ir/experimental/open-platform/chatbot-conversations/{conversation_id}/messages'
 DIVAR_AUTHORIZATION_TOKEN = os.getenv('DIVAR_AUTHORIZATION_TOKEN', 'your-divar-authorization-token-here')
 
+# Shared Divar API client (data_line/divar_client.py)
+DIVAR_CLIENT_POOL_SIZE = int(os.getenv('DIVAR_CLIENT_POOL_SIZE', '16'))  # keep-alive connections per process
+DIVAR_CLIENT_MAX_RETRIES = 2  # extra attempts on 429, failed connects, and 5xx of idempotent requests
+DIVAR_CLIENT_BACKOFF_BASE = 0.5  # seconds
+DIVAR_CLIENT_BACKOFF_MAX = 5.0  # seconds
+# (connect, read) timeouts in seconds per endpoint
+DIVAR_CLIENT_TIMEOUTS = {
+    'default': (3.05, 15),
+    'oauth_token': (3.05, 10),
+    'user_info': (3.05, 10),
+    'chat_message': (3.05, 10),
+    'chat_user_message': (3.05, 15),
+    'post_addon': (3.05, 30),
+}
+
 # Aval AI API Configuration
 AVAL_AI_BASE_URL = 'https://api.avalai.ir/v1'
 AVAL_AI_API_KEY = os.getenv('AVAL_AI_API_KEY', '')
 
+# Khodroyar chatbot background processing
+# When enabled, the chat webhook only stores the message and queues a job;
+# replies are generated by `python manage.py run_khodroyar_worker`
+KHODROYAR_ASYNC_WEBHOOK = os.getenv('KHODROYAR_ASYNC_WEBHOOK', 'False') == 'True'
+KHODROYAR_WORKER_CONCURRENCY = int(os.getenv('KHODROYAR_WORKER_CONCURRENCY', '8'))
+KHODROYAR_WORKER_POLL_INTERVAL = float(os.getenv('KHODROYAR_WORKER_POLL_INTERVAL', '0.5'))  # seconds
+KHODROYAR_CHAT_JOB_MAX_ATTEMPTS = 3
+KHODROYAR_CHAT_JOB_LOCK_TIMEOUT = 300  # seconds without a heartbeat before a running job is considered abandoned
+KHODROYAR_CHAT_JOB_HEARTBEAT = 30  # seconds between lock renewals of a running job
+# Messages of one conversation arriving within this window are answered as a single turn
+KHODROYAR_COALESCE_WINDOW = float(os.getenv('KHODROYAR_COALESCE_WINDOW', '2.0'))  # seconds
+KHODROYAR_COALESCE_MAX_DELAY = 8.0  # seconds a turn may be postponed by new messages
+# Outbox of bot messages (khodroyar/outbox.py)
+KHODROYAR_OUTBOX_INLINE_DELIVERY = os.getenv('KHODROYAR_OUTBOX_INLINE_DELIVERY', 'True') == 'True'  # first attempt right after saving
+KHODROYAR_OUTBOX_BATCH_SIZE = 50
+KHODROYAR_OUTBOX_CONCURRENCY = int(os.getenv('KHODROYAR_OUTBOX_CONCURRENCY', '8'))  # delivery threads of run_khodroyar_worker
+KHODROYAR_OUTBOX_MAX_ATTEMPTS = 6
+KHODROYAR_OUTBOX_LOCK_TIMEOUT = 60  # seconds before a message being sent is considered abandoned
+# Concurrent Aval AI calls shared by all processes on the host (khodroyar/llm_limiter.py)
+KHODROYAR_LLM_MAX_CONCURRENCY = int(os.getenv('KHODROYAR_LLM_MAX_CONCURRENCY', '16'))
+KHODROYAR_LLM_WAIT_BUDGET = float(os.getenv('KHODROYAR_LLM_WAIT_BUDGET', '10'))  # seconds a call may wait before a "please wait" reply
+KHODROYAR_LLM_LOCK_DIR = os.getenv('KHODROYAR_LLM_LOCK_DIR', '/tmp/khodroyar-llm-slots')
+KHODROYAR_LLM_TIMEOUT = float(os.getenv('KHODROYAR_LLM_TIMEOUT', '60'))  # seconds per Aval AI request
+KHODROYAR_LLM_MAX_RETRIES = 1
+# Circuit breaker per Aval AI endpoint and model (khodroyar/circuit_breaker.py)
+KHODROYAR_LLM_BREAKER_WINDOW = 60  # seconds of calls the failure rate is measured over
+KHODROYAR_LLM_BREAKER_FAILURE_RATE = 0.5
+KHODROYAR_LLM_BREAKER_MIN_CALLS = 5
+KHODROYAR_LLM_BREAKER_OPEN_SECONDS = 30  # before a probe call is let through
+# Fire the next model when the first one has not answered within this many seconds (0 disables hedging)
+KHODROYAR_LLM_HEDGE_DELAY = float(os.getenv('KHODROYAR_LLM_HEDGE_DELAY', '0'))
+# LLM call telemetry (khodroyar/telemetry.py): usage of streamed calls and prices in USD per million tokens
+KHODROYAR_LLM_STREAM_USAGE = os.getenv('KHODROYAR_LLM_STREAM_USAGE', 'True') == 'True'
+KHODROYAR_LLM_PRICES = {
+    'gpt-4.1': {'prompt': 2.0, 'cached': 0.5, 'completion': 8.0},
+    'gpt-4.1-mini': {'prompt': 0.4, 'cached': 0.1, 'completion': 1.6},
+}
+KHODROYAR_POST_PAYMENT_MAX_ATTEMPTS = 6  # welcome message retries after a payment
+KHODROYAR_POST_PAYMENT_LOCK_TIMEOUT = 120  # seconds before a running welcome message job is considered abandoned
+# First welcome message attempt on a thread of the web process, so it is sent without run_khodroyar_worker
+KHODROYAR_POST_PAYMENT_INLINE_DELIVERY = os.getenv('KHODROYAR_POST_PAYMENT_INLINE_DELIVERY', 'True') == 'True'
+KHODROYAR_BULK_MESSAGE_CONCURRENCY = 8  # concurrent Divar calls of an admin bulk messaging job
+KHODROYAR_BULK_MESSAGE_HEARTBEAT = 10  # seconds between progress saves of a running bulk job
+KHODROYAR_BULK_MESSAGE_LOCK_TIMEOUT = 120  # seconds without a progress save before a running bulk job is considered abandoned
+# Run admin bulk messaging jobs on a thread of the web process instead of run_khodroyar_worker
+# (a job is cut short when its web worker is recycled)
+KHODROYAR_BULK_MESSAGE_INLINE = os.getenv('KHODROYAR_BULK_MESSAGE_INLINE', 'False') == 'True'
+# Send replies to Divar sentence by sentence while the model is still generating
+KHODROYAR_STREAM_REPLIES = os.getenv('KHODROYAR_STREAM_REPLIES', 'False') == 'True'
+KHODROYAR_STREAM_MIN_CHARS = 60  # shortest piece sent as its own message
+# Model tiers of the AI agent (khodroyar/model_router.py): small talk goes to the fast model
+KHODROYAR_PRIMARY_MODEL = os.getenv('KHODROYAR_PRIMARY_MODEL', 'gpt-4.1')
+KHODROYAR_FAST_MODEL = os.getenv('KHODROYAR_FAST_MODEL', 'gpt-4.1-mini')
+KHODROYAR_FALLBACK_MODEL = os.getenv('KHODROYAR_FALLBACK_MODEL', '')  # tried after the primary model, if set
+KHODROYAR_MODEL_ROUTING_ENABLED = os.getenv('KHODROYAR_MODEL_ROUTING_ENABLED', 'True') == 'True'
+KHODROYAR_FAST_MODEL_MAX_CHARS = 40  # longer messages always go to the primary model
+# Rules answering greetings, subscription end and new car price questions without the model (khodroyar/intent_router.py)
+KHODROYAR_INTENT_ROUTER_ENABLED = os.getenv('KHODROYAR_INTENT_ROUTER_ENABLED', 'True') == 'True'
+# Tool calling in the AI agent: rounds of tool calls per reply and tools run in parallel
+KHODROYAR_MAX_TOOL_ROUNDS = 3
+KHODROYAR_TOOL_MAX_WORKERS = 4
+KHODROYAR_TOOL_ANSWER_TEMPLATES = True  # answer plain used car price questions from a template (khodroyar/tool_answers.py)
+# get_car_details result sent to the model (CarDetailsService.project_car_details)
+KHODROYAR_CAR_DETAILS_FIELDS = ['car_name', 'brand', 'technical_specs', 'advantages', 'disadvantages']
+KHODROYAR_CAR_DETAILS_MAX_CHARS = {'technical_specs': 1500, 'advantages': 700, 'disadvantages': 700}
+KHODROYAR_CAR_DETAILS_ALTERNATIVES = 4  # other matches, sent as names and scores only
+# Per-user token buckets on the chat webhook (khodroyar/rate_limit.py), keyed by plan code
+KHODROYAR_RATE_LIMIT_ENABLED = os.getenv('KHODROYAR_RATE_LIMIT_ENABLED', 'True') == 'True'
+KHODROYAR_RATE_LIMIT_CACHE = 'ratelimit'
+KHODROYAR_RATE_LIMITS = {
+    'default': {'capacity': 5, 'refill_per_minute': 6},  # no active subscription or unknown plan
+    'golden': {'capacity': 8, 'refill_per_minute': 10},
+    'diamond': {'capacity': 15, 'refill_per_minute': 20},
+}
+# Token budget of the conversation history sent to the model (khodroyar/tokens.py);
+# counted with tiktoken when it is installed, otherwise approximated
+KHODROYAR_HISTORY_MAX_TOKENS = int(os.getenv('KHODROYAR_HISTORY_MAX_TOKENS', '3000'))
+# Rolling summary of the messages that fall out of the history window (khodroyar/summary.py)
+KHODROYAR_SUMMARY_ENABLED = os.getenv('KHODROYAR_SUMMARY_ENABLED', 'True') == 'True'
+KHODROYAR_SUMMARY_MODEL = os.getenv('KHODROYAR_SUMMARY_MODEL', 'gpt-4.1-mini')
+KHODROYAR_SUMMARY_MAX_TOKENS = 500
+# Paste the whole new car price list into the system prompt instead of using the price search functions (legacy)
+KHODROYAR_PROMPT_INCLUDE_PRICE_LIST = os.getenv('KHODROYAR_PROMPT_INCLUDE_PRICE_LIST', 'False') == 'True'
+
 AWS_DEFAULT_ACL = 'public-read'
 AWS_S3_FILE_OVERWRITE = False
 AWS_QUERYSTRING_AUTH = False
@@ -0,0 +1,56 @@
+from unittest import mock
+import requests
+from django.test import SimpleTestCase, override_settings
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from data_line.divar_client import DivarClient
+
+
+def response(status_code):
+    result = requests.Response()
+    result.status_code = status_code
+    return result
+
+
+def connection_refused():
+    reason = NewConnectionError(None, 'Connection refused')
+    return requests.ConnectionError(MaxRetryError(None, 'https://open-api.divar.ir', reason))
+
+
+@override_settings(DIVAR_CLIENT_MAX_RETRIES=2, DIVAR_CLIENT_BACKOFF_BASE=0, DIVAR_CLIENT_BACKOFF_MAX=0)
+class DivarClientRetryTests(SimpleTestCase):
+    def setUp(self):
+        self.client = DivarClient()
+        patcher = mock.patch.object(self.client.session, 'request')
+        self.session_request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_is_retried_on_server_errors(self):
+        self.session_request.side_effect = [response(502), response(200)]
+        self.assertEqual(self.client.get('https://open-api.divar.ir/v1').status_code, 200)
+        self.assertEqual(self.session_request.call_count, 2)
+
+    def test_post_is_not_retried_on_server_errors(self):
+        self.session_request.return_value = response(502)
+        self.assertEqual(self.client.post('https://open-api.divar.ir/v1', endpoint='chat_message').status_code, 502)
+        self.assertEqual(self.session_request.call_count, 1)
+
+    def test_post_with_idempotency_key_is_retried_on_server_errors(self):
+        self.session_request.side_effect = [response(503), response(200)]
+        self.client.post('https://open-api.divar.ir/v1', idempotent=True)
+        self.assertEqual(self.session_request.call_count, 2)
+
+    def test_post_is_retried_when_rate_limited(self):
+        self.session_request.side_effect = [response(429), response(200)]
+        self.assertEqual(self.client.post('https://open-api.divar.ir/v1').status_code, 200)
+
+    def test_post_is_retried_when_the_connection_failed(self):
+        self.session_request.side_effect = [connection_refused(), requests.ConnectTimeout(), response(200)]
+        self.assertEqual(self.client.post('https://open-api.divar.ir/v1').status_code, 200)
+        self.assertEqual(self.session_request.call_count, 3)
+
+    def test_post_is_not_retried_when_the_connection_dropped_after_sending(self):
+        self.session_request.side_effect = requests.ConnectionError('Connection aborted.')
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post('https://open-api.divar.ir/v1', endpoint='chat_message')
+        self.assertEqual(self.session_request.call_count, 1)
+        self.assertEqual(self.client.stats()['chat_message']['retries'], 0)
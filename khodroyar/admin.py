@@ -5,9 +5,10 @@ from django.urls import path, reverse
 from django.shortcuts import render, get_object_or_404
 from django import forms
 from django.utils.html import format_html
-from .models import UserAuth, Conversation, Message, Payment
-from .views import send_welcome_message_after_payment, send_bot_message
-from .utils import to_shamsi_datetime_full
+from .models import UserAuth, Conversation, Message, Payment, ChatJob, OutgoingMessage, BulkMessageJob, PostPaymentJob, LLMUsageDaily
+from .views import send_bot_message
+from .bulk_messaging import create_bulk_message_job
+from django.utils import timezone
 from datetime import datetime
 
 # Register your models here.
@@ -19,104 +20,32 @@ class SendMessageForm(forms.Form):
         help_text='پیامی که برای کاربر ارسال خواهد شد'
     )
 
-# Mock Payment class for admin welcome messages
-class MockPayment:
-    def __init__(self, user_auth, amount=0, ref_id='ADMIN_WELCOME', subscription_start=None, subscription_end=None):
-        self.user_auth = user_auth
-        self.amount = amount
-        self.ref_id = ref_id
-        self.subscription_start = subscription_start
-        self.subscription_end = subscription_end
-
 @admin.register(UserAuth)
 class UserAuthAdmin(admin.ModelAdmin):
-    list_display = ['user_id', 'phone', 'created_at', 'updated_at']
-    list_filter = ['created_at', 'updated_at']
+    list_display = ['user_id', 'phone', 'subscription_plan_name', 'subscription_end', 'created_at', 'updated_at']
+    list_filter = ['has_subscription', 'created_at', 'updated_at']
     search_fields = ['user_id', 'phone']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = [
+        'has_subscription', 'subscription_end', 'subscription_plan',
+        'subscription_plan_name', 'subscription_days', 'created_at', 'updated_at'
+    ]
     
     actions = ['send_welcome_message']
     
     def send_welcome_message(self, request, queryset):
-        """Send welcome message to selected users"""
-        success_count = 0
-        error_count = 0
-        
-        # Default welcome message template
-        message_template = """🎉 تبریک! اشتراک خودرویار شما با موفقیت فعال شد!
-
-✅ پرداخت شما تایید شد
-💰 مبلغ: {amount:,} ریال
-📅 شروع اشتراک: {start_date}
-📅 پایان اشتراک: {end_date}
-🔢 شماره پیگیری: {ref_id}
-
-🚗 حالا می‌توانید از خدمات خودرویار استفاده کنید:
-• جستجوی خودرو
-• اطلاعات قیمت
-• مقایسه خودروها
-• راهنمای خرید
-
-برای شروع، پیام خود را بنویسید! (مثلا: سلام)"""
-        
-        for user_auth in queryset:
-            try:
-                # Get user's latest completed payment for formatting
-                latest_payment = Payment.objects.filter(
-                    user_auth=user_auth,
-                    status='completed'
-                ).order_by('-created_at').first()
-                
-                # Format message with payment data or use placeholders
-                if latest_payment:
-                    formatted_message = message_template.format(
-                        amount=latest_payment.amount,
-                        start_date=to_shamsi_datetime_full(latest_payment.subscription_start) if latest_payment.subscription_start else "نامشخص",
-                        end_date=to_shamsi_datetime_full(latest_payment.subscription_end) if latest_payment.subscription_end else "نامشخص",
-                        ref_id=latest_payment.ref_id or "نامشخص"
-                    )
-                else:
-                    # Use placeholder values if no payment exists
-                    formatted_message = message_template.format(
-                        amount=0,
-                        start_date="نامشخص",
-                        end_date="نامشخص",
-                        ref_id="ADMIN_WELCOME"
-                    )
-                
-                # Create a mock payment object for the welcome message function
-                mock_payment = MockPayment(
-                    user_auth=user_auth,
-                    amount=latest_payment.amount if latest_payment else 0,
-                    ref_id=latest_payment.ref_id if latest_payment else 'ADMIN_WELCOME',
-                    subscription_start=latest_payment.subscription_start if latest_payment else None,
-                    subscription_end=latest_payment.subscription_end if latest_payment else None
-                )
-                
-                # Send welcome message
-                if send_welcome_message_after_payment(user_auth, mock_payment):
-                    success_count += 1
-                else:
-                    error_count += 1
-            except Exception as e:
-                error_count += 1
-                print(f"Error sending welcome message to {user_auth.user_id}: {str(e)}")
-        
-        if success_count > 0:
-            self.message_user(
-                request,
-                f'پیام خوش‌آمدگویی با موفقیت برای {success_count} کاربر ارسال شد.',
-                messages.SUCCESS
-            )
-        
-        if error_count > 0:
-            self.message_user(
-                request,
-                f'خطا در ارسال پیام برای {error_count} کاربر.',
-                messages.ERROR
-            )
+        """Send welcome message to selected users in the background"""
+        job = create_bulk_message_job(
+            'welcome_message',
+            list(queryset.values_list('id', flat=True)),
+            created_by=request.user.get_username()
+        )
         
-        return HttpResponseRedirect(request.get_full_path())
+        self.message_user(
+            request,
+            f'ارسال پیام خوش‌آمدگویی به {job.total} کاربر در پس‌زمینه آغاز شد.',
+            messages.SUCCESS
+        )
+        return HttpResponseRedirect(reverse('admin:khodroyar_bulkmessagejob_progress', args=[job.id]))
     
     send_welcome_message.short_description = 'ارسال پیام خوش‌آمدگویی به کاربران انتخاب شده'
 
@@ -126,7 +55,7 @@ class ConversationAdmin(admin.ModelAdmin):
     list_display = ['conversation_id', 'user_auth', 'title', 'is_active', 'created_at', 'view_conversation_link']
     list_filter = ['is_active', 'created_at', 'updated_at']
     search_fields = ['conversation_id', 'title', 'user_auth__user_id']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['summary', 'summarized_message_id', 'summary_updated_at', 'created_at', 'updated_at']
     
     actions = ['view_conversation', 'send_message']
     
@@ -180,47 +109,20 @@ class ConversationAdmin(admin.ModelAdmin):
         if 'apply' in request.POST:
             form = SendMessageForm(request.POST)
             if form.is_valid():
-                message_content = form.cleaned_data['message']
-                success_count = 0
-                error_count = 0
-                
-                for conversation in queryset:
-                    try:
-                        # Send message using the conversation's user_auth and conversation_id
-                        if send_bot_message(conversation.user_auth, conversation.conversation_id, message_content):
-                            # Also save the message to our database
-                            Message.objects.create(
-                                conversation=conversation,
-                                message_type='bot',
-                                content=message_content,
-                                metadata={
-                                    'sent_at': datetime.now().isoformat(),
-                                    'timestamp': datetime.now().isoformat(),
-                                    'admin_sent': True
-                                }
-                            )
-                            success_count += 1
-                        else:
-                            error_count += 1
-                    except Exception as e:
-                        error_count += 1
-                        print(f"Error sending message to {conversation.conversation_id}: {str(e)}")
-                
-                if success_count > 0:
-                    self.message_user(
-                        request,
-                        f'پیام با موفقیت برای {success_count} مکالمه ارسال شد.',
-                        messages.SUCCESS
-                    )
-                
-                if error_count > 0:
-                    self.message_user(
-                        request,
-                        f'خطا در ارسال پیام برای {error_count} مکالمه.',
-                        messages.ERROR
-                    )
+                # Delivered by the background worker, see khodroyar/bulk_messaging.py
+                job = create_bulk_message_job(
+                    'conversation_message',
+                    list(queryset.values_list('id', flat=True)),
+                    message=form.cleaned_data['message'],
+                    created_by=request.user.get_username()
+                )
                 
-                return HttpResponseRedirect(request.get_full_path())
+                self.message_user(
+                    request,
+                    f'ارسال پیام به {job.total} مکالمه در پس‌زمینه آغاز شد.',
+                    messages.SUCCESS
+                )
+                return HttpResponseRedirect(reverse('admin:khodroyar_bulkmessagejob_progress', args=[job.id]))
         else:
             form = SendMessageForm()
         
@@ -333,6 +235,16 @@ class PaymentAdmin(admin.ModelAdmin):
     search_fields = ['user_auth__user_id', 'authority', 'ref_id']
     readonly_fields = ['created_at', 'updated_at']
     
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Keep the denormalized subscription on UserAuth current
+        obj.user_auth.refresh_subscription()
+    
+    def delete_model(self, request, obj):
+        user_auth = obj.user_auth
+        super().delete_model(request, obj)
+        user_auth.refresh_subscription()
+    
     fieldsets = (
         ('اطلاعات پرداخت', {
             'fields': ('user_auth', 'amount', 'status')
@@ -349,3 +261,127 @@ class PaymentAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(ChatJob)
+class ChatJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'status', 'attempts', 'available_at', 'created_at', 'updated_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['conversation__conversation_id', 'user_message__content']
+    readonly_fields = ['created_at', 'updated_at', 'locked_at']
+    raw_id_fields = ['conversation', 'user_message']
+
+
+@admin.register(PostPaymentJob)
+class PostPaymentJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'payment', 'status', 'attempts', 'available_at', 'conversation_id', 'created_at', 'updated_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['payment__user_auth__user_id', 'payment__ref_id', 'conversation_id']
+    readonly_fields = ['created_at', 'updated_at', 'locked_at']
+    raw_id_fields = ['payment']
+
+
+@admin.register(OutgoingMessage)
+class OutgoingMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'status', 'attempts', 'delivery_lag_display', 'latency_ms', 'last_status_code', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['conversation__conversation_id', 'message__content']
+    readonly_fields = ['created_at', 'updated_at', 'locked_at', 'sent_at', 'latency_ms', 'last_status_code']
+    raw_id_fields = ['conversation', 'message']
+    
+    actions = ['retry_delivery']
+    
+    def delivery_lag_display(self, obj):
+        """Seconds between queueing and delivery (or until now while undelivered)"""
+        return f"{obj.delivery_lag.total_seconds():.1f}s"
+    delivery_lag_display.short_description = 'تاخیر ارسال'
+    
+    def retry_delivery(self, request, queryset):
+        """Put failed messages back in the outbox queue"""
+        updated = queryset.filter(status='failed').update(
+            status='pending',
+            attempts=0,
+            available_at=timezone.now(),
+            locked_at=None
+        )
+        self.message_user(
+            request,
+            f'{updated} پیام برای ارسال مجدد در صف قرار گرفت.',
+            messages.SUCCESS
+        )
+    
+    retry_delivery.short_description = 'ارسال مجدد پیام‌های ناموفق'
+
+
+
+@admin.register(LLMUsageDaily)
+class LLMUsageDailyAdmin(admin.ModelAdmin):
+    list_display = [
+        'date', 'model', 'calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'tool_calls',
+        'avg_latency_display', 'avg_ttft_display', 'max_latency_ms', 'cost_display'
+    ]
+    list_filter = ['date', 'model']
+    date_hierarchy = 'date'
+    readonly_fields = [
+        'date', 'model', 'calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'tool_calls',
+        'total_latency_ms', 'total_ttft_ms', 'max_latency_ms', 'cost_usd', 'updated_at'
+    ]
+    
+    def has_add_permission(self, request):
+        # Rows are written by telemetry.record_llm_usage
+        return False
+    
+    def avg_latency_display(self, obj):
+        return f"{obj.avg_latency_ms}ms"
+    avg_latency_display.short_description = 'میانگین زمان پاسخ'
+    
+    def avg_ttft_display(self, obj):
+        return f"{obj.avg_ttft_ms}ms"
+    avg_ttft_display.short_description = 'میانگین زمان اولین توکن'
+    
+    def cost_display(self, obj):
+        return f"${obj.cost_usd:.4f}"
+    cost_display.short_description = 'هزینه تخمینی'
+
+
+@admin.register(BulkMessageJob)
+class BulkMessageJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'total', 'sent_count', 'failed_count', 'created_by', 'created_at', 'progress_link']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = [
+        'kind', 'message', 'target_ids', 'status', 'total', 'sent_count', 'failed_count',
+        'errors', 'created_by', 'started_at', 'finished_at', 'created_at', 'updated_at'
+    ]
+    
+    def has_add_permission(self, request):
+        # Jobs are created by the bulk messaging actions
+        return False
+    
+    def progress_link(self, obj):
+        url = reverse('admin:khodroyar_bulkmessagejob_progress', args=[obj.id])
+        return format_html('<a href="{}" class="button">📊 پیشرفت</a>', url)
+    progress_link.short_description = 'پیشرفت'
+    
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:job_id>/progress/',
+                self.admin_site.admin_view(self.progress_view),
+                name='khodroyar_bulkmessagejob_progress',
+            ),
+        ]
+        return custom_urls + urls
+    
+    def progress_view(self, request, job_id):
+        """Progress page of a bulk messaging job, refreshed while it runs"""
+        job = get_object_or_404(BulkMessageJob, id=job_id)
+        
+        context = {
+            'title': f'پیشرفت ارسال گروهی #{job.id}',
+            'job': job,
+            'is_running': job.status in ('pending', 'running'),
+            'opts': self.model._meta,
+        }
+        
+        return render(request, 'admin/khodroyar/bulkmessagejob/progress.html', context)
@@ -1,15 +1,29 @@
 import os
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
 import openai
 import jdatetime
 import pytz
 from django.conf import settings
 from .models import Conversation, Message
+from .context import recent_messages_queryset, history_to_chat_messages
 from .car_search import get_car_search_service
 from .car_details_service import get_car_details_service
+from .llm_limiter import get_llm_limiter, LLMOverloaded, OVERLOADED_MESSAGE
+from .streaming import SentenceChunker
+from .tokens import count_message_tokens, count_tokens
+from .tool_answers import render_tool_answer
+from .model_router import choose_model
+from .intent_router import route_intent
+from .circuit_breaker import CircuitOpen, get_circuit_breaker
+from .telemetry import build_llm_call
 
 # Configure logging for function calls
 logging.basicConfig(
@@ -21,6 +35,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger('khodroyar_function_calls')
 
+# Reply when the model still had no answer after the last allowed tool round
+TOOL_LIMIT_MESSAGE = "متأسفانه نتوانستم پاسخ کاملی آماده کنم. لطفاً سوال خود را دقیق‌تر بپرسید."
+
+
+def _is_upstream_failure(error: Exception) -> bool:
+    """Whether an API error means the Aval AI endpoint is failing (as opposed to a bad request)"""
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
 
 class KhodroyarAIAgent:
     """AI Agent for Khodroyar chatbot using Aval AI API with GPT-4.1"""
@@ -41,7 +67,9 @@ class KhodroyarAIAgent:
             # First try with minimal configuration
             self.client = openai.OpenAI(
                 api_key=self.api_key,
-                base_url=self.base_url
+                base_url=self.base_url,
+                timeout=settings.KHODROYAR_LLM_TIMEOUT,
+                max_retries=settings.KHODROYAR_LLM_MAX_RETRIES
             )
         except Exception as e:
             print(f"Failed to initialize OpenAI client with base_url: {e}")
@@ -51,29 +79,41 @@ class KhodroyarAIAgent:
             )
             print("Using standard OpenAI client as fallback")
         
+        # Rendered system prompt (without user context) and its (catalog version, date) key
+        self._system_prompt_cache = None
+        self._system_prompt_lock = threading.Lock()
+        
+        # Runs the tool calls of one model turn in parallel
+        self._tool_executor = ThreadPoolExecutor(
+            max_workers=settings.KHODROYAR_TOOL_MAX_WORKERS,
+            thread_name_prefix='khodroyar-tool'
+        )
+        # Runs the first model call and its hedge side by side (_hedged_completion)
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=settings.KHODROYAR_LLM_MAX_CONCURRENCY,
+            thread_name_prefix='khodroyar-hedge'
+        )
+        
     
-    def get_conversation_history(self, conversation: Conversation, max_messages: int = 50) -> List[Dict]:
+    def get_conversation_history(
+        self,
+        conversation: Conversation,
+        max_messages: int = 50,
+        exclude_message_ids: Optional[List[int]] = None
+    ) -> List[Dict]:
         """
         Get conversation history for context
         
         Args:
             conversation: Conversation object
             max_messages: Maximum number of recent messages to include
+            exclude_message_ids: Messages of the current turn, which are sent separately
             
         Returns:
             List of message dictionaries for AI context
         """
-        messages = conversation.messages.order_by('-created_at')[:max_messages]
-        history = []
-        
-        for message in reversed(messages):  # Reverse to get chronological order
-            role = "user" if message.message_type == "user" else "assistant"
-            history.append({
-                "role": role,
-                "content": message.content
-            })
-        
-        return history
+        messages = list(recent_messages_queryset(conversation, max_messages, exclude_message_ids))
+        return history_to_chat_messages(messages)
     
     def _get_current_shamsi_date(self) -> str:
         """
@@ -124,245 +164,914 @@ class KhodroyarAIAgent:
             print(f"Error getting current date: {str(e)}")
             return "تاریخ نامشخص"
     
+    def _get_functions(self) -> List[Dict]:
+        """
+        Get the function definitions exposed to the model
+        
+        Returns:
+            List of function schemas
+        """
+        return [
+            {
+                "name": "calculate_used_car_price",
+                "description": "Calculate used car price based on age, kilometers, and damages",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "base_price": {
+                            "type": "number",
+                            "description": "Original car price in tomans"
+                        },
+                        "car_age": {
+                            "type": "integer",
+                            "description": "Car age in years"
+                        },
+                        "car_kilometers": {
+                            "type": "integer",
+                            "description": "Total kilometers driven"
+                        },
+                        "damages": {
+                            "type": "array",
+                            "description": "List of car damages",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "type": {
+                                        "type": "string",
+                                        "enum": ["paint", "replacement", "body_replacement", "hood_replacement"],
+                                        "description": "Type of damage"
+                                    },
+                                    "part": {
+                                        "type": "string",
+                                        "description": "Part name"
+                                    },
+                                    "severity": {
+                                        "type": "string",
+                                        "enum": ["minor", "major"],
+                                        "description": "Severity for paint damage"
+                                    }
+                                },
+                                "required": ["type"]
+                            }
+                        }
+                    },
+                    "required": ["base_price", "car_age", "car_kilometers", "damages"]
+                }
+            },
+            {
+                "name": "get_car_details",
+                "description": "Get detailed information about a specific car model, including technical specifications, pros and cons using similarity search from car details database.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "car_name": {
+                            "type": "string",
+                            "description": "Full car name to search for (e.g., 'پژو 207', 'دنا پلاس', 'سورن پلاس', 'لاماری ایما')"
+                        }
+                    },
+                    "required": ["car_name"]
+                }
+            },
+            {
+                "name": "search_cars_by_budget",
+                "description": "Search the new car price list for cars within a budget range, optionally limited to some brands. Returns the cars closest to the top of the budget first.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "max_price": {
+                            "type": "integer",
+                            "description": "Maximum budget in tomans"
+                        },
+                        "min_price": {
+                            "type": "integer",
+                            "description": "Minimum price in tomans (e.g. about 80% of the budget to skip much cheaper cars)"
+                        },
+                        "brands": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Optional brand names to search in (e.g. 'ایران خودرو', 'سایپا', 'ام جی')"
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of cars to return (default 10)"
+                        }
+                    },
+                    "required": ["max_price"]
+                }
+            },
+            {
+                "name": "get_car_price",
+                "description": "Get the current new car price of a specific car model from the price list",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "car_name": {
+                            "type": "string",
+                            "description": "Car name to look up (e.g., 'پژو 207', 'دنا پلاس', 'شاهین')"
+                        }
+                    },
+                    "required": ["car_name"]
+                }
+            }
+        ]
+    
+    def _get_tools(self) -> List[Dict]:
+        """
+        Get the tool definitions exposed to the model
+        
+        Returns:
+            List of tool schemas for the chat completions tools API
+        """
+        return [{"type": "function", "function": function} for function in self._get_functions()]
+    
+    def _tool_choice(self, tool_rounds: int) -> str:
+        """Let the model call tools until KHODROYAR_MAX_TOOL_ROUNDS rounds were run, then require an answer"""
+        return "auto" if tool_rounds < settings.KHODROYAR_MAX_TOOL_ROUNDS else "none"
+    
+    def _assistant_tool_message(self, content: Optional[str], tool_calls) -> Dict:
+        """Assistant message carrying the tool calls of one round, to send back with their results"""
+        return {
+            "role": "assistant",
+            "content": content,
+            "tool_calls": [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments
+                    }
+                }
+                for tool_call in tool_calls
+            ]
+        }
+    
+    def _run_tool_call(self, tool_call, user_message: str, conversation: Conversation) -> Dict:
+        """
+        Run one tool call and build its tool message
+        
+        Failures are reported to the model as the tool result, so the other tool
+        calls of the round and the answer are not lost.
+        """
+        try:
+            result = self._execute_function_call(tool_call.function, user_message, conversation)
+            if result is None:
+                result = {"error": f"Function {tool_call.function.name} is not supported"}
+        except Exception as e:
+            result = {"error": f"Function {tool_call.function.name} failed: {str(e)}"}
+        
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": json.dumps(result, ensure_ascii=False)
+        }
+    
+    def _execute_tool_calls(self, tool_calls, user_message: str, conversation: Conversation) -> List[Dict]:
+        """
+        Run the tool calls of one model turn, in parallel when there are several
+        
+        Args:
+            tool_calls: Tool calls returned by the model
+            user_message: The user's message (for logging)
+            conversation: Conversation object (for logging)
+            
+        Returns:
+            Tool messages in the order of the calls
+        """
+        if len(tool_calls) == 1:
+            return [self._run_tool_call(tool_calls[0], user_message, conversation)]
+        
+        logger.info(f"Running {len(tool_calls)} tool calls in parallel")
+        return list(self._tool_executor.map(
+            lambda tool_call: self._run_tool_call(tool_call, user_message, conversation),
+            tool_calls
+        ))
+    
+    def _local_tool_answer(
+        self,
+        tool_calls,
+        tool_messages: List[Dict],
+        user_message: str,
+        metadata: Optional[Dict] = None
+    ) -> Optional[str]:
+        """
+        Answer from a template when the turn needs nothing but one tool result
+        
+        Saves the follow-up model call that would only rephrase the result
+        (see tool_answers.py).
+        
+        Returns:
+            The answer text, or None if the model has to write the answer
+        """
+        if not settings.KHODROYAR_TOOL_ANSWER_TEMPLATES or len(tool_calls) != 1:
+            return None
+        
+        tool_name = tool_calls[0].function.name
+        answer = render_tool_answer(
+            tool_name,
+            json.loads(tool_messages[0]['content']),
+            user_message,
+            self._get_current_shamsi_date()
+        )
+        if answer:
+            logger.info(f"Answered {tool_name} result from template without a follow-up model call")
+            if metadata is not None:
+                metadata['tool_answer_template'] = tool_name
+        return answer
+    
+    def _build_messages(
+        self,
+        user_message: str,
+        conversation_history: List[Dict],
+        user_context: Optional[Dict] = None,
+        metadata: Optional[Dict] = None,
+        summary: str = ''
+    ) -> List[Dict]:
+        """
+        Build the message list sent to the model
+        
+        Args:
+            user_message: The user's message
+            conversation_history: Previous messages from get_conversation_history
+            user_context: Additional user context (subscription info, etc.)
+            metadata: Bot message metadata; the size of the history sent is recorded in it
+            summary: Summary of the older part of the conversation, sent before the history
+            
+        Returns:
+            List of chat messages starting with the system prompt
+        """
+        history_tokens = count_message_tokens(conversation_history)
+        logger.info(f"History sent to model: {len(conversation_history)} messages, {history_tokens} tokens")
+        if metadata is not None:
+            metadata['history_messages'] = len(conversation_history)
+            metadata['history_tokens'] = history_tokens
+            if summary:
+                metadata['summary_tokens'] = count_tokens(summary)
+        
+        messages = [{"role": "system", "content": self._build_system_prompt(user_context)}]
+        if summary:
+            messages.append({"role": "system", "content": f"خلاصه بخش‌های قبلی این گفتگو:\n{summary}"})
+        messages.extend(conversation_history)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def _execute_function_call(self, function_call, user_message: str, conversation: Conversation) -> Optional[Dict]:
+        """
+        Run a function requested by the model
+        
+        Args:
+            function_call: Function of a tool call returned by the model (name and arguments)
+            user_message: The user's message (for logging)
+            conversation: Conversation object (for logging)
+            
+        Returns:
+            Function result dictionary, or None if the function is not supported
+        """
+        # Log function call attempt
+        logger.info(f"Function call requested: {function_call.name}")
+        logger.info(f"User message: {user_message}")
+        logger.info(f"Conversation ID: {conversation.id}")
+        
+        if function_call.name not in (
+            "calculate_used_car_price", "get_car_details", "search_cars_by_budget", "get_car_price"
+        ):
+            # Unknown function call
+            logger.warning(f"Unknown function call requested: {function_call.name}")
+            return None
+        
+        # Parse function arguments
+        function_args = json.loads(function_call.arguments)
+        
+        # Log function parameters
+        logger.info(f"Function parameters: {json.dumps(function_args, ensure_ascii=False, indent=2)}")
+        
+        try:
+            # Call the function
+            if function_call.name == "calculate_used_car_price":
+                return self.calculate_used_car_price(
+                    base_price=function_args["base_price"],
+                    car_age=function_args["car_age"],
+                    car_kilometers=function_args["car_kilometers"],
+                    damages=function_args["damages"]
+                )
+            
+            if function_call.name == "search_cars_by_budget":
+                return self.car_search_service.search_cars_by_budget(
+                    max_price=function_args["max_price"],
+                    min_price=function_args.get("min_price", 0),
+                    brands=function_args.get("brands"),
+                    limit=min(function_args.get("limit", 10), 20)
+                )
+            
+            if function_call.name == "get_car_price":
+                return self.car_search_service.get_car_price(
+                    car_name=function_args["car_name"]
+                )
+            
+            return self.car_details_service.get_car_details_for_model(
+                car_name=function_args["car_name"]
+            )
+            
+        except Exception as func_error:
+            logger.error(f"Function execution failed: {str(func_error)}")
+            raise func_error
+    
+    def _intent_answer(self, user_message: str, user_context: Optional[Dict], metadata: Optional[Dict] = None) -> Optional[str]:
+        """Answer the turn from the intent router rules, skipping the history and the model"""
+        routed = route_intent(user_message, user_context, self._get_current_shamsi_date())
+        if routed is None:
+            return None
+        
+        intent, answer = routed
+        logger.info(f"Turn answered by the intent router: {intent}")
+        if metadata is not None:
+            metadata['intent'] = intent
+        return answer
+    
+    def _route_models(self, user_message: str, metadata: Optional[Dict] = None) -> List[str]:
+        """
+        Models to try for a turn, the routed one first (see model_router.py)
+        
+        A turn routed to the fast model falls back to the primary model, and the
+        primary model to KHODROYAR_FALLBACK_MODEL when one is configured.
+        """
+        model, tier = choose_model(user_message)
+        logger.info(f"Turn routed to {tier} model {model}")
+        if metadata is not None:
+            metadata['model_tier'] = tier
+        
+        models = [model]
+        for fallback in (settings.KHODROYAR_PRIMARY_MODEL, settings.KHODROYAR_FALLBACK_MODEL):
+            if fallback and fallback not in models:
+                models.append(fallback)
+        return models
+    
+    def _record_model_call(
+        self,
+        metadata: Optional[Dict],
+        model: str,
+        elapsed: float,
+        response=None,
+        ttft: Optional[float] = None,
+        usage=None,
+        tool_names: Optional[List[str]] = None
+    ):
+        """
+        Add a finished model call to the bot message metadata
+        
+        Besides the per-turn totals, every call is kept in metadata['llm_calls']
+        (see telemetry.build_llm_call); a non-streamed response provides its own
+        usage and tool names.
+        """
+        if metadata is None:
+            return
+        if response is not None:
+            usage = response.usage
+            tool_names = [tool_call.function.name for tool_call in response.choices[0].message.tool_calls or []]
+        
+        metadata['model'] = model
+        metadata['model_calls'] = metadata.get('model_calls', 0) + 1
+        metadata['model_latency_ms'] = metadata.get('model_latency_ms', 0) + int(elapsed * 1000)
+        metadata.setdefault('llm_calls', []).append(build_llm_call(model, elapsed, ttft, usage, tool_names))
+    
+    def _observe_stream_event(self, event, start: float, telemetry: Dict):
+        """Collect time to first token, usage and tool names of a streamed call"""
+        if event.usage:
+            telemetry['usage'] = event.usage
+        if not event.choices:
+            return
+        delta = event.choices[0].delta
+        if telemetry['ttft'] is None and (delta.content or delta.tool_calls):
+            telemetry['ttft'] = time.monotonic() - start
+        for tool_call in delta.tool_calls or []:
+            if tool_call.function and tool_call.function.name:
+                telemetry['tool_names'].append(tool_call.function.name)
+    
+    @contextmanager
+    def _circuit(self, model: str):
+        """
+        Guard a call to `model` with its circuit breaker
+        
+        Raises:
+            CircuitOpen: if the breaker of the model is open
+        """
+        breaker = get_circuit_breaker(f"{self.base_url}|{model}")
+        if not breaker.allow_request():
+            raise CircuitOpen(f"Circuit breaker open for {model}")
+        
+        # None when the call never reached the upstream (shed or abandoned)
+        succeeded = None
+        try:
+            yield
+            succeeded = True
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            succeeded = not _is_upstream_failure(e)
+            raise
+        finally:
+            breaker.record(succeeded)
+    
+    def _create_completion(self, metadata: Optional[Dict] = None, **kwargs):
+        """
+        Call the chat completions API while holding a slot of the shared LLM limiter
+        
+        Args:
+            metadata: Bot message metadata the model and latency of the call are added to
+            
+        Raises:
+            LLMOverloaded: if no slot is free within the wait budget
+            CircuitOpen: if the circuit breaker of the model is open
+        """
+        with self._circuit(kwargs['model']), get_llm_limiter().slot():
+            start = time.monotonic()
+            response = self.client.chat.completions.create(**kwargs)
+            self._record_model_call(metadata, kwargs['model'], time.monotonic() - start, response)
+            return response
+    
+    def _stream_completion(self, metadata: Optional[Dict] = None, **kwargs) -> Iterator:
+        """
+        Stream a chat completion, holding the LLM limiter slot until the stream ends
+        
+        Yields:
+            Completion chunks as returned by the API
+        """
+        with self._circuit(kwargs['model']), get_llm_limiter().slot():
+            start = time.monotonic()
+            telemetry = {'ttft': None, 'usage': None, 'tool_names': []}
+            stream = self.client.chat.completions.create(stream=True, **self._stream_options(), **kwargs)
+            for event in stream:
+                self._observe_stream_event(event, start, telemetry)
+                yield event
+            self._record_model_call(metadata, kwargs['model'], time.monotonic() - start, **telemetry)
+    
+    def _first_stream_completion(self, models: List[str], metadata: Optional[Dict] = None, **kwargs) -> Iterator:
+        """
+        Stream a model call, trying the models in order until one sends its first chunk
+        
+        Once a chunk has arrived the stream stays with that model, since the
+        chunks may already be on their way to the user.
+        
+        Yields:
+            tuple: (model, completion chunk)
+        """
+        for index, model in enumerate(models):
+            started = False
+            try:
+                for event in self._stream_completion(metadata, model=model, **kwargs):
+                    started = True
+                    yield model, event
+                return
+            except LLMOverloaded:
+                raise
+            except Exception as model_error:
+                if started or index == len(models) - 1:
+                    raise
+                print(f"Failed with {model}: {model_error}")
+    
+    def _stream_options(self) -> Dict:
+        """Ask for token usage at the end of streamed completions, if the endpoint supports it"""
+        if not settings.KHODROYAR_LLM_STREAM_USAGE:
+            return {}
+        return {"stream_options": {"include_usage": True}}
+    
+    def _first_completion(self, models: List[str], metadata: Optional[Dict] = None, **kwargs):
+        """
+        Make the first model call of a turn
+        
+        The models are tried in order. With KHODROYAR_LLM_HEDGE_DELAY set, the
+        second model is instead fired alongside the first one when the first has
+        not answered within the delay (see _hedged_completion); the remaining
+        models are tried in order if both fail.
+        
+        Returns:
+            tuple: (response, model that produced it)
+        """
+        if settings.KHODROYAR_LLM_HEDGE_DELAY and len(models) > 1:
+            try:
+                return self._hedged_completion(models[0], models[1], metadata, **kwargs)
+            except LLMOverloaded:
+                raise
+            except Exception as hedge_error:
+                print(f"Failed with {models[0]} and {models[1]}: {hedge_error}")
+                models = models[2:]
+        
+        for model in models:
+            try:
+                response = self._create_completion(metadata, model=model, **kwargs)
+                print(f"Successfully used model: {model}")
+                return response, model
+            except LLMOverloaded:
+                raise
+            except Exception as model_error:
+                print(f"Failed with {model}: {model_error}")
+                continue
+        
+        raise Exception("All GPT models failed to respond")
+    
+    def _hedged_completion(self, model: str, hedge_model: str, metadata: Optional[Dict] = None, **kwargs):
+        """
+        Call `model`, and also `hedge_model` if no answer came within the hedge delay
+        
+        If `model` fails before the delay (e.g. its circuit breaker is open),
+        `hedge_model` is called right away, like the sequential fallback. The
+        first successful answer is used. A losing call cannot be cancelled and
+        finishes in the background; its result is discarded.
+        
+        Returns:
+            tuple: (response, model that produced it)
+        
+        Raises:
+            LLMOverloaded: if `model` was shed by the LLM limiter
+        """
+        start = time.monotonic()
+        futures = {self._hedge_executor.submit(self._create_completion, model=model, **kwargs): model}
+        done, _ = wait(futures, timeout=settings.KHODROYAR_LLM_HEDGE_DELAY)
+        if not done:
+            logger.info(f"No answer from {model} within {settings.KHODROYAR_LLM_HEDGE_DELAY}s, hedging with {hedge_model}")
+            if metadata is not None:
+                metadata['hedged'] = True
+            futures[self._hedge_executor.submit(self._create_completion, model=hedge_model, **kwargs)] = hedge_model
+        else:
+            first_error = next(iter(done)).exception()
+            if isinstance(first_error, LLMOverloaded):
+                raise first_error
+            if first_error is not None:
+                print(f"Failed with {model}: {first_error}")
+                logger.info(f"{model} failed before the hedge delay, falling back to {hedge_model}")
+                futures[self._hedge_executor.submit(self._create_completion, model=hedge_model, **kwargs)] = hedge_model
+        
+        error = None
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"Failed with {futures[future]}: {e}")
+                error = e
+                continue
+            self._record_model_call(metadata, futures[future], time.monotonic() - start, response)
+            print(f"Successfully used model: {futures[future]}")
+            return response, futures[future]
+        
+        raise error
+    
+    def _read_stream_event(self, event, chunker: SentenceChunker, tool_calls: Dict, content: List[str]) -> List[str]:
+        """
+        Handle one streamed completion chunk
+        
+        Text deltas are fed to the chunker and collected in `content`; tool call
+        deltas (id, name and argument fragments) are accumulated into
+        `tool_calls` by their index.
+        
+        Returns:
+            Chunks of text ready to be sent
+        """
+        if not event.choices:
+            return []
+        
+        delta = event.choices[0].delta
+        for tool_call in delta.tool_calls or []:
+            call = tool_calls.setdefault(tool_call.index, {'id': '', 'name': '', 'arguments': ''})
+            call['id'] += tool_call.id or ''
+            if tool_call.function:
+                call['name'] += tool_call.function.name or ''
+                call['arguments'] += tool_call.function.arguments or ''
+        if delta.content:
+            content.append(delta.content)
+            return chunker.feed(delta.content)
+        return []
+    
+    def _collect_stream_tool_calls(self, tool_calls: Dict) -> List:
+        """Turn tool calls accumulated by _read_stream_event into tool call objects"""
+        return [
+            SimpleNamespace(
+                id=call['id'],
+                function=SimpleNamespace(name=call['name'], arguments=call['arguments'])
+            )
+            for _, call in sorted(tool_calls.items())
+        ]
+    
+    def summarize_conversation(
+        self,
+        previous_summary: str,
+        messages: List[Message],
+        metadata: Optional[Dict] = None
+    ) -> str:
+        """
+        Fold messages into the running summary of a conversation
+        
+        Args:
+            previous_summary: Current summary (empty for the first fold)
+            messages: Messages to add, in chronological order
+            metadata: Dictionary the telemetry of the model call is added to
+            
+        Returns:
+            The updated summary
+        """
+        transcript = "\n".join(
+            f"{'کاربر' if message.message_type == 'user' else 'خودرویار'}: {message.content}"
+            for message in messages
+        )
+        response = self._create_completion(
+            metadata,
+            model=settings.KHODROYAR_SUMMARY_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "شما خلاصه‌نویس گفتگوهای ربات خودرویار هستید. خلاصه قبلی و ادامه گفتگو را در یک خلاصه کوتاه فارسی ادغام کنید. "
+                        "نیاز کاربر، بودجه، خودروهای مطرح‌شده و قیمت‌ها، مشخصات خودروی دست دوم و نتیجه‌گیری‌ها را نگه دارید "
+                        "و احوالپرسی و جزئیات غیرضروری را حذف کنید. فقط متن خلاصه را برگردانید."
+                    )
+                },
+                {
+                    "role": "user",
+                    "content": f"خلاصه قبلی:\n{previous_summary or '-'}\n\nادامه گفتگو:\n{transcript}"
+                }
+            ],
+            max_tokens=settings.KHODROYAR_SUMMARY_MAX_TOKENS,
+            temperature=0.2
+        )
+        return (response.choices[0].message.content or '').strip()
+    
+    def _log_error(self, e: Exception) -> str:
+        """Print error details and return the user facing error message"""
+        error_msg = f"متأسفانه مشکلی در پردازش پیام شما پیش آمد. لطفاً دوباره تلاش کنید."
+        print(f"AI Agent Error: {str(e)}")
+        print(f"Error type: {type(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return error_msg
+    
     def generate_response(
         self, 
         user_message: str, 
         conversation: Conversation,
-        user_context: Optional[Dict] = None
+        user_context: Optional[Dict] = None,
+        turn_message_ids: Optional[List[int]] = None,
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict] = None
     ) -> str:
         """
-        Generate AI response for user message using GPT-4.1 with function calling
+        Generate AI response for user message using GPT-4.1 with tool calling
+        
+        The model may request several tools per turn; they run in parallel and
+        their results go back in one follow-up request, for at most
+        KHODROYAR_MAX_TOOL_ROUNDS rounds.
         
         Args:
             user_message: The user's message
             conversation: Conversation object for context
             user_context: Additional user context (subscription info, etc.)
+            turn_message_ids: IDs of the stored user messages making up this turn
+            history: Preloaded conversation history; loaded from the database when omitted
+            metadata: Bot message metadata, filled with details of the call (history size)
             
         Returns:
             Generated AI response
         """
         try:
+            intent_answer = self._intent_answer(user_message, user_context, metadata)
+            if intent_answer:
+                return intent_answer
+            
             # Get conversation history
-            conversation_history = self.get_conversation_history(conversation)
+            conversation_history = history
+            if conversation_history is None:
+                conversation_history = self.get_conversation_history(
+                    conversation,
+                    exclude_message_ids=turn_message_ids
+                )
             
-            # Build system prompt
-            system_prompt = self._build_system_prompt(user_context)
+            # Prepare messages for AI
+            messages = self._build_messages(
+                user_message, conversation_history, user_context, metadata, summary=conversation.summary
+            )
+            tools = self._get_tools()
             
-            # Define available functions
-            functions = [
-                {
-                    "name": "calculate_used_car_price",
-                    "description": "Calculate used car price based on age, kilometers, and damages",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "base_price": {
-                                "type": "number",
-                                "description": "Original car price in tomans"
-                            },
-                            "car_age": {
-                                "type": "integer",
-                                "description": "Car age in years"
-                            },
-                            "car_kilometers": {
-                                "type": "integer",
-                                "description": "Total kilometers driven"
-                            },
-                            "damages": {
-                                "type": "array",
-                                "description": "List of car damages",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "type": {
-                                            "type": "string",
-                                            "enum": ["paint", "replacement", "body_replacement", "hood_replacement"],
-                                            "description": "Type of damage"
-                                        },
-                                        "part": {
-                                            "type": "string",
-                                            "description": "Part name"
-                                        },
-                                        "severity": {
-                                            "type": "string",
-                                            "enum": ["minor", "major"],
-                                            "description": "Severity for paint damage"
-                                        }
-                                    },
-                                    "required": ["type"]
-                                }
-                            }
-                        },
-                        "required": ["base_price", "car_age", "car_kilometers", "damages"]
-                    }
-                },
-                {
-                    "name": "get_car_details",
-                    "description": "Get detailed information about a specific car model, including technical specifications, pros and cons using similarity search from car details database.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "car_name": {
-                                "type": "string",
-                                "description": "Full car name to search for (e.g., 'پژو 207', 'دنا پلاس', 'سورن پلاس', 'لاماری ایما')"
-                            }
-                        },
-                        "required": ["car_name"]
-                    }
-                }
-            ]
+            # Try the routed model, then the primary model
+            gpt_models = self._route_models(user_message, metadata)
             
-            # Prepare messages for AI
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(conversation_history)
-            messages.append({"role": "user", "content": user_message})
+            response, used_model = self._first_completion(
+                gpt_models,
+                metadata,
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                max_tokens=16000,
+                temperature=0.7,
+                stream=False
+            )
             
-            # Try GPT-4.1 models in order of preference
-            gpt_models = [
-                "gpt-4.1",      # Primary GPT-4.1 model
-            ]
+            message = response.choices[0].message
+            tool_rounds = 0
+            while message.tool_calls and tool_rounds < settings.KHODROYAR_MAX_TOOL_ROUNDS:
+                tool_rounds += 1
+                messages.append(self._assistant_tool_message(message.content, message.tool_calls))
+                tool_messages = self._execute_tool_calls(message.tool_calls, user_message, conversation)
+                messages.extend(tool_messages)
+                
+                local_answer = self._local_tool_answer(message.tool_calls, tool_messages, user_message, metadata)
+                if local_answer:
+                    return local_answer
+                
+                # Get the next response with all tool results of this round
+                response = self._create_completion(
+                    metadata,
+                    model=used_model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice=self._tool_choice(tool_rounds),
+                    max_tokens=16000,
+                    temperature=0.7,
+                    stream=False
+                )
+                message = response.choices[0].message
             
-            response = None
-            used_model = None
+            if not tool_rounds:
+                logger.info("No tool call requested - direct response generated")
             
-            for model in gpt_models:
-                try:
-                    response = self.client.chat.completions.create(
-                        model=model,
-                        messages=messages,
-                        functions=functions,
-                        function_call="auto",
-                        max_tokens=16000,
-                        temperature=0.7,
-                        stream=False
-                    )
-                    
-                    used_model = model
-                    print(f"Successfully used model: {model}")
-                    break
-                    
-                except Exception as model_error:
-                    print(f"Failed with {model}: {model_error}")
-                    continue
+            return (message.content or '').strip() or TOOL_LIMIT_MESSAGE
             
-            if response is None:
-                raise Exception("All GPT models failed to respond")
+        except LLMOverloaded as e:
+            logger.warning(f"LLM call shed: {str(e)}")
+            return OVERLOADED_MESSAGE
+        except Exception as e:
+            return self._log_error(e)
+    
+    def generate_response_stream(
+        self,
+        user_message: str,
+        conversation: Conversation,
+        user_context: Optional[Dict] = None,
+        turn_message_ids: Optional[List[int]] = None,
+        history: Optional[List[Dict]] = None,
+        metadata: Optional[Dict] = None
+    ) -> Iterator[str]:
+        """
+        Generate the AI response as a stream of complete sentences or paragraphs
+        
+        Args:
+            user_message: The user's message
+            conversation: Conversation object for context
+            user_context: Additional user context (subscription info, etc.)
+            turn_message_ids: IDs of the stored user messages making up this turn
+            history: Preloaded conversation history; loaded from the database when omitted
+            metadata: Bot message metadata, filled with details of the call (history size)
+            
+        Yields:
+            Consecutive pieces of the response; joined together they form the full reply
+        """
+        chunker = SentenceChunker(settings.KHODROYAR_STREAM_MIN_CHARS)
+        produced = False
+        
+        try:
+            intent_answer = self._intent_answer(user_message, user_context, metadata)
+            if intent_answer:
+                yield intent_answer
+                return
+            
+            conversation_history = history
+            if conversation_history is None:
+                conversation_history = self.get_conversation_history(
+                    conversation,
+                    exclude_message_ids=turn_message_ids
+                )
             
-            # Check if function call was requested
-            if response.choices[0].message.function_call:
-                function_call = response.choices[0].message.function_call
+            messages = self._build_messages(
+                user_message, conversation_history, user_context, metadata, summary=conversation.summary
+            )
+            tools = self._get_tools()
+            models = self._route_models(user_message, metadata)
+            tool_rounds = 0
+            
+            while True:
+                content = []
+                tool_calls = {}
+                for model, event in self._first_stream_completion(
+                    models,
+                    metadata,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice=self._tool_choice(tool_rounds),
+                    max_tokens=16000,
+                    temperature=0.7
+                ):
+                    # Later rounds stay on the model that answered, like generate_response
+                    models = [model]
+                    for chunk in self._read_stream_event(event, chunker, tool_calls, content):
+                        produced = True
+                        yield chunk
                 
-                # Log function call attempt
-                logger.info(f"Function call requested: {function_call.name}")
-                logger.info(f"User message: {user_message}")
-                logger.info(f"Conversation ID: {conversation.id}")
+                if not tool_calls or tool_rounds >= settings.KHODROYAR_MAX_TOOL_ROUNDS:
+                    break
                 
-                if function_call.name == "calculate_used_car_price":
-                    # Parse function arguments
-                    function_args = json.loads(function_call.arguments)
-                    
-                    # Log function parameters
-                    logger.info(f"Function parameters: {json.dumps(function_args, ensure_ascii=False, indent=2)}")
-                    
-                    try:
-                        # Call the function
-                        result = self.calculate_used_car_price(
-                            base_price=function_args["base_price"],
-                            car_age=function_args["car_age"],
-                            car_kilometers=function_args["car_kilometers"],
-                            damages=function_args["damages"]
-                        )
-                        
-                    except Exception as func_error:
-                        logger.error(f"Function execution failed: {str(func_error)}")
-                        raise func_error
-                    
-                    # Add function result to messages
-                    messages.append({
-                        "role": "function",
-                        "name": "calculate_used_car_price",
-                        "content": json.dumps(result, ensure_ascii=False)
-                    })
-                    
-                    # Get final response from AI
-                    final_response = self.client.chat.completions.create(
-                        model=used_model,
-                        messages=messages,
-                        max_tokens=16000,
-                        temperature=0.7,
-                        stream=False
-                    )
-                    
-                    ai_response = final_response.choices[0].message.content.strip()
-                    
-                elif function_call.name == "get_car_details":
-                    # Parse function arguments
-                    function_args = json.loads(function_call.arguments)
-                    
-                    # Log function parameters
-                    logger.info(f"Function parameters: {json.dumps(function_args, ensure_ascii=False, indent=2)}")
-                    
-                    try:
-                        # Call the function
-                        result = self.car_details_service.get_car_details_and_pros_cons(
-                            car_name=function_args["car_name"]
-                        )
-                        
-                    except Exception as func_error:
-                        logger.error(f"Function execution failed: {str(func_error)}")
-                        raise func_error
-                    
-                    # Add function result to messages
-                    messages.append({
-                        "role": "function",
-                        "name": "get_car_details",
-                        "content": json.dumps(result, ensure_ascii=False)
-                    })
-                    
-                    # Get final response from AI
-                    final_response = self.client.chat.completions.create(
-                        model=used_model,
-                        messages=messages,
-                        max_tokens=16000,
-                        temperature=0.7,
-                        stream=False
-                    )
-                    
-                    ai_response = final_response.choices[0].message.content.strip()
-                    
-                else:
-                    # Unknown function call
-                    logger.warning(f"Unknown function call requested: {function_call.name}")
-                    ai_response = "متأسفانه تابع درخواستی پشتیبانی نمی‌شود."
-            else:
-                # No function call, get direct response
-                logger.info("No function call requested - direct response generated")
-                ai_response = response.choices[0].message.content.strip()
+                tool_rounds += 1
+                calls = self._collect_stream_tool_calls(tool_calls)
+                messages.append(self._assistant_tool_message(''.join(content) or None, calls))
+                tool_messages = self._execute_tool_calls(calls, user_message, conversation)
+                messages.extend(tool_messages)
+                
+                local_answer = self._local_tool_answer(calls, tool_messages, user_message, metadata)
+                if local_answer:
+                    for chunk in chunker.feed(local_answer):
+                        produced = True
+                        yield chunk
+                    break
             
-            return ai_response
+            if not tool_rounds:
+                logger.info("No tool call requested - direct response generated")
             
+            for chunk in chunker.flush():
+                produced = True
+                yield chunk
+            
+            # Never leave the user with an empty reply, like generate_response
+            if not produced:
+                yield TOOL_LIMIT_MESSAGE
+                
+        except LLMOverloaded as e:
+            logger.warning(f"LLM call shed: {str(e)}")
+            if not produced:
+                yield OVERLOADED_MESSAGE
         except Exception as e:
-            error_msg = f"متأسفانه مشکلی در پردازش پیام شما پیش آمد. لطفاً دوباره تلاش کنید."
-            print(f"AI Agent Error: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return error_msg
+            error_message = self._log_error(e)
+            # Keep a partially streamed answer rather than appending an error to it
+            if not produced:
+                yield error_message
     
     def _build_system_prompt(self, user_context: Optional[Dict] = None) -> str:
         """
         Build system prompt for the AI agent
         
+        The shared part is rendered once per catalog version and day (see
+        _get_base_system_prompt); only the user context is added per message.
+        
         Args:
             user_context: User context information
             
         Returns:
             System prompt string
         """
+        base_prompt = self._get_base_system_prompt()
         
+        # Add user context if available
+        if user_context:
+            context_info = []
+            if user_context.get('subscription_end'):
+                context_info.append(f"اشتراک کاربر تا {user_context['subscription_end']} فعال است")
+            if user_context.get('plan_name'):
+                context_info.append(f"نوع اشتراک: {user_context['plan_name']}")
+            
+            if context_info:
+                base_prompt += f"\n\nاطلاعات کاربر:\n" + "\n".join(context_info)
+        
+        return base_prompt
+    
+    def _get_base_system_prompt(self) -> str:
+        """
+        Get the system prompt without user context
+        
+        The rendered prompt is cached and rebuilt only when car_prices.json
+        changes or the date in Tehran rolls over.
+        """
+        self.car_search_service.refresh_if_changed()
+        key = (
+            self.car_search_service.catalog_version,
+            datetime.now(pytz.timezone('Asia/Tehran')).date()
+        )
+        
+        cached = self._system_prompt_cache
+        if cached and cached[0] == key:
+            return cached[1]
+        
+        with self._system_prompt_lock:
+            cached = self._system_prompt_cache
+            if not cached or cached[0] != key:
+                self._system_prompt_cache = (key, self._render_system_prompt())
+                logger.info(f"System prompt rebuilt for catalog version {key[0]} on {key[1]}")
+            return self._system_prompt_cache[1]
+    
+    def _render_system_prompt(self) -> str:
+        """Render the shared system prompt with the current date (and the full price list in legacy mode)"""
         # Get current date
         current_date = self._get_current_shamsi_date()
-        car_prices_info = self.car_search_service.get_car_prices_for_prompt()
+        
+        if settings.KHODROYAR_PROMPT_INCLUDE_PRICE_LIST:
+            # Legacy prompt carrying every new car price
+            price_source = "لیست بالا"
+            price_info = f"""اطلاعات قیمت خودروهای صفر:
+
+{self.car_search_service.get_car_prices_for_prompt()}"""
+        else:
+            price_source = "توابع search_cars_by_budget و get_car_price"
+            price_info = f"""برای اطلاعات قیمت خودروهای صفر:
+- قیمت‌ها در این پیام نیستند و همیشه باید از توابع زیر گرفته شوند، هرگز قیمتی را از خودتان حدس نزنید
+- برای پیشنهاد خودرو بر اساس بودجه از تابع search_cars_by_budget استفاده کنید (max_price همان بودجه کاربر و min_price حدود ۸۰ درصد آن)
+- اگر کاربر برند خاصی خواست، نام برند را در brands وارد کنید
+- برای قیمت یک خودروی مشخص از تابع get_car_price استفاده کنید
+- برندهای موجود در لیست قیمت: {'، '.join(self.car_search_service.brands)}"""
+        
         base_prompt = f"""شما ربات خودرویار هستید، یک دستیار هوشمند برای کمک به کاربران در زمینه انتخاب خودرو صفر و دست دوم جهت خرید بر اساس بودجه . 
 
 وظایف شما:
@@ -385,9 +1094,7 @@ class KhodroyarAIAgent:
 - در صورتی که از یک اسم چندین مدل خودرو وجود داشت مثل سورن از کاربر بپرسید که به دنبال کدام مدل هست
 - اگر به خودرویی اشاره کرد که در لیست قیمت صفر نیست نزدیک ترین خودرو رو به کاربر نشون بده و بپرس که این خودرو مد نظرشه یا نه
 
-اطلاعات قیمت خودروهای صفر:
-
-{car_prices_info}
+{price_info}
 
 برای محاسبه قیمت خودروهای دست دوم:
 - از تابع calculate_used_car_price استفاده کنید
@@ -396,7 +1103,7 @@ class KhodroyarAIAgent:
 - خروجی: قیمت نهایی
 
 نحوه استفاده از تابع calculate_used_car_price:
-1. قیمت پایه خودرو صفر را از لیست بالا پیدا کنید
+1. قیمت پایه خودرو صفر را از {price_source} پیدا کنید
 2.  سن خودرو (سال) را مشخص کنید
 3. کیلومتر خودرو را وارد کنید
 4. لیست آسیب‌ها را به صورت زیر تعریف کنید:
@@ -423,25 +1130,14 @@ class KhodroyarAIAgent:
 
 
 برای پاسخ به سوالات کاربر:
-- اگر کاربر بودجه خود را اعلام کرد، از اطلاعات قیمت بالا برای پیدا کردن خودروهای مناسب استفاده کنید
-- اگر کاربر قیمت خودروی خاصی را پرسید، از اطلاعات قیمت بالا برای پیدا کردن آن خودرو استفاده کنید
+- اگر کاربر بودجه خود را اعلام کرد، از {price_source} برای پیدا کردن خودروهای مناسب استفاده کنید
+- اگر کاربر قیمت خودروی خاصی را پرسید، از {price_source} برای پیدا کردن آن خودرو استفاده کنید
 - اگر کاربر درباره مشخصات، مزایا یا معایب خودروی خاصی سوال کرد، از تابع get_car_details استفاده کنید
-- اگر صفر خودرو تولید نمیشد و قیمتش رو در لیست بالا نداشتی نزدیک ترین خودرو رو انتخاب کن و ۱۰ درصد کمتر در نظر بگیر به عنوان قیمت صفر خودرو مذکور
+- اگر صفر خودرو تولید نمیشد و قیمتش رو در {price_source} نداشتی نزدیک ترین خودرو رو انتخاب کن و ۱۰ درصد کمتر در نظر بگیر به عنوان قیمت صفر خودرو مذکور
 - همیشه قیمت‌ها را به صورت فارسی و خوانا ارائه دهید (مثلاً ۱ میلیارد و ۵۰۰ میلیون تومان)
 - برای محاسبه قیمت خودروهای دست دوم، حتماً از تابع calculate_used_car_price استفاده کنید
 - قیمت نهایی را به صورت بازه ۵ درصد بالاتر و ۵ درصد پایین‌تر ارائه دهید
 - حین ارائه قیمت به کاربر تاریخ فعلی هم ذکر کن تاریخ فعلی:  {current_date} """ 
-
-        # Add user context if available
-        if user_context:
-            context_info = []
-            if user_context.get('subscription_end'):
-                context_info.append(f"اشتراک کاربر تا {user_context['subscription_end']} فعال است")
-            if user_context.get('plan_name'):
-                context_info.append(f"نوع اشتراک: {user_context['plan_name']}")
-            
-            if context_info:
-                base_prompt += f"\n\nاطلاعات کاربر:\n" + "\n".join(context_info)
         
         return base_prompt
     
@@ -454,11 +1150,11 @@ class KhodroyarAIAgent:
         """
         try:
             # Try GPT-4.1 first, then fallback to other models
-            gpt_models = ["gpt-4.1"]
+            gpt_models = [settings.KHODROYAR_PRIMARY_MODEL]
             
             for model in gpt_models:
                 try:
-                    response = self.client.chat.completions.create(
+                    response = self._create_completion(
                         model=model,
                         messages=[{"role": "user", "content": "سلام"}],
                         max_tokens=10
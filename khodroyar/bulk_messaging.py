@@ -0,0 +1,339 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import List, Optional
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import BulkMessageJob, Conversation, Message, Payment, UserAuth
+
+# Errors kept on a job for the progress page
+MAX_STORED_ERRORS = 50
+
+
+# Mock Payment class for admin welcome messages
+class MockPayment:
+    def __init__(self, user_auth, amount=0, ref_id='ADMIN_WELCOME', subscription_start=None, subscription_end=None):
+        self.user_auth = user_auth
+        self.amount = amount
+        self.ref_id = ref_id
+        self.subscription_start = subscription_start
+        self.subscription_end = subscription_end
+
+
+def create_bulk_message_job(kind: str, target_ids: List[int], message: str = '', created_by: str = '') -> BulkMessageJob:
+    """
+    Queue an admin bulk messaging action for the background worker
+
+    With KHODROYAR_BULK_MESSAGE_INLINE the job is started right away on a
+    thread of the calling (web) process instead, see start_bulk_message_job.
+
+    Args:
+        kind: 'conversation_message' or 'welcome_message'
+        target_ids: Conversation ids (conversation_message) or UserAuth ids (welcome_message)
+        message: Message text for conversation_message
+        created_by: Username of the admin who started the action
+
+    Returns:
+        The created BulkMessageJob
+    """
+    job = BulkMessageJob.objects.create(
+        kind=kind,
+        message=message,
+        target_ids=list(target_ids),
+        total=len(target_ids),
+        created_by=created_by
+    )
+    if settings.KHODROYAR_BULK_MESSAGE_INLINE:
+        transaction.on_commit(lambda: start_bulk_message_job(job))
+    return job
+
+
+def start_bulk_message_job(job: BulkMessageJob) -> bool:
+    """
+    Run a pending bulk messaging job on a new thread of the current process
+
+    Lets admin bulk actions work without run_khodroyar_worker. The job is
+    claimed with a conditional update, so a worker polling the same table
+    never runs it a second time.
+
+    Args:
+        job: Pending BulkMessageJob
+
+    Returns:
+        True if the job was claimed and started
+    """
+    now = timezone.now()
+    claimed = BulkMessageJob.objects.filter(id=job.id, status='pending').update(
+        status='running',
+        started_at=now,
+        updated_at=now
+    )
+    if not claimed:
+        return False
+
+    # The thread works on its own copy, the caller's object stays untouched
+    running_job = BulkMessageJob.objects.get(id=job.id)
+    threading.Thread(
+        target=_run_job_on_thread, args=(running_job,), daemon=True, name=f'khodroyar-bulk-{job.id}'
+    ).start()
+    return True
+
+
+def _run_job_on_thread(job: BulkMessageJob):
+    """Run a bulk messaging job on its own thread with its own database connection"""
+    close_old_connections()
+    try:
+        run_bulk_message_job(job)
+    finally:
+        close_old_connections()
+
+
+def claim_bulk_message_job() -> Optional[BulkMessageJob]:
+    """
+    Atomically claim the oldest pending bulk messaging job
+
+    A running job whose progress heartbeat stopped for longer than
+    KHODROYAR_BULK_MESSAGE_LOCK_TIMEOUT (its worker stopped) is marked as
+    failed instead of being claimed again, so recipients who were already
+    messaged do not get the message twice.
+
+    Returns:
+        The claimed BulkMessageJob (already marked as running), or None
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.KHODROYAR_BULK_MESSAGE_LOCK_TIMEOUT)
+    BulkMessageJob.objects.filter(status='running', updated_at__lt=stale_before).update(
+        status='failed',
+        finished_at=now,
+        updated_at=now
+    )
+
+    with transaction.atomic():
+        job = (
+            BulkMessageJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.started_at = now
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+
+    return job
+
+
+def run_bulk_message_job(job: BulkMessageJob):
+    """
+    Deliver a bulk messaging job with a bounded pool of concurrent senders
+
+    Progress is saved on the job while it runs, at least every
+    KHODROYAR_BULK_MESSAGE_HEARTBEAT seconds even when no delivery finished,
+    which keeps the job from being taken for abandoned. The Message rows of
+    the messages delivered since the last save are written with bulk_create
+    along with it, so a worker that stops mid-job leaves no delivered message
+    unrecorded for long. The final status is only written while the job is
+    still running.
+
+    Args:
+        job: BulkMessageJob returned by claim_bulk_message_job
+    """
+    try:
+        _deliver_bulk_message_job(job)
+    except Exception as e:
+        print(f"Bulk message job {job.id} failed: {str(e)}")
+        job.errors = (job.errors or [])[:MAX_STORED_ERRORS] + [{'recipient': '-', 'error': str(e)}]
+        _finish(job, 'failed')
+
+
+def _deliver_bulk_message_job(job: BulkMessageJob):
+    if job.kind == 'welcome_message':
+        recipients = _welcome_recipients(job.target_ids)
+        deliver = _deliver_welcome
+    else:
+        recipients = list(
+            Conversation.objects.filter(id__in=job.target_ids).select_related('user_auth')
+        )
+        deliver = _deliver_conversation_message
+
+    job.total = len(recipients)
+    job.sent_count = 0
+    job.failed_count = 0
+    job.errors = []
+    delivered = []
+    last_saved = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=settings.KHODROYAR_BULK_MESSAGE_CONCURRENCY) as executor:
+        futures = {executor.submit(_run_delivery, deliver, job, recipient): recipient for recipient in recipients}
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=settings.KHODROYAR_BULK_MESSAGE_HEARTBEAT, return_when=FIRST_COMPLETED)
+            for future in done:
+                recipient = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = None
+                    error = str(e)
+                else:
+                    error = 'Divar API rejected the message'
+
+                if result:
+                    job.sent_count += 1
+                    delivered.append(result)
+                else:
+                    job.failed_count += 1
+                    if len(job.errors) < MAX_STORED_ERRORS:
+                        job.errors.append({'recipient': _recipient_label(recipient), 'error': error})
+
+            # Also a heartbeat while slow deliveries are in flight
+            if time.monotonic() - last_saved >= 1:
+                _save_messages(job, delivered)
+                delivered = []
+                _save_progress(job)
+                last_saved = time.monotonic()
+
+    _save_messages(job, delivered)
+
+    if _finish(job, 'done'):
+        print(f"Bulk message job {job.id} finished: {job.sent_count} sent, {job.failed_count} failed")
+
+
+def _run_delivery(deliver, job, recipient):
+    """Run one delivery on a pool thread with its own database connection"""
+    close_old_connections()
+    try:
+        return deliver(job, recipient)
+    finally:
+        close_old_connections()
+
+
+def _recipient_label(recipient) -> str:
+    if isinstance(recipient, Conversation):
+        return recipient.conversation_id
+    return recipient.user_auth.user_id
+
+
+def _save_progress(job: BulkMessageJob):
+    job.save(update_fields=['total', 'sent_count', 'failed_count', 'errors', 'updated_at'])
+
+
+def _finish(job: BulkMessageJob, status: str) -> bool:
+    """
+    Save the final progress and mark a running job as `status`
+
+    Returns:
+        False if the job was no longer running (e.g. given up as stale), whose status is then kept
+    """
+    _save_progress(job)
+    now = timezone.now()
+    finished = BulkMessageJob.objects.filter(id=job.id, status='running').update(
+        status=status,
+        finished_at=now,
+        updated_at=now
+    )
+    if not finished:
+        print(f"Bulk message job {job.id} was no longer running, its status is kept")
+        return False
+
+    job.status = status
+    job.finished_at = now
+    return True
+
+
+def _deliver_conversation_message(job, conversation):
+    """Send the job message to one conversation; returns the Message to save, or None"""
+    # Imported here because the admin imports this module along with views
+    from .views import send_bot_message
+
+    if not send_bot_message(conversation.user_auth, conversation.conversation_id, job.message):
+        return None
+
+    return Message(
+        conversation=conversation,
+        message_type='bot',
+        content=job.message,
+        metadata={
+            'sent_at': datetime.now().isoformat(),
+            'timestamp': datetime.now().isoformat(),
+            'admin_sent': True,
+            'bulk_message_job_id': job.id
+        }
+    )
+
+
+def _welcome_recipients(user_auth_ids):
+    """Selected users with the payment their welcome message describes"""
+    latest_payments = {}
+    for payment in Payment.objects.filter(user_auth_id__in=user_auth_ids, status='completed').order_by('created_at'):
+        latest_payments[payment.user_auth_id] = payment
+
+    recipients = []
+    for user_auth in UserAuth.objects.filter(id__in=user_auth_ids):
+        latest_payment = latest_payments.get(user_auth.id)
+        recipients.append(MockPayment(
+            user_auth=user_auth,
+            amount=latest_payment.amount if latest_payment else 0,
+            ref_id=latest_payment.ref_id if latest_payment else 'ADMIN_WELCOME',
+            subscription_start=latest_payment.subscription_start if latest_payment else None,
+            subscription_end=latest_payment.subscription_end if latest_payment else None
+        ))
+    return recipients
+
+
+def _deliver_welcome(job, payment):
+    """Send the welcome message to one user; returns the Message to save (without conversation yet), or None"""
+    from .views import build_welcome_message, deliver_welcome_message, welcome_message_metadata
+
+    welcome_message = build_welcome_message(payment)
+    conversation_id = deliver_welcome_message(payment.user_auth, welcome_message)
+    if not conversation_id:
+        return None
+
+    message = Message(
+        message_type='bot',
+        content=welcome_message,
+        metadata={**welcome_message_metadata(payment, conversation_id), 'bulk_message_job_id': job.id}
+    )
+    message.user_auth = payment.user_auth
+    return message
+
+
+def _save_messages(job: BulkMessageJob, messages: List[Message]):
+    """Write the delivered messages (and new welcome conversations) in bulk"""
+    if not messages:
+        return
+
+    if job.kind == 'welcome_message':
+        conversation_ids = {message.metadata['conversation_id'] for message in messages}
+        conversations = {
+            conversation.conversation_id: conversation
+            for conversation in Conversation.objects.filter(conversation_id__in=conversation_ids)
+        }
+        new_conversations = []
+        for message in messages:
+            conversation_id = message.metadata['conversation_id']
+            if conversation_id not in conversations:
+                conversations[conversation_id] = Conversation(
+                    user_auth=message.user_auth,
+                    conversation_id=conversation_id,
+                    title='خودرویار - اشتراک جدید',
+                    is_active=True
+                )
+                new_conversations.append(conversations[conversation_id])
+        Conversation.objects.bulk_create(new_conversations, ignore_conflicts=True)
+
+        # Re-read so conversations created above (or concurrently) have their ids
+        conversations = {
+            conversation.conversation_id: conversation
+            for conversation in Conversation.objects.filter(conversation_id__in=conversation_ids)
+        }
+        for message in messages:
+            message.conversation = conversations[message.metadata['conversation_id']]
+
+    Message.objects.bulk_create(messages, batch_size=500)
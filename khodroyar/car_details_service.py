@@ -1,9 +1,12 @@
 import json
+import logging
 import os
 from typing import List, Dict, Optional
 from django.conf import settings
 from difflib import SequenceMatcher
 
+logger = logging.getLogger(__name__)
+
 
 class CarDetailsService:
     """Service for searching car details and pros/cons based on similarity"""
@@ -129,6 +132,76 @@ class CarDetailsService:
             'all_matches': matches[:5] if len(matches) > 1 else []  # Include top 5 matches for reference
         }
     
+    def get_car_details_for_model(self, car_name: str) -> Dict:
+        """
+        Get car details projected down to what the model needs
+        
+        Args:
+            car_name: The full car name to search for
+            
+        Returns:
+            Compact version of get_car_details_and_pros_cons (see project_car_details)
+        """
+        details = self.get_car_details_and_pros_cons(car_name)
+        projected = self.project_car_details(details)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            full_size = len(json.dumps(details, ensure_ascii=False).encode('utf-8'))
+            projected_size = len(json.dumps(projected, ensure_ascii=False).encode('utf-8'))
+            logger.debug("Car details projection for '%s': %s -> %s bytes", car_name, full_size, projected_size)
+        return projected
+    
+    def project_car_details(self, details: Dict) -> Dict:
+        """
+        Keep the configured fields of the best match, capped in length, and
+        only the names and scores of the alternatives
+        
+        Fields and caps come from KHODROYAR_CAR_DETAILS_FIELDS,
+        KHODROYAR_CAR_DETAILS_MAX_CHARS and KHODROYAR_CAR_DETAILS_ALTERNATIVES.
+        
+        Args:
+            details: Result of get_car_details_and_pros_cons
+            
+        Returns:
+            Projected details dictionary
+        """
+        if not details.get('found'):
+            return details
+        
+        max_chars = settings.KHODROYAR_CAR_DETAILS_MAX_CHARS
+        projected = {'found': True}
+        for field in settings.KHODROYAR_CAR_DETAILS_FIELDS:
+            value = details.get(field, '')
+            if isinstance(value, str) and field in max_chars:
+                value = self._truncate(value, max_chars[field])
+            projected[field] = value
+        projected['similarity_score'] = round(details.get('similarity_score', 0), 2)
+        
+        # all_matches starts with the best match itself
+        alternatives = details.get('all_matches', [])[1:settings.KHODROYAR_CAR_DETAILS_ALTERNATIVES + 1]
+        if alternatives:
+            projected['alternatives'] = [
+                {
+                    'car_name': car.get('full_car_name', ''),
+                    'similarity_score': round(car.get('similarity_score', 0), 2)
+                }
+                for car in alternatives
+            ]
+        return projected
+    
+    def _truncate(self, text: str, max_chars: int) -> str:
+        """
+        Cut a text to `max_chars`, at a line break in its last fifth when there
+        is one, so a break near the start does not throw most of the text away
+        """
+        if len(text) <= max_chars:
+            return text
+        cut = text[:max_chars]
+        line_break = cut.rfind('\n')
+        if line_break >= max_chars * 0.8:
+            cut = cut[:line_break]
+        return cut.rstrip() + ' …'
+    
     def _get_similar_car_names(self, car_name: str, limit: int = 5) -> List[str]:
         """
         Get similar car names for suggestions
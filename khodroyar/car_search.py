@@ -1,6 +1,8 @@
 import json
 import os
-from typing import List, Dict
+import threading
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Optional
 from django.conf import settings
 from difflib import SequenceMatcher
 
@@ -10,7 +12,201 @@ class CarSearchService:
     
     def __init__(self):
         """Initialize the car search service"""
-        self.cars_data = self._load_cars_data()
+        # Get the path to the JSON file in the khodroyar/data directory
+        self.json_file_path = os.path.join(settings.BASE_DIR, 'khodroyar', 'data', 'car_prices.json')
+        self._reload_lock = threading.Lock()
+        self.catalog_version = self._get_file_version()
+        self._set_cars_data(self._load_cars_data())
+    
+    def _get_file_version(self) -> str:
+        """Version of the price catalog on disk (modification time and size)"""
+        try:
+            stat = os.stat(self.json_file_path)
+            return f"{stat.st_mtime_ns}-{stat.st_size}"
+        except OSError:
+            return ''
+    
+    def refresh_if_changed(self) -> bool:
+        """
+        Reload the catalog if car_prices.json changed on disk
+        
+        Returns:
+            True if the catalog was reloaded
+        """
+        version = self._get_file_version()
+        if version == self.catalog_version:
+            return False
+        
+        with self._reload_lock:
+            if version != self.catalog_version:
+                self._set_cars_data(self._load_cars_data())
+                self.catalog_version = version
+        return True
+    
+    def _set_cars_data(self, cars_data: List[Dict]):
+        """
+        Replace the catalog and rebuild the price indexes
+        
+        Cars are kept sorted by current_price, overall and per brand, so budget
+        ranges are found with a binary search. The normalized full names are
+        kept for exact name lookups (find_cars_by_name).
+        """
+        cars_by_price = sorted(cars_data, key=lambda car: car['current_price'])
+        
+        brand_index = {}
+        for car in cars_by_price:
+            brand = car.get('brand', 'سایر')
+            cars, prices = brand_index.setdefault(self._normalize(brand), ([], []))
+            cars.append(car)
+            prices.append(car['current_price'])
+        
+        self._price_index = (cars_by_price, [car['current_price'] for car in cars_by_price])
+        self._brand_index = brand_index
+        self._name_index = [(self._normalize(car.get('full_car_name', '')), car) for car in cars_by_price]
+        self.brands = sorted({car.get('brand', 'سایر') for car in cars_data})
+        self.cars_data = cars_data
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """Normalize a Persian name for matching (Arabic letters, spaces and ZWNJ)"""
+        return (
+            text.replace('ي', 'ی').replace('ك', 'ک')
+            .replace('\u200c', '').replace(' ', '')
+            .strip().lower()
+        )
+    
+    def _match_brands(self, brands: List[str]) -> List[str]:
+        """Map brand names given by the model to normalized catalog brands"""
+        matched = []
+        for brand in brands:
+            normalized = self._normalize(brand)
+            if not normalized:
+                continue
+            if normalized in self._brand_index:
+                matched.append(normalized)
+                continue
+            # Partial names, e.g. 'ایران' for 'ایران خودرو'
+            matched.extend(key for key in self._brand_index if normalized in key or key in normalized)
+        return list(dict.fromkeys(matched))
+    
+    def search_cars_by_budget(
+        self,
+        max_price: int,
+        min_price: int = 0,
+        brands: Optional[List[str]] = None,
+        limit: int = 10
+    ) -> Dict:
+        """
+        Find new cars whose price falls within a budget range
+        
+        Args:
+            max_price: Upper bound of the budget in tomans
+            min_price: Lower bound of the budget in tomans
+            brands: Optional brand names to restrict the search to
+            limit: Maximum number of cars to return
+            
+        Returns:
+            Dictionary with the matching cars closest to the top of the budget
+            first, and the total number of matches
+        """
+        if brands:
+            indexes = [self._brand_index[brand] for brand in self._match_brands(brands)]
+            if not indexes:
+                return {
+                    'found': False,
+                    'message': 'برندی با این نام در لیست قیمت خودروهای صفر یافت نشد.',
+                    'available_brands': self.brands
+                }
+        else:
+            indexes = [self._price_index]
+        
+        matches = []
+        for cars, prices in indexes:
+            matches.extend(cars[bisect_left(prices, min_price):bisect_right(prices, max_price)])
+        matches.sort(key=lambda car: car['current_price'], reverse=True)
+        
+        if not matches:
+            return {
+                'found': False,
+                'message': 'خودروی صفری در این بازه قیمت یافت نشد.',
+                'total_matches': 0
+            }
+        
+        return {
+            'found': True,
+            'total_matches': len(matches),
+            'cars': [
+                {
+                    'name': car['full_car_name'],
+                    'brand': car.get('brand', ''),
+                    'price': car['current_price'],
+                    'price_formatted': self.format_price(car['current_price'])
+                }
+                for car in matches[:limit]
+            ]
+        }
+    
+    def get_car_price(self, car_name: str, limit: int = 3) -> Dict:
+        """
+        Look up the new-car price of a model by name
+        
+        Args:
+            car_name: Car name as written by the user or the model
+            limit: Maximum number of matching models to return
+            
+        Returns:
+            Dictionary with the best matching models and their prices
+        """
+        search_term = self._normalize(car_name or '')
+        if not search_term:
+            return {'found': False, 'message': 'نام خودرو مشخص نیست.'}
+        
+        scored = []
+        for car in self.cars_data:
+            full_name = self._normalize(car.get('full_car_name', ''))
+            score = SequenceMatcher(None, search_term, full_name).ratio()
+            if search_term in full_name:
+                score = max(score, 0.9)
+            if score >= 0.5:
+                scored.append((score, car))
+        
+        if not scored:
+            return {
+                'found': False,
+                'message': f'قیمت خودرو "{car_name}" در لیست قیمت خودروهای صفر یافت نشد.'
+            }
+        
+        scored.sort(key=lambda item: (item[0], -item[1]['current_price']), reverse=True)
+        return {
+            'found': True,
+            'cars': [
+                {
+                    'name': car['full_car_name'],
+                    'brand': car.get('brand', ''),
+                    'price': car['current_price'],
+                    'price_formatted': self.format_price(car['current_price'])
+                }
+                for _, car in scored[:limit]
+            ]
+        }
+    
+    def find_cars_by_name(self, car_name: str) -> List[Dict]:
+        """
+        Cars whose full name contains the given name, cheapest first
+        
+        Unlike get_car_price there is no fuzzy matching, so an empty result or
+        many results mean the name is unknown or ambiguous.
+        
+        Args:
+            car_name: Car name as written by the user
+            
+        Returns:
+            List of matching car dictionaries
+        """
+        search_term = self._normalize(car_name or '')
+        if not search_term:
+            return []
+        return [car for full_name, car in self._name_index if search_term in full_name]
     
     def _load_cars_data(self) -> List[Dict]:
         """
@@ -20,10 +216,7 @@ class CarSearchService:
             List of car dictionaries
         """
         try:
-            # Get the path to the JSON file in the khodroyar/data directory
-            json_file_path = os.path.join(settings.BASE_DIR, 'khodroyar', 'data', 'car_prices.json')
-            
-            with open(json_file_path, 'r', encoding='utf-8') as file:
+            with open(self.json_file_path, 'r', encoding='utf-8') as file:
                 data = json.load(file)
             
             # Extract cars from the new format
@@ -49,7 +242,7 @@ class CarSearchService:
             print(f"Error loading car data: {str(e)}")
             return []
     
-    def _format_price(self, price: int) -> str:
+    def format_price(self, price: int) -> str:
         """
         Format price in Persian/Farsi format
         
@@ -127,7 +320,7 @@ class CarSearchService:
                 cars.sort(key=lambda x: x['current_price'])
                 
                 for car in cars:
-                    price_formatted = self._format_price(car['current_price'])
+                    price_formatted = self.format_price(car['current_price'])
                     result += f"  • {car['full_car_name']}: {price_formatted}\n"
                 result += "\n"
             
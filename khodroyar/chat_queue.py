@@ -0,0 +1,250 @@
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import List
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, Max, OuterRef, Q
+from django.utils import timezone
+from .models import ChatJob, Conversation, Message
+from .context import load_conversation_context
+
+
+def enqueue_chat_job(conversation: Conversation, user_message: Message) -> ChatJob:
+    """
+    Queue a user message so that a background worker generates and delivers the reply
+
+    Messages arriving within the coalescing window of each other are merged into
+    the conversation's pending job, whose start is pushed back (debounced) up to
+    the maximum coalescing delay.
+
+    Args:
+        conversation: Conversation the message belongs to
+        user_message: The saved user Message
+
+    Returns:
+        The created or extended ChatJob
+    """
+    now = timezone.now()
+    window = timedelta(seconds=settings.KHODROYAR_COALESCE_WINDOW)
+    max_delay = timedelta(seconds=settings.KHODROYAR_COALESCE_MAX_DELAY)
+
+    with transaction.atomic():
+        # Serialize enqueues of the same conversation
+        Conversation.objects.select_for_update().filter(id=conversation.id).first()
+
+        pending_job = (
+            ChatJob.objects.select_for_update()
+            .filter(conversation=conversation, status='pending')
+            .order_by('id')
+            .first()
+        )
+
+        if pending_job:
+            pending_job.user_message = user_message
+            pending_job.available_at = min(now + window, pending_job.created_at + max_delay)
+            pending_job.save(update_fields=['user_message', 'available_at', 'updated_at'])
+            return pending_job
+
+        return ChatJob.objects.create(
+            conversation=conversation,
+            user_message=user_message,
+            available_at=now + window
+        )
+
+
+def claim_chat_jobs(limit: int) -> List[ChatJob]:
+    """
+    Atomically claim up to `limit` jobs that are ready to run
+
+    Pending jobs whose `available_at` has passed are claimed, as well as running
+    jobs whose worker stopped updating them for longer than the lock timeout.
+    A stale job that already used KHODROYAR_CHAT_JOB_MAX_ATTEMPTS (e.g. one
+    that crashes its worker every time) is marked as failed instead. Rows
+    locked by another worker are skipped instead of waited on, and at most one
+    job per conversation runs at a time so replies keep their order.
+
+    Args:
+        limit: Maximum number of jobs to claim
+
+    Returns:
+        List of claimed ChatJob objects (already marked as running)
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.KHODROYAR_CHAT_JOB_LOCK_TIMEOUT)
+    max_attempts = settings.KHODROYAR_CHAT_JOB_MAX_ATTEMPTS
+
+    ChatJob.objects.filter(status='running', locked_at__lt=stale_before, attempts__gte=max_attempts).update(
+        status='failed',
+        last_error='Worker stopped while processing the job',
+        updated_at=now
+    )
+
+    conversation_busy = ChatJob.objects.filter(
+        conversation=OuterRef('conversation'),
+        status='running',
+        locked_at__gte=stale_before
+    )
+
+    with transaction.atomic():
+        candidates = (
+            ChatJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', available_at__lte=now) |
+                Q(status='running', locked_at__lt=stale_before, attempts__lt=max_attempts)
+            )
+            .filter(~Exists(conversation_busy))
+            .order_by('available_at', 'id')[:limit]
+        )
+
+        jobs = []
+        conversation_ids = set()
+        for job in candidates:
+            if job.conversation_id in conversation_ids:
+                continue
+            conversation_ids.add(job.conversation_id)
+            jobs.append(job)
+
+        if jobs:
+            ChatJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                status='running',
+                locked_at=now,
+                attempts=F('attempts') + 1
+            )
+
+    # Re-read the claimed rows with their relations for processing
+    return list(
+        ChatJob.objects.filter(id__in=[job.id for job in jobs])
+        .select_related('conversation', 'user_message')
+        .order_by('available_at', 'id')
+    )
+
+
+def process_chat_job(job: ChatJob) -> bool:
+    """
+    Generate and deliver the bot reply for a claimed job
+
+    The job's lock is renewed while the reply is generated (see _heartbeat),
+    so a slow turn is not taken for abandoned and answered a second time.
+
+    Args:
+        job: ChatJob previously returned by claim_chat_jobs
+
+    Returns:
+        True if the job finished successfully, False otherwise
+    """
+    # Imported here because views enqueue jobs through this module
+    from .views import reply_to_message
+
+    turn_messages = get_unanswered_messages(job) or [job.user_message]
+    text = "\n".join(message.content for message in turn_messages)
+
+    try:
+        with _heartbeat(job):
+            context = load_conversation_context(job.conversation.conversation_id)
+            reply_to_message(
+                context,
+                text,
+                turn_message_ids=[message.id for message in turn_messages]
+            )
+    except Exception as e:
+        print(f"Chat job {job.id} failed (attempt {job.attempts}): {str(e)}")
+        _mark_failed(job, str(e))
+        return False
+
+    ChatJob.objects.filter(id=job.id).update(
+        status='done',
+        last_error='',
+        updated_at=timezone.now()
+    )
+    return True
+
+
+@contextmanager
+def _heartbeat(job: ChatJob):
+    """Renew the lock of a running job every KHODROYAR_CHAT_JOB_HEARTBEAT seconds while the block runs"""
+    stop = threading.Event()
+
+    def beat():
+        close_old_connections()
+        try:
+            while not stop.wait(settings.KHODROYAR_CHAT_JOB_HEARTBEAT):
+                ChatJob.objects.filter(id=job.id, status='running').update(locked_at=timezone.now())
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=beat, daemon=True, name=f'khodroyar-chat-job-{job.id}')
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def get_unanswered_messages(job: ChatJob) -> List[Message]:
+    """
+    Get the user messages a job answers as one merged turn
+
+    These are the user messages up to and including the job's latest message
+    that were neither covered by an earlier job nor followed by a bot message.
+
+    Args:
+        job: ChatJob being processed
+
+    Returns:
+        List of user Message objects in chronological order
+    """
+    previous_job_message = (
+        ChatJob.objects.filter(
+            conversation_id=job.conversation_id,
+            user_message_id__lt=job.user_message_id
+        )
+        .exclude(id=job.id)
+        .aggregate(last_id=Max('user_message_id'))['last_id']
+    )
+    last_bot_message = (
+        Message.objects.filter(
+            conversation_id=job.conversation_id,
+            message_type='bot',
+            id__lt=job.user_message_id
+        )
+        .aggregate(last_id=Max('id'))['last_id']
+    )
+
+    messages = Message.objects.filter(
+        conversation_id=job.conversation_id,
+        message_type='user',
+        id__lte=job.user_message_id
+    )
+    lower_bound = max(previous_job_message or 0, last_bot_message or 0)
+    if lower_bound:
+        messages = messages.filter(id__gt=lower_bound)
+
+    return list(messages.order_by('id'))
+
+
+def _mark_failed(job: ChatJob, error: str):
+    """Reschedule a failed job with backoff, or give up after the maximum attempts"""
+    now = timezone.now()
+
+    if job.attempts >= settings.KHODROYAR_CHAT_JOB_MAX_ATTEMPTS:
+        ChatJob.objects.filter(id=job.id).update(
+            status='failed',
+            last_error=error,
+            updated_at=now
+        )
+        return
+
+    # Back off 5s, 10s, 20s, ... between attempts
+    delay = 5 * (2 ** max(job.attempts - 1, 0))
+    ChatJob.objects.filter(id=job.id).update(
+        status='pending',
+        available_at=now + timedelta(seconds=delay),
+        locked_at=None,
+        last_error=error,
+        updated_at=now
+    )
@@ -0,0 +1,150 @@
+"""
+Circuit breakers for Aval AI (LLM) calls, one per endpoint and model.
+
+A breaker counts the outcomes of the calls of the last
+KHODROYAR_LLM_BREAKER_WINDOW seconds. Once at least
+KHODROYAR_LLM_BREAKER_MIN_CALLS calls were made and the failure rate reaches
+KHODROYAR_LLM_BREAKER_FAILURE_RATE, the breaker opens: calls fail right away
+with CircuitOpen, so the agent moves on to its next model instead of waiting
+for a timeout. After KHODROYAR_LLM_BREAKER_OPEN_SECONDS a single probe call is
+let through (half-open); its outcome closes or reopens the breaker.
+
+Breakers live in the memory of each process.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from django.conf import settings
+
+
+class CircuitOpen(Exception):
+    """Raised when a call is refused because its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with a half-open probe"""
+
+    def __init__(self, name: str, window: float, failure_rate: float, min_calls: int, open_seconds: float):
+        self.name = name
+        self.window = window
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        # (time, succeeded) of the calls within the window
+        self._results = deque()
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        Whether a call may be made now
+
+        In the half-open state only one probe call is allowed at a time; its
+        outcome must be reported with record().
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self.state = 'half_open'
+                self._probe_in_flight = False
+
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record(self, succeeded: Optional[bool]):
+        """
+        Report the outcome of an allowed call
+
+        Args:
+            succeeded: True or False, or None when the call did not reach the
+                upstream (e.g. it was shed locally) and says nothing about it
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+                if succeeded is None:
+                    return
+                if succeeded:
+                    self.state = 'closed'
+                    self._results.clear()
+                    print(f"Circuit breaker {self.name} closed")
+                else:
+                    self._open()
+                return
+
+            if succeeded is None or self.state == 'open':
+                return
+
+            now = time.monotonic()
+            self._results.append((now, succeeded))
+            while self._results and self._results[0][0] < now - self.window:
+                self._results.popleft()
+
+            failures = sum(1 for _, ok in self._results if not ok)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        print(f"Circuit breaker {self.name} opened")
+
+    def stats(self) -> Dict:
+        """
+        Current breaker state
+
+        Returns:
+            Dictionary with state, calls and failures within the window
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls': len(self._results),
+                'failures': sum(1 for _, ok in self._results if not ok),
+            }
+
+
+# Breakers of this process by name
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    Get or create the circuit breaker of an endpoint and model
+
+    Args:
+        name: Breaker name, e.g. "<base url>|<model>"
+
+    Returns:
+        CircuitBreaker instance
+    """
+    breaker = _circuit_breakers.get(name)
+    if breaker is None:
+        with _circuit_breakers_lock:
+            breaker = _circuit_breakers.get(name)
+            if breaker is None:
+                breaker = _circuit_breakers[name] = CircuitBreaker(
+                    name,
+                    window=settings.KHODROYAR_LLM_BREAKER_WINDOW,
+                    failure_rate=settings.KHODROYAR_LLM_BREAKER_FAILURE_RATE,
+                    min_calls=settings.KHODROYAR_LLM_BREAKER_MIN_CALLS,
+                    open_seconds=settings.KHODROYAR_LLM_BREAKER_OPEN_SECONDS
+                )
+    return breaker
+
+
+def circuit_breaker_stats() -> Dict:
+    """State of every circuit breaker of this process"""
+    return {name: breaker.stats() for name, breaker in list(_circuit_breakers.items())}
@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.utils import timezone
+from .models import Conversation, Message
+from .tokens import fit_history_to_budget
+from .utils import get_subscription_state, get_subscription_status
+
+
+def recent_messages_queryset(
+    conversation: Conversation,
+    max_messages: int = 50,
+    exclude_message_ids: Optional[List[int]] = None
+):
+    """
+    Queryset of the most recent messages of a conversation, newest first
+
+    Args:
+        conversation: Conversation object
+        max_messages: Maximum number of recent messages to include
+        exclude_message_ids: Messages of the current turn, which are sent separately
+
+    Returns:
+        Sliced Message queryset
+    """
+    messages = Message.objects.filter(conversation_id=conversation.id)
+    if conversation.summarized_message_id:
+        # Older messages are sent as the conversation summary
+        messages = messages.filter(id__gt=conversation.summarized_message_id)
+    if exclude_message_ids:
+        # Leave out the current turn and user messages queued after it
+        messages = messages.exclude(id__in=exclude_message_ids).exclude(
+            message_type='user',
+            id__gt=max(exclude_message_ids)
+        )
+    return messages.order_by('-created_at')[:max_messages]
+
+
+def history_to_chat_messages(messages: List[Message], max_tokens: Optional[int] = None) -> List[Dict]:
+    """
+    Convert messages (newest first) into chronological chat messages for the model
+
+    The newest messages are kept verbatim within the token budget and older
+    ones are trimmed first (see fit_history_to_budget).
+
+    Args:
+        messages: Message objects ordered newest first
+        max_tokens: Token budget of the history, KHODROYAR_HISTORY_MAX_TOKENS by default
+
+    Returns:
+        List of {"role", "content"} dictionaries
+    """
+    chat_messages = [
+        {
+            "role": "user" if message.message_type == "user" else "assistant",
+            "content": message.content
+        }
+        for message in reversed(messages)
+    ]
+    if max_tokens is None:
+        max_tokens = settings.KHODROYAR_HISTORY_MAX_TOKENS
+    return fit_history_to_budget(chat_messages, max_tokens)[0]
+
+
+class ConversationContext:
+    """
+    Everything the chat pipeline needs to answer one turn of a conversation
+
+    Built by load_conversation_context with a single query for the conversation
+    and its user, which carries the denormalized subscription; the history is
+    loaded with one more query once the current turn's messages are known.
+    """
+
+    def __init__(self, conversation: Conversation):
+        self.conversation = conversation
+        self.user_auth = conversation.user_auth
+        self.subscription = get_subscription_state(self.user_auth)
+        self.history = None
+
+    @property
+    def conversation_id(self) -> str:
+        return self.conversation.conversation_id
+
+    def subscription_status(self):
+        """
+        Returns:
+            tuple: (has_ended, message) as returned by check_subscription_status
+        """
+        return get_subscription_status(
+            self.subscription['has_subscription'],
+            self.subscription['subscription_end']
+        )
+
+    def user_context(self) -> Dict:
+        """
+        Build the AI agent user context for an active subscription
+
+        Returns:
+            Dictionary with subscription info, empty if there is no active subscription
+        """
+        subscription_end = self.subscription['subscription_end']
+        if not subscription_end or subscription_end <= timezone.now():
+            return {}
+
+        return {
+            'subscription_end': self.subscription['subscription_end_display'],
+            'plan_name': self.subscription['plan_name'] or 'اشتراک طلایی',
+            'subscription_days': self.subscription['subscription_days'] or 1
+        }
+
+    def load_history(self, exclude_message_ids: Optional[List[int]] = None, max_messages: int = 50) -> List[Dict]:
+        """Load the recent history for the model in one query"""
+        messages = list(recent_messages_queryset(self.conversation, max_messages, exclude_message_ids))
+        self.history = history_to_chat_messages(messages)
+        return self.history
+
+
+def load_conversation_context(conversation_id: str) -> Optional[ConversationContext]:
+    """
+    Load a conversation with its user and subscription in a single query
+
+    Args:
+        conversation_id: Divar conversation id
+
+    Returns:
+        ConversationContext, or None if the conversation does not exist
+    """
+    conversation = Conversation.objects.select_related('user_auth').filter(conversation_id=conversation_id).first()
+    return ConversationContext(conversation) if conversation else None
+
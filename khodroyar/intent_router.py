@@ -0,0 +1,164 @@
+"""
+Rules that answer common messages without the model.
+
+Plain greetings, questions about the end of the subscription and "price of X"
+for a car that the price catalog knows unambiguously are answered from
+templates. Everything else, including anything these rules are unsure about,
+returns None and goes to the model.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from .car_search import get_car_search_service
+from .tool_answers import NEEDS_MODEL_KEYWORDS
+
+GREETING_WORDS = {
+    'سلام', 'درود', 'علیک', 'وقت', 'روز', 'صبح', 'عصر', 'شب', 'به', 'بخیر', 'خیر', 'خسته', 'نباشید',
+    'hi', 'hello',
+}
+GREETING_REQUIRED_WORDS = {'سلام', 'درود', 'hi', 'hello'}
+GREETING_MAX_CHARS = 40
+
+GREETING_ANSWER = (
+    "سلام! 👋 من خودرویار هستم و در انتخاب خودرو و تخمین قیمت کنارتان هستم.\n"
+    "دنبال خودروی صفر هستید یا دست دوم؟"
+)
+
+SUBSCRIPTION_END_KEYWORDS = (
+    'تا کی', 'کی تموم', 'کی تمام', 'پایان', 'انقضا', 'اعتبار', 'مونده', 'باقی', 'تاریخ',
+)
+# Questions about buying or renewing are left to the model
+SUBSCRIPTION_SKIP_KEYWORDS = ('تمدید', 'خرید', 'بخرم', 'قیمت', 'هزینه')
+
+# Used car questions need a price calculation, not the catalog price
+USED_CAR_KEYWORDS = (
+    'کارکرد', 'کیلومتر', 'دست دوم', 'دسته دوم', 'تصادف', 'رنگ', 'مدل', 'سال', 'قسط', 'اقساط', 'وام',
+)
+
+_QUESTION_END = r'\s*(?:رو بگو|را بگو|رو بگید|را بگید|چنده|چند است|چنده است|چقدره|چقدر است|چیه|چی است|هست)?\s*[؟?!.]*'
+PRICE_PATTERNS = (
+    re.compile(r'^(?:قیمت|نرخ)\s+(?:روز\s+)?(?:خودرو\s+|ماشین\s+)?(?P<name>.+?)' + _QUESTION_END + r'$'),
+    re.compile(r'^(?P<name>.+?)\s+(?:قیمتش\s+|قیمت\s+)?(?:چنده|چند است|چقدره|چقدر است)\s*[؟?!.]*$'),
+)
+# A year in the message points to a used car
+_YEAR = re.compile(r'(?<!\d)(?:13|14|20)\d\d(?!\d)')
+
+# Names matching more trims than this are left to the model to ask which one
+MAX_PRICE_MATCHES = 4
+
+# Model year at the end of catalog names, e.g. "سایپا شاهین اتومات-1404"
+_MODEL_YEAR_SUFFIX = re.compile(r'\s*-\s*(\d{4})\s*$')
+
+PERSIAN_TO_ASCII_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+_WORD = re.compile(r'[^\W\d_]+')
+
+
+def _normalize(text: str) -> str:
+    return (
+        text.strip().lower()
+        .replace('ي', 'ی').replace('ك', 'ک')
+        .translate(PERSIAN_TO_ASCII_DIGITS)
+    )
+
+
+def answer_greeting(text: str) -> Optional[str]:
+    """Answer a message made only of greeting words"""
+    if len(text) > GREETING_MAX_CHARS or any(char.isdigit() for char in text):
+        return None
+    words = _WORD.findall(text)
+    if not words or not all(word in GREETING_WORDS for word in words):
+        return None
+    if not GREETING_REQUIRED_WORDS.intersection(words):
+        return None
+    return GREETING_ANSWER
+
+
+def answer_subscription_end(text: str, user_context: Optional[Dict]) -> Optional[str]:
+    """Answer a question about when the subscription ends"""
+    if 'اشتراک' not in text or not user_context or not user_context.get('subscription_end'):
+        return None
+    if not any(keyword in text for keyword in SUBSCRIPTION_END_KEYWORDS):
+        return None
+    if any(keyword in text for keyword in SUBSCRIPTION_SKIP_KEYWORDS):
+        return None
+    return (
+        f"📅 {user_context.get('plan_name') or 'اشتراک'} شما تا {user_context['subscription_end']} فعال است.\n"
+        f"تا آن زمان می‌توانید هر سوالی درباره خودرو دارید بپرسید."
+    )
+
+
+def _latest_model_years(cars: List[Dict]) -> List[Dict]:
+    """Keep only the newest model year of each trim, in catalog order"""
+    latest = {}
+    for car in cars:
+        match = _MODEL_YEAR_SUFFIX.search(car['full_car_name'])
+        trim = car['full_car_name'][:match.start()] if match else car['full_car_name']
+        year = int(match.group(1)) if match else 0
+        if trim not in latest or year > latest[trim][0]:
+            latest[trim] = (year, car)
+    kept = {id(car) for _, car in latest.values()}
+    return [car for car in cars if id(car) in kept]
+
+
+def answer_car_price(text: str, current_date: str) -> Optional[str]:
+    """Answer "price of X" for a car the price catalog matches unambiguously"""
+    if _YEAR.search(text) or any(keyword in f" {text} " for keyword in NEEDS_MODEL_KEYWORDS + USED_CAR_KEYWORDS):
+        return None
+
+    for pattern in PRICE_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            break
+    else:
+        return None
+
+    name = re.sub(r'\s+صفر$', '', match.group('name')).strip()
+    if len(_WORD.findall(name)) == 0:
+        return None
+
+    car_search = get_car_search_service()
+    cars = _latest_model_years(car_search.find_cars_by_name(name))
+    if not cars or len(cars) > MAX_PRICE_MATCHES:
+        return None
+
+    lines = [f"💰 قیمت خودروی صفر در تاریخ {current_date}:"]
+    lines.extend(f"• {car['full_car_name']}: {car_search.format_price(car['current_price'])}" for car in cars)
+    if len(cars) > 1:
+        lines.append("\nکدام مدل مد نظرتان است؟")
+    return "\n".join(lines)
+
+
+def route_intent(user_message: str, user_context: Optional[Dict], current_date: str) -> Optional[Tuple[str, str]]:
+    """
+    Answer a message from the rules when it clearly matches one of them
+
+    Args:
+        user_message: The user's message of the turn
+        user_context: User context of the agent (subscription info)
+        current_date: Current Shamsi date shown with prices
+
+    Returns:
+        tuple: (intent, answer), or None if the message needs the model
+    """
+    if not settings.KHODROYAR_INTENT_ROUTER_ENABLED:
+        return None
+
+    text = _normalize(user_message)
+    if not text or '\n' in text:
+        return None
+
+    answer = answer_greeting(text)
+    if answer:
+        return 'greeting', answer
+
+    answer = answer_subscription_end(text, user_context)
+    if answer:
+        return 'subscription_end', answer
+
+    answer = answer_car_price(text, current_date)
+    if answer:
+        return 'car_price', answer
+
+    return None
@@ -0,0 +1,195 @@
+"""
+Cross-process concurrency limiter for Aval AI (LLM) calls.
+
+Every web and worker process on the host shares a fixed number of slots,
+implemented as flock()ed files in KHODROYAR_LLM_LOCK_DIR. A call waiting for a
+slot registers itself as a locked waiter file, so the queue depth is visible to
+all processes. When the expected wait exceeds KHODROYAR_LLM_WAIT_BUDGET the
+call is shed right away with LLMOverloaded instead of piling up.
+"""
+
+import fcntl
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+from django.conf import settings
+
+# Message sent instead of an AI answer when the limiter sheds a call
+OVERLOADED_MESSAGE = "در حال حاضر درخواست‌های زیادی در حال پردازش است. لطفاً چند لحظه دیگر دوباره پیام دهید 🙏"
+
+
+class LLMOverloaded(Exception):
+    """Raised when no LLM slot can be obtained within the wait budget"""
+
+
+class LLMLimiter:
+    """File-lock based semaphore shared by all processes on the host"""
+
+    def __init__(self, max_concurrency: int, lock_dir: str, wait_budget: float, poll_interval: float = 0.05):
+        self.max_concurrency = max_concurrency
+        self.lock_dir = lock_dir
+        self.waiters_dir = os.path.join(lock_dir, 'waiters')
+        self.wait_budget = wait_budget
+        self.poll_interval = poll_interval
+        os.makedirs(self.waiters_dir, exist_ok=True)
+
+        # Moving average of how long a call holds its slot, measured in this process
+        self._avg_call_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _slot_path(self, index: int) -> str:
+        return os.path.join(self.lock_dir, f'slot-{index}.lock')
+
+    def _try_lock(self, path: str) -> Optional[int]:
+        """Open and exclusively lock a file without blocking; return the fd or None"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _try_acquire(self) -> Optional[int]:
+        """Take the first free slot, if any"""
+        # Start at a random slot so processes do not all contend on slot 0
+        offset = uuid.uuid4().int % self.max_concurrency
+        for i in range(self.max_concurrency):
+            fd = self._try_lock(self._slot_path((offset + i) % self.max_concurrency))
+            if fd is not None:
+                return fd
+        return None
+
+    def _release(self, fd: int, held_since: float):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+        elapsed = time.monotonic() - held_since
+        with self._stats_lock:
+            if self._avg_call_seconds:
+                self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * elapsed
+            else:
+                self._avg_call_seconds = elapsed
+
+    def _register_waiter(self):
+        """Create a locked waiter file; returns (fd, path)"""
+        path = os.path.join(self.waiters_dir, f'{os.getpid()}-{uuid.uuid4().hex}.lock')
+        fd = self._try_lock(path)
+        return fd, path
+
+    def _unregister_waiter(self, fd: int, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def queue_depth(self) -> int:
+        """Number of calls currently waiting for a slot, across all processes"""
+        depth = 0
+        for name in os.listdir(self.waiters_dir):
+            path = os.path.join(self.waiters_dir, name)
+            try:
+                fd = self._try_lock(path)
+            except FileNotFoundError:
+                continue
+            if fd is None:
+                depth += 1
+                continue
+            # Left behind by a process that died while waiting
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        return depth
+
+    def in_flight(self) -> int:
+        """Number of slots currently held, across all processes"""
+        held = 0
+        for i in range(self.max_concurrency):
+            fd = self._try_lock(self._slot_path(i))
+            if fd is None:
+                held += 1
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return held
+
+    def stats(self) -> Dict:
+        """
+        Current limiter state
+
+        Returns:
+            Dictionary with max_concurrency, in_flight, queue_depth, avg_call_seconds and wait_budget
+        """
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight(),
+            'queue_depth': self.queue_depth(),
+            'avg_call_seconds': round(self._avg_call_seconds, 3),
+            'wait_budget': self.wait_budget,
+        }
+
+    def _should_shed(self) -> bool:
+        """Whether the expected wait for a slot already exceeds the budget"""
+        if not self._avg_call_seconds:
+            return False
+        expected_wait = (self.queue_depth() + 1) / self.max_concurrency * self._avg_call_seconds
+        return expected_wait > self.wait_budget
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one LLM slot for the duration of the block
+
+        Raises:
+            LLMOverloaded: if the expected or actual wait exceeds the wait budget
+        """
+        fd = self._try_acquire()
+        if fd is None:
+            if self._should_shed():
+                raise LLMOverloaded("LLM queue is full")
+
+            waiter_fd, waiter_path = self._register_waiter()
+            deadline = time.monotonic() + self.wait_budget
+            try:
+                while fd is None:
+                    if time.monotonic() >= deadline:
+                        raise LLMOverloaded(f"No LLM slot within {self.wait_budget}s")
+                    time.sleep(self.poll_interval)
+                    fd = self._try_acquire()
+            finally:
+                self._unregister_waiter(waiter_fd, waiter_path)
+
+        held_since = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(fd, held_since)
+
+
+# Global limiter instance
+_llm_limiter = None
+_llm_limiter_lock = threading.Lock()
+
+def get_llm_limiter() -> LLMLimiter:
+    """
+    Get or create the global LLM limiter instance
+
+    Returns:
+        LLMLimiter instance
+    """
+    global _llm_limiter
+    if _llm_limiter is None:
+        with _llm_limiter_lock:
+            if _llm_limiter is None:
+                _llm_limiter = LLMLimiter(
+                    max_concurrency=settings.KHODROYAR_LLM_MAX_CONCURRENCY,
+                    lock_dir=settings.KHODROYAR_LLM_LOCK_DIR,
+                    wait_budget=settings.KHODROYAR_LLM_WAIT_BUDGET
+                )
+    return _llm_limiter
@@ -0,0 +1,121 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from khodroyar.replay import (
+    DEFAULT_FIXTURE_PATH, StubLLMServer, conversations_from_db, load_fixture, replay_conversations, summarize_replay
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay conversations through the Khodroyar AI agent against a local stub LLM server and report '
+        'prompt size, tool calls, latency percentiles and database queries per turn'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fixture',
+            default=str(DEFAULT_FIXTURE_PATH),
+            help='Fixture with the canned model responses and, unless --from-db is given, the conversations to replay'
+        )
+        parser.add_argument(
+            '--from-db',
+            action='store_true',
+            help='Replay the user messages of recorded conversations instead of the fixture conversations'
+        )
+        parser.add_argument(
+            '--conversation',
+            action='append',
+            dest='conversation_ids',
+            help='Divar conversation id to replay (implies --from-db, may be repeated)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=10,
+            help='Number of most recent recorded conversations replayed with --from-db'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.3,
+            help='Seconds the stub server waits before answering each model call'
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0.1,
+            help='Random +/- seconds added to the stub latency'
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            help='Use the streaming agent (generate_response_stream)'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the per-turn results and the summary as JSON to this file, e.g. to compare two runs'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fixture = load_fixture(options['fixture'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load fixture {options['fixture']}: {e}")
+
+        if options['from_db'] or options['conversation_ids']:
+            conversations = conversations_from_db(options['conversation_ids'], options['limit'])
+        else:
+            conversations = fixture['conversations']
+        if not conversations:
+            raise CommandError('No conversations to replay')
+
+        server = StubLLMServer(
+            fixture.get('responses', []),
+            default_content=fixture['default_content'],
+            summary_content=fixture['summary_content'],
+            latency=options['latency'],
+            jitter=options['jitter']
+        )
+        server.start()
+        self.stdout.write(
+            f"Replaying {sum(len(conversation['turns']) for conversation in conversations)} turns of "
+            f"{len(conversations)} conversations against {server.url}"
+        )
+        try:
+            results = replay_conversations(conversations, server, stream=options['stream'])
+        finally:
+            server.stop()
+
+        self.stdout.write(
+            f"\n{'conversation':<20} {'turn':<32} {'route':<16} {'calls':>5} {'prompt':>7} "
+            f"{'total':>7} {'tools':>5} {'ms':>7} {'queries':>7}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['conversation'][:20]:<20} {result['user_message'][:32]:<32} {result['route'][:16]:<16} "
+                f"{result['model_calls']:>5} {result['prompt_tokens']:>7} {result['total_prompt_tokens']:>7} "
+                f"{result['tool_calls']:>5} {result['latency_ms']:>7.0f} {result['db_queries']:>7}"
+            )
+
+        summary = summarize_replay(results)
+        latency = summary['latency_ms']
+        self.stdout.write(
+            f"\n{summary['turns']} turns: {summary['model_calls']} model calls, {summary['summary_calls']} summary calls, "
+            f"{summary['tool_calls']} tool calls, {summary['turns_without_model']} turns without the model"
+        )
+        self.stdout.write(
+            f"Prompt tokens per turn: {summary['avg_prompt_tokens']:.0f} first call, "
+            f"{summary['avg_total_prompt_tokens']:.0f} all calls"
+        )
+        self.stdout.write(
+            f"Latency: p50 {latency['p50']:.0f}ms, p90 {latency['p90']:.0f}ms, p95 {latency['p95']:.0f}ms, "
+            f"p99 {latency['p99']:.0f}ms, max {latency['max']:.0f}ms"
+        )
+        self.stdout.write(
+            f"Database queries per turn: avg {summary['avg_db_queries']:.1f}, max {summary['max_db_queries']}"
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'summary': summary, 'turns': results}, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
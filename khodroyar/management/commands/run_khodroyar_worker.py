@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from data_line.divar_client import get_divar_client
+from khodroyar.chat_queue import claim_chat_jobs, process_chat_job
+from khodroyar.outbox import claim_outgoing_messages, deliver_outgoing_message
+from khodroyar.post_payment import claim_post_payment_jobs, process_post_payment_job
+from khodroyar.bulk_messaging import claim_bulk_message_job, run_bulk_message_job
+
+
+class Command(BaseCommand):
+    help = 'Run the Khodroyar background worker pool that answers queued chat messages, sends post-payment welcome messages and drains the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.KHODROYAR_WORKER_CONCURRENCY,
+            help='Number of chat jobs processed concurrently'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.KHODROYAR_WORKER_POLL_INTERVAL,
+            help='Seconds to sleep when the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        poll_interval = options['poll_interval']
+        delivery_concurrency = settings.KHODROYAR_OUTBOX_CONCURRENCY
+        in_flight = set()
+        deliveries_in_flight = set()
+        bulk_in_flight = None
+
+        self.stdout.write(
+            f"Khodroyar worker started with {concurrency} threads and {delivery_concurrency} delivery threads"
+        )
+
+        # One extra thread for the bulk messaging job; outbox deliveries have their own
+        # pool so a claimed entry never waits behind chat jobs past its lock timeout
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as executor, \
+                ThreadPoolExecutor(max_workers=delivery_concurrency) as delivery_executor:
+            try:
+                while True:
+                    in_flight = {future for future in in_flight if not future.done()}
+                    deliveries_in_flight = {future for future in deliveries_in_flight if not future.done()}
+
+                    close_old_connections()
+                    jobs = claim_chat_jobs(concurrency - len(in_flight))
+                    for job in jobs:
+                        in_flight.add(executor.submit(self._run_job, job, process_chat_job))
+
+                    post_payment_jobs = claim_post_payment_jobs(concurrency - len(in_flight))
+                    for job in post_payment_jobs:
+                        in_flight.add(executor.submit(self._run_job, job, process_post_payment_job))
+
+                    # Only as many entries as there are free delivery threads are claimed
+                    outgoing_messages = claim_outgoing_messages(
+                        min(delivery_concurrency - len(deliveries_in_flight), settings.KHODROYAR_OUTBOX_BATCH_SIZE)
+                    )
+                    for outgoing in outgoing_messages:
+                        deliveries_in_flight.add(delivery_executor.submit(self._run_job, outgoing, deliver_outgoing_message))
+
+                    # Bulk messaging jobs run one at a time with their own sender pool
+                    bulk_job = None
+                    if bulk_in_flight is None or bulk_in_flight.done():
+                        bulk_job = claim_bulk_message_job()
+                        bulk_in_flight = executor.submit(self._run_job, bulk_job, run_bulk_message_job) if bulk_job else None
+
+                    if not jobs and not post_payment_jobs and not outgoing_messages and not bulk_job:
+                        time.sleep(poll_interval)
+            except KeyboardInterrupt:
+                self.stdout.write("Khodroyar worker stopping, waiting for running jobs...")
+
+        for endpoint, stats in get_divar_client().stats().items():
+            self.stdout.write(
+                f"Divar API {endpoint}: {stats['requests']} requests, {stats['errors']} errors, "
+                f"{stats['retries']} retries, avg {stats['avg_ms']:.0f}ms, max {stats['max_ms']:.0f}ms"
+            )
+
+    def _run_job(self, job, handler):
+        """Process a single queued job or outbox entry on a pool thread with its own database connection"""
+        close_old_connections()
+        try:
+            handler(job)
+        finally:
+            close_old_connections()
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0004_payment_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار پردازش'), ('running', 'در حال پردازش'), ('done', 'انجام شده'), ('failed', 'ناموفق')], db_index=True, default='pending', max_length=20, verbose_name='وضعیت')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان قابل پردازش')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع پردازش')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='آخرین خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='تاریخ ایجاد')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_jobs', to='khodroyar.conversation', verbose_name='مکالمه')),
+                ('user_message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_jobs', to='khodroyar.message', verbose_name='پیام کاربر')),
+            ],
+            options={
+                'verbose_name': 'کار پردازش پیام',
+                'verbose_name_plural': 'کارهای پردازش پیام',
+                'ordering': ['available_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='khodroyar_c_status_f9186d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+def backfill_divar_message_id(apps, schema_editor):
+    """Copy metadata['message_id'] into the new column, keeping the first copy of retried messages"""
+    Message = apps.get_model('khodroyar', 'Message')
+    seen = set()
+    for message in Message.objects.filter(message_type='user').order_by('id').iterator():
+        message_id = (message.metadata or {}).get('message_id')
+        if not message_id or message_id in seen:
+            continue
+        seen.add(message_id)
+        Message.objects.filter(id=message.id).update(divar_message_id=message_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0005_chatjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='divar_message_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='شناسه پیام دیوار'),
+        ),
+        migrations.RunPython(backfill_divar_message_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:21
+
+from django.db import migrations, models
+
+
+def backfill_subscriptions(apps, schema_editor):
+    """Copy each user's latest completed payment onto the new UserAuth fields"""
+    UserAuth = apps.get_model('khodroyar', 'UserAuth')
+    Payment = apps.get_model('khodroyar', 'Payment')
+    for user_auth in UserAuth.objects.iterator():
+        latest_payment = Payment.objects.filter(
+            user_auth=user_auth,
+            status='completed'
+        ).order_by('-created_at').first()
+        if not latest_payment:
+            continue
+        metadata = latest_payment.metadata or {}
+        UserAuth.objects.filter(id=user_auth.id).update(
+            has_subscription=True,
+            subscription_end=latest_payment.subscription_end,
+            subscription_plan=metadata.get('plan', ''),
+            subscription_plan_name=metadata.get('plan_name', ''),
+            subscription_days=metadata.get('subscription_days'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0006_message_divar_message_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userauth',
+            name='has_subscription',
+            field=models.BooleanField(default=False, verbose_name='دارای اشتراک'),
+        ),
+        migrations.AddField(
+            model_name='userauth',
+            name='subscription_days',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='مدت اشتراک (روز)'),
+        ),
+        migrations.AddField(
+            model_name='userauth',
+            name='subscription_end',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='پایان اشتراک'),
+        ),
+        migrations.AddField(
+            model_name='userauth',
+            name='subscription_plan',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='کد اشتراک'),
+        ),
+        migrations.AddField(
+            model_name='userauth',
+            name='subscription_plan_name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='نوع اشتراک'),
+        ),
+        migrations.RunPython(backfill_subscriptions, migrations.RunPython.noop),
+    ]
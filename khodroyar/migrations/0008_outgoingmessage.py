@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0007_userauth_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار ارسال'), ('sending', 'در حال ارسال'), ('sent', 'ارسال شده'), ('failed', 'ناموفق')], db_index=True, default='pending', max_length=20, verbose_name='وضعیت')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان قابل ارسال')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع ارسال')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان ارسال')),
+                ('latency_ms', models.PositiveIntegerField(blank=True, null=True, verbose_name='زمان پاسخ دیوار (میلی\u200cثانیه)')),
+                ('last_status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='آخرین کد پاسخ')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='آخرین خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='تاریخ ایجاد')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_messages', to='khodroyar.conversation', verbose_name='مکالمه')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing', to='khodroyar.message', verbose_name='پیام')),
+            ],
+            options={
+                'verbose_name': 'پیام خروجی',
+                'verbose_name_plural': 'صف پیام\u200cهای خروجی',
+                'ordering': ['available_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='khodroyar_o_status_f87f60_idx')],
+            },
+        ),
+    ]
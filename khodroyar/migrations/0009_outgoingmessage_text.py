@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0008_outgoingmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingmessage',
+            name='text',
+            field=models.TextField(blank=True, default='', verbose_name='متن باقی\u200cمانده برای ارسال'),
+        ),
+    ]
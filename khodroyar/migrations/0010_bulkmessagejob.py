@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0009_outgoingmessage_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkMessageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('conversation_message', 'ارسال پیام به مکالمه\u200cها'), ('welcome_message', 'ارسال پیام خوش\u200cآمدگویی')], max_length=30, verbose_name='نوع')),
+                ('message', models.TextField(blank=True, default='', verbose_name='پیام')),
+                ('target_ids', models.JSONField(default=list, verbose_name='شناسه\u200cهای گیرندگان')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار اجرا'), ('running', 'در حال اجرا'), ('done', 'انجام شده'), ('failed', 'ناموفق')], db_index=True, default='pending', max_length=20, verbose_name='وضعیت')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='تعداد کل')),
+                ('sent_count', models.PositiveIntegerField(default=0, verbose_name='ارسال موفق')),
+                ('failed_count', models.PositiveIntegerField(default=0, verbose_name='ارسال ناموفق')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='خطاها')),
+                ('created_by', models.CharField(blank=True, default='', max_length=150, verbose_name='ایجاد کننده')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان پایان')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='تاریخ ایجاد')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')),
+            ],
+            options={
+                'verbose_name': 'ارسال گروهی پیام',
+                'verbose_name_plural': 'ارسال\u200cهای گروهی پیام',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
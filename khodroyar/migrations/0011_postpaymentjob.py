@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0010_bulkmessagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostPaymentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار پردازش'), ('running', 'در حال پردازش'), ('done', 'انجام شده'), ('failed', 'ناموفق')], db_index=True, default='pending', max_length=20, verbose_name='وضعیت')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان قابل پردازش')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع پردازش')),
+                ('conversation_id', models.CharField(blank=True, default='', max_length=255, verbose_name='شناسه مکالمه')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='آخرین خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='تاریخ ایجاد')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='post_payment_job', to='khodroyar.payment', verbose_name='پرداخت')),
+            ],
+            options={
+                'verbose_name': 'کار پس از پرداخت',
+                'verbose_name_plural': 'کارهای پس از پرداخت',
+                'ordering': ['available_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='khodroyar_p_status_1fe8f4_idx')],
+            },
+        ),
+    ]
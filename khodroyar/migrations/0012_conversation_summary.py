@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0011_postpaymentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summarized_message_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='آخرین پیام خلاصه\u200cشده'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, default='', verbose_name='خلاصه مکالمه'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='تاریخ بروزرسانی خلاصه'),
+        ),
+    ]
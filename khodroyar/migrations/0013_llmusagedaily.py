@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('khodroyar', '0012_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='تاریخ')),
+                ('model', models.CharField(max_length=100, verbose_name='مدل')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='تعداد فراخوانی')),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توکن\u200cهای ورودی')),
+                ('cached_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توکن\u200cهای ورودی کش\u200cشده')),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0, verbose_name='توکن\u200cهای خروجی')),
+                ('tool_calls', models.PositiveIntegerField(default=0, verbose_name='تعداد فراخوانی ابزار')),
+                ('total_latency_ms', models.PositiveBigIntegerField(default=0, verbose_name='مجموع زمان پاسخ (میلی\u200cثانیه)')),
+                ('total_ttft_ms', models.PositiveBigIntegerField(default=0, verbose_name='مجموع زمان اولین توکن (میلی\u200cثانیه)')),
+                ('max_latency_ms', models.PositiveIntegerField(default=0, verbose_name='بیشترین زمان پاسخ (میلی\u200cثانیه)')),
+                ('cost_usd', models.FloatField(default=0, verbose_name='هزینه تخمینی (دلار)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')),
+            ],
+            options={
+                'verbose_name': 'مصرف روزانه مدل',
+                'verbose_name_plural': 'مصرف روزانه مدل\u200cها',
+                'ordering': ['-date', 'model'],
+                'unique_together': {('date', 'model')},
+            },
+        ),
+    ]
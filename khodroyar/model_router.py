@@ -0,0 +1,47 @@
+import re
+from typing import Tuple
+from django.conf import settings
+
+# Short messages made only of these words (greetings, thanks, goodbyes) are
+# answered by the fast model. Yes/no and "ok" words are left out: they usually
+# answer a question of the bot and need the full conversation reasoning.
+TRIVIAL_WORDS = {
+    'سلام', 'درود', 'صبح', 'عصر', 'شب', 'بخیر', 'به', 'خیر', 'وقت', 'روز', 'خوش',
+    'ممنون', 'ممنونم', 'مرسی', 'متشکرم', 'تشکر', 'سپاس', 'دمت', 'گرم', 'خیلی', 'لطف', 'کردی', 'کردید',
+    'خداحافظ', 'خدانگهدار', 'فعلا', 'فعلاً', 'بای',
+    'hi', 'hello', 'thanks', 'thank', 'you', 'bye',
+}
+
+_WORD = re.compile(r'[^\W\d_]+')
+
+
+def is_trivial_turn(user_message: str) -> bool:
+    """
+    Whether a message is small talk that needs no pricing or car knowledge
+
+    Args:
+        user_message: The user's message of the turn
+
+    Returns:
+        True for short messages without numbers made only of trivial words
+    """
+    text = user_message.strip().lower().replace('ي', 'ی').replace('ك', 'ک')
+    if not text or len(text) > settings.KHODROYAR_FAST_MODEL_MAX_CHARS or any(char.isdigit() for char in text):
+        return False
+    words = _WORD.findall(text)
+    return bool(words) and all(word in TRIVIAL_WORDS for word in words)
+
+
+def choose_model(user_message: str) -> Tuple[str, str]:
+    """
+    Pick the model tier of a turn
+
+    Args:
+        user_message: The user's message of the turn
+
+    Returns:
+        tuple: (model name, tier) where tier is 'fast' or 'primary'
+    """
+    if settings.KHODROYAR_MODEL_ROUTING_ENABLED and is_trivial_turn(user_message):
+        return settings.KHODROYAR_FAST_MODEL, 'fast'
+    return settings.KHODROYAR_PRIMARY_MODEL, 'primary'
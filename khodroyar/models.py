@@ -7,12 +7,38 @@ class UserAuth(models.Model):
     user_id = models.CharField(max_length=255, unique=True, verbose_name='شناسه کاربر', db_index=True)
     access_token = models.TextField(verbose_name='توکن دسترسی')
     phone = models.CharField(max_length=20, blank=True, null=True, verbose_name='شماره تلفن', db_index=True)
+    # Denormalized from the latest completed Payment, kept in sync by refresh_subscription()
+    has_subscription = models.BooleanField(default=False, verbose_name='دارای اشتراک')
+    subscription_end = models.DateTimeField(blank=True, null=True, verbose_name='پایان اشتراک')
+    subscription_plan = models.CharField(max_length=50, blank=True, default='', verbose_name='کد اشتراک')
+    subscription_plan_name = models.CharField(max_length=255, blank=True, default='', verbose_name='نوع اشتراک')
+    subscription_days = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='مدت اشتراک (روز)')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
     updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
 
     def __str__(self):
         return f"User {self.user_id}"
 
+    def refresh_subscription(self):
+        """
+        Copy the latest completed payment's subscription onto this user
+        """
+        latest_payment = Payment.objects.filter(
+            user_auth=self,
+            status='completed'
+        ).order_by('-created_at').first()
+
+        metadata = (latest_payment.metadata or {}) if latest_payment else {}
+        self.has_subscription = latest_payment is not None
+        self.subscription_end = latest_payment.subscription_end if latest_payment else None
+        self.subscription_plan = metadata.get('plan', '')
+        self.subscription_plan_name = metadata.get('plan_name', '')
+        self.subscription_days = metadata.get('subscription_days')
+        self.save(update_fields=[
+            'has_subscription', 'subscription_end', 'subscription_plan',
+            'subscription_plan_name', 'subscription_days', 'updated_at'
+        ])
+
     class Meta:
         verbose_name = 'احراز هویت کاربر'
         verbose_name_plural = 'احراز هویت کاربران'
@@ -57,6 +83,10 @@ class Conversation(models.Model):
     conversation_id = models.CharField(max_length=255, unique=True, verbose_name='شناسه مکالمه', db_index=True)
     title = models.CharField(max_length=500, blank=True, null=True, verbose_name='عنوان مکالمه')
     is_active = models.BooleanField(default=True, verbose_name='فعال')
+    # Rolling summary of the messages that fell out of the history window (khodroyar/summary.py)
+    summary = models.TextField(blank=True, default='', verbose_name='خلاصه مکالمه')
+    summarized_message_id = models.BigIntegerField(blank=True, null=True, verbose_name='آخرین پیام خلاصه‌شده')
+    summary_updated_at = models.DateTimeField(blank=True, null=True, verbose_name='تاریخ بروزرسانی خلاصه')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
     updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
 
@@ -78,6 +108,7 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', verbose_name='مکالمه')
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, verbose_name='نوع پیام')
     content = models.TextField(verbose_name='محتوای پیام')
+    divar_message_id = models.CharField(max_length=255, unique=True, blank=True, null=True, verbose_name='شناسه پیام دیوار')
     metadata = models.JSONField(default=dict, blank=True, verbose_name='متادیتا')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
 
@@ -88,3 +119,187 @@ class Message(models.Model):
         verbose_name = 'پیام'
         verbose_name_plural = 'پیام‌ها'
         ordering = ['created_at']
+
+
+class ChatJob(models.Model):
+    """Queued chatbot turn waiting to be answered by a background worker"""
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار پردازش'),
+        ('running', 'در حال پردازش'),
+        ('done', 'انجام شده'),
+        ('failed', 'ناموفق'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='chat_jobs', verbose_name='مکالمه')
+    user_message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='chat_jobs', verbose_name='پیام کاربر')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت', db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='زمان قابل پردازش')
+    locked_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع پردازش')
+    last_error = models.TextField(blank=True, default='', verbose_name='آخرین خطا')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
+
+    def __str__(self):
+        return f"ChatJob {self.id} - {self.conversation.conversation_id} - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = 'کار پردازش پیام'
+        verbose_name_plural = 'کارهای پردازش پیام'
+        ordering = ['available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+
+class OutgoingMessage(models.Model):
+    """Outbox entry for a bot message that must be delivered through the Divar Chat API"""
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار ارسال'),
+        ('sending', 'در حال ارسال'),
+        ('sent', 'ارسال شده'),
+        ('failed', 'ناموفق'),
+    ]
+
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='outgoing', verbose_name='پیام')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='outgoing_messages', verbose_name='مکالمه')
+    # Set when only part of the message still has to be sent (e.g. the rest of a streamed reply)
+    text = models.TextField(blank=True, default='', verbose_name='متن باقی‌مانده برای ارسال')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت', db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='زمان قابل ارسال')
+    locked_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع ارسال')
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان ارسال')
+    latency_ms = models.PositiveIntegerField(blank=True, null=True, verbose_name='زمان پاسخ دیوار (میلی‌ثانیه)')
+    last_status_code = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='آخرین کد پاسخ')
+    last_error = models.TextField(blank=True, default='', verbose_name='آخرین خطا')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
+
+    def __str__(self):
+        return f"OutgoingMessage {self.id} - {self.conversation.conversation_id} - {self.get_status_display()}"
+
+    @property
+    def delivery_lag(self):
+        """Time between queueing and delivery (or until now while undelivered)"""
+        return (self.sent_at or timezone.now()) - self.created_at
+
+    class Meta:
+        verbose_name = 'پیام خروجی'
+        verbose_name_plural = 'صف پیام‌های خروجی'
+        ordering = ['available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+
+class BulkMessageJob(models.Model):
+    """Admin bulk messaging action processed in the background with its progress"""
+    KIND_CHOICES = [
+        ('conversation_message', 'ارسال پیام به مکالمه‌ها'),
+        ('welcome_message', 'ارسال پیام خوش‌آمدگویی'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار اجرا'),
+        ('running', 'در حال اجرا'),
+        ('done', 'انجام شده'),
+        ('failed', 'ناموفق'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES, verbose_name='نوع')
+    message = models.TextField(blank=True, default='', verbose_name='پیام')
+    # Conversation ids for conversation_message, UserAuth ids for welcome_message
+    target_ids = models.JSONField(default=list, verbose_name='شناسه‌های گیرندگان')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت', db_index=True)
+    total = models.PositiveIntegerField(default=0, verbose_name='تعداد کل')
+    sent_count = models.PositiveIntegerField(default=0, verbose_name='ارسال موفق')
+    failed_count = models.PositiveIntegerField(default=0, verbose_name='ارسال ناموفق')
+    errors = models.JSONField(default=list, blank=True, verbose_name='خطاها')
+    created_by = models.CharField(max_length=150, blank=True, default='', verbose_name='ایجاد کننده')
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع')
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان پایان')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
+
+    def __str__(self):
+        return f"BulkMessageJob {self.id} - {self.get_kind_display()} - {self.get_status_display()}"
+
+    @property
+    def processed_count(self):
+        return self.sent_count + self.failed_count
+
+    @property
+    def progress_percent(self):
+        if not self.total:
+            return 100 if self.status == 'done' else 0
+        return int(self.processed_count * 100 / self.total)
+
+    class Meta:
+        verbose_name = 'ارسال گروهی پیام'
+        verbose_name_plural = 'ارسال‌های گروهی پیام'
+        ordering = ['-created_at']
+
+
+class PostPaymentJob(models.Model):
+    """Side effects of a completed payment (welcome message and conversation), run in the background"""
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار پردازش'),
+        ('running', 'در حال پردازش'),
+        ('done', 'انجام شده'),
+        ('failed', 'ناموفق'),
+    ]
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='post_payment_job', verbose_name='پرداخت')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت', db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='زمان قابل پردازش')
+    locked_at = models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع پردازش')
+    # Set once Divar accepted the welcome message, so a retry only saves it
+    conversation_id = models.CharField(max_length=255, blank=True, default='', verbose_name='شناسه مکالمه')
+    last_error = models.TextField(blank=True, default='', verbose_name='آخرین خطا')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد', db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
+
+    def __str__(self):
+        return f"PostPaymentJob {self.id} - {self.payment_id} - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = 'کار پس از پرداخت'
+        verbose_name_plural = 'کارهای پس از پرداخت'
+        ordering = ['available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+
+class LLMUsageDaily(models.Model):
+    """Daily totals of the Aval AI calls of each model (khodroyar/telemetry.py)"""
+    date = models.DateField(verbose_name='تاریخ', db_index=True)
+    model = models.CharField(max_length=100, verbose_name='مدل')
+    calls = models.PositiveIntegerField(default=0, verbose_name='تعداد فراخوانی')
+    prompt_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توکن‌های ورودی')
+    cached_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توکن‌های ورودی کش‌شده')
+    completion_tokens = models.PositiveBigIntegerField(default=0, verbose_name='توکن‌های خروجی')
+    tool_calls = models.PositiveIntegerField(default=0, verbose_name='تعداد فراخوانی ابزار')
+    total_latency_ms = models.PositiveBigIntegerField(default=0, verbose_name='مجموع زمان پاسخ (میلی‌ثانیه)')
+    total_ttft_ms = models.PositiveBigIntegerField(default=0, verbose_name='مجموع زمان اولین توکن (میلی‌ثانیه)')
+    max_latency_ms = models.PositiveIntegerField(default=0, verbose_name='بیشترین زمان پاسخ (میلی‌ثانیه)')
+    cost_usd = models.FloatField(default=0, verbose_name='هزینه تخمینی (دلار)')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ بروزرسانی')
+
+    def __str__(self):
+        return f"LLMUsageDaily {self.date} - {self.model}"
+
+    @property
+    def avg_latency_ms(self):
+        return int(self.total_latency_ms / self.calls) if self.calls else 0
+
+    @property
+    def avg_ttft_ms(self):
+        return int(self.total_ttft_ms / self.calls) if self.calls else 0
+
+    class Meta:
+        verbose_name = 'مصرف روزانه مدل'
+        verbose_name_plural = 'مصرف روزانه مدل‌ها'
+        ordering = ['-date', 'model']
+        unique_together = [('date', 'model')]
@@ -0,0 +1,234 @@
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from data_line.divar_client import get_divar_client
+from .models import Conversation, Message, OutgoingMessage
+from .telemetry import record_llm_usage
+
+
+def queue_bot_message(
+    conversation: Conversation,
+    content: str,
+    metadata: Optional[Dict] = None,
+    outgoing_text: Optional[str] = None
+) -> Message:
+    """
+    Save a bot message together with its outbox entry in one transaction
+
+    LLM calls recorded in the metadata (metadata['llm_calls']) are added to the
+    daily usage totals.
+
+    With inline delivery enabled the entry is created already claimed, so the
+    caller can attempt delivery right away (deliver_outgoing_message) without
+    a worker sending it a second time; if that attempt fails or the process
+    dies, the outbox worker retries it.
+
+    Args:
+        conversation: Conversation the message belongs to
+        content: Bot message text
+        metadata: Extra message metadata
+        outgoing_text: Part of the message still to be sent when the rest was
+            already delivered (streamed replies); an empty string records the
+            message as fully delivered
+
+    Returns:
+        The saved bot Message, with its OutgoingMessage as `message.outgoing`
+    """
+    now = timezone.now()
+    inline = settings.KHODROYAR_OUTBOX_INLINE_DELIVERY
+    delivered = outgoing_text == ''
+
+    with transaction.atomic():
+        message = Message.objects.create(
+            conversation=conversation,
+            message_type='bot',
+            content=content,
+            metadata={
+                'sent_at': datetime.now().isoformat(),
+                'timestamp': datetime.now().isoformat(),
+                **(metadata or {})
+            }
+        )
+        if delivered:
+            message.outgoing = OutgoingMessage.objects.create(
+                message=message,
+                conversation=conversation,
+                status='sent',
+                sent_at=now,
+                available_at=now
+            )
+        else:
+            message.outgoing = OutgoingMessage.objects.create(
+                message=message,
+                conversation=conversation,
+                text=outgoing_text or '',
+                status='sending' if inline else 'pending',
+                locked_at=now if inline else None,
+                attempts=1 if inline else 0,
+                available_at=now
+            )
+
+    if metadata and metadata.get('llm_calls'):
+        try:
+            record_llm_usage(metadata['llm_calls'])
+        except Exception as e:
+            print(f"Failed to record LLM usage of message {message.id}: {str(e)}")
+
+    return message
+
+
+def claim_outgoing_messages(limit: int) -> List[OutgoingMessage]:
+    """
+    Atomically claim up to `limit` outbox entries that are due for delivery
+
+    Rows locked by another worker are skipped, and entries whose sender stopped
+    updating them for longer than the lock timeout are claimed again, unless
+    they already used up KHODROYAR_OUTBOX_MAX_ATTEMPTS, in which case they are
+    marked failed.
+
+    Args:
+        limit: Maximum number of entries to claim
+
+    Returns:
+        List of claimed OutgoingMessage objects (already marked as sending)
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.KHODROYAR_OUTBOX_LOCK_TIMEOUT)
+    max_attempts = settings.KHODROYAR_OUTBOX_MAX_ATTEMPTS
+
+    OutgoingMessage.objects.filter(status='sending', locked_at__lt=stale_before, attempts__gte=max_attempts).update(
+        status='failed',
+        locked_at=None,
+        last_error='Sender stopped while delivering the message',
+        updated_at=now
+    )
+
+    with transaction.atomic():
+        ids = list(
+            OutgoingMessage.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', available_at__lte=now) |
+                Q(status='sending', locked_at__lt=stale_before, attempts__lt=max_attempts)
+            )
+            .order_by('available_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+
+        if ids:
+            OutgoingMessage.objects.filter(id__in=ids).update(
+                status='sending',
+                locked_at=now,
+                attempts=F('attempts') + 1
+            )
+
+    return list(
+        OutgoingMessage.objects.filter(id__in=ids)
+        .select_related('message', 'conversation__user_auth')
+        .order_by('available_at', 'id')
+    )
+
+
+def deliver_outgoing_message(outgoing: OutgoingMessage) -> bool:
+    """
+    Send a claimed outbox entry through the Divar Chat API and record the result
+
+    The claim is renewed right before sending; an entry whose claim went stale
+    while it waited for a thread and was claimed again by another sender is
+    skipped, so it is not sent twice.
+
+    Args:
+        outgoing: OutgoingMessage in the `sending` state
+
+    Returns:
+        True if Divar accepted the message, False otherwise
+    """
+    # Imported here because views queue messages through this module
+    from .views import _divar_chat_request
+
+    if not _renew_claim(outgoing):
+        print(f"Outbox entry {outgoing.id} was claimed again by another sender, skipping")
+        return False
+
+    conversation = outgoing.conversation
+    start = time.monotonic()
+    status_code = None
+    try:
+        chat_api_url, headers, message_data = _divar_chat_request(
+            conversation.user_auth,
+            conversation.conversation_id,
+            outgoing.text or outgoing.message.content
+        )
+        response = get_divar_client().post(
+            chat_api_url,
+            endpoint='chat_message',
+            headers=headers,
+            json=message_data
+        )
+        status_code = response.status_code
+        error = '' if status_code == 200 else f"HTTP {status_code}: {response.text[:500]}"
+    except Exception as e:
+        error = str(e)
+
+    return _record_delivery(outgoing, time.monotonic() - start, status_code, error)
+
+
+def _renew_claim(outgoing: OutgoingMessage) -> bool:
+    """Move the lock of a claimed entry to now, if it still holds the claim it was loaded with"""
+    now = timezone.now()
+    renewed = OutgoingMessage.objects.filter(
+        id=outgoing.id,
+        status='sending',
+        locked_at=outgoing.locked_at
+    ).update(locked_at=now)
+    if renewed:
+        outgoing.locked_at = now
+    return bool(renewed)
+
+
+def _record_delivery(outgoing: OutgoingMessage, elapsed: float, status_code: Optional[int], error: str) -> bool:
+    """Store the outcome of a delivery attempt, rescheduling failures with backoff"""
+    now = timezone.now()
+    conversation_id = outgoing.conversation.conversation_id
+    latency_ms = int(elapsed * 1000)
+
+    if not error:
+        OutgoingMessage.objects.filter(id=outgoing.id).update(
+            status='sent',
+            sent_at=now,
+            latency_ms=latency_ms,
+            last_status_code=status_code,
+            last_error='',
+            updated_at=now
+        )
+        print(f"Bot message sent successfully to conversation {conversation_id}")
+        return True
+
+    print(f"Failed to send bot message to conversation {conversation_id} (attempt {outgoing.attempts}): {error}")
+
+    # Client errors other than rate limiting will not succeed on retry
+    permanent = status_code is not None and 400 <= status_code < 500 and status_code != 429
+    if permanent or outgoing.attempts >= settings.KHODROYAR_OUTBOX_MAX_ATTEMPTS:
+        status = 'failed'
+        available_at = now
+    else:
+        # Back off 5s, 10s, 20s, ... between attempts
+        status = 'pending'
+        available_at = now + timedelta(seconds=5 * (2 ** max(outgoing.attempts - 1, 0)))
+
+    OutgoingMessage.objects.filter(id=outgoing.id).update(
+        status=status,
+        available_at=available_at,
+        locked_at=None,
+        latency_ms=latency_ms,
+        last_status_code=status_code,
+        last_error=error,
+        updated_at=now
+    )
+    return False
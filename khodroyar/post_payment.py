@@ -0,0 +1,181 @@
+import threading
+from datetime import timedelta
+from typing import List
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Payment, PostPaymentJob
+
+
+def enqueue_post_payment_job(payment: Payment) -> PostPaymentJob:
+    """
+    Queue the welcome message of a completed payment for the background worker
+
+    Args:
+        payment: Completed Payment
+
+    Returns:
+        The PostPaymentJob (an existing one is reused, e.g. on a repeated callback)
+    """
+    job, _ = PostPaymentJob.objects.get_or_create(payment=payment)
+    return job
+
+
+def start_post_payment_job(job: PostPaymentJob) -> bool:
+    """
+    Send the welcome message of a queued job on a new thread of the current process
+
+    Used with KHODROYAR_POST_PAYMENT_INLINE_DELIVERY so that welcome messages
+    are sent even when no background worker runs, without the payment
+    redirect waiting on the Divar API. The job is claimed the way a worker
+    claims it, so it is never processed twice; a failed attempt is
+    rescheduled for the worker's retries, and a job whose thread died with
+    its process is reclaimed by the worker after the lock timeout.
+
+    Args:
+        job: PostPaymentJob returned by enqueue_post_payment_job
+
+    Returns:
+        True if the job was claimed and its thread started
+    """
+    claimed = PostPaymentJob.objects.filter(id=job.id, status='pending').update(
+        status='running',
+        locked_at=timezone.now(),
+        attempts=F('attempts') + 1
+    )
+    if not claimed:
+        return False
+
+    claimed_job = PostPaymentJob.objects.select_related('payment__user_auth').get(id=job.id)
+    threading.Thread(
+        target=_run_job_on_thread, args=(claimed_job,), daemon=True, name=f'khodroyar-post-payment-{job.id}'
+    ).start()
+    return True
+
+
+def _run_job_on_thread(job: PostPaymentJob):
+    """Process a post-payment job on its own thread with its own database connection"""
+    close_old_connections()
+    try:
+        process_post_payment_job(job)
+    finally:
+        close_old_connections()
+
+
+def claim_post_payment_jobs(limit: int) -> List[PostPaymentJob]:
+    """
+    Atomically claim up to `limit` post-payment jobs that are ready to run
+
+    Like claim_chat_jobs, a stale running job is claimed again unless it already
+    used KHODROYAR_POST_PAYMENT_MAX_ATTEMPTS, in which case it is marked as failed.
+
+    Args:
+        limit: Maximum number of jobs to claim
+
+    Returns:
+        List of claimed PostPaymentJob objects (already marked as running)
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.KHODROYAR_POST_PAYMENT_LOCK_TIMEOUT)
+    max_attempts = settings.KHODROYAR_POST_PAYMENT_MAX_ATTEMPTS
+
+    PostPaymentJob.objects.filter(status='running', locked_at__lt=stale_before, attempts__gte=max_attempts).update(
+        status='failed',
+        last_error='Worker stopped while processing the job',
+        updated_at=now
+    )
+
+    with transaction.atomic():
+        ids = list(
+            PostPaymentJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', available_at__lte=now) |
+                Q(status='running', locked_at__lt=stale_before, attempts__lt=max_attempts)
+            )
+            .order_by('available_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+
+        if ids:
+            PostPaymentJob.objects.filter(id__in=ids).update(
+                status='running',
+                locked_at=now,
+                attempts=F('attempts') + 1
+            )
+
+    return list(
+        PostPaymentJob.objects.filter(id__in=ids)
+        .select_related('payment__user_auth')
+        .order_by('available_at', 'id')
+    )
+
+
+def process_post_payment_job(job: PostPaymentJob) -> bool:
+    """
+    Send the welcome message of a payment and save it with its conversation
+
+    The conversation id returned by Divar is stored on the job before the
+    message is saved, so a retry after a database error does not send the
+    welcome message a second time.
+
+    Args:
+        job: PostPaymentJob previously returned by claim_post_payment_jobs
+
+    Returns:
+        True if the job finished successfully, False otherwise
+    """
+    # Imported here because views enqueue jobs through this module
+    from .views import build_welcome_message, deliver_welcome_message, save_welcome_message
+
+    payment = job.payment
+    user_auth = payment.user_auth
+    welcome_message = build_welcome_message(payment)
+
+    try:
+        if not job.conversation_id:
+            conversation_id = deliver_welcome_message(user_auth, welcome_message)
+            if not conversation_id:
+                raise Exception("Divar API did not accept the welcome message")
+            job.conversation_id = conversation_id
+            PostPaymentJob.objects.filter(id=job.id).update(conversation_id=conversation_id)
+
+        save_welcome_message(user_auth, payment, job.conversation_id, welcome_message)
+    except Exception as e:
+        print(f"Post-payment job {job.id} failed (attempt {job.attempts}): {str(e)}")
+        _mark_failed(job, str(e))
+        return False
+
+    PostPaymentJob.objects.filter(id=job.id).update(
+        status='done',
+        last_error='',
+        updated_at=timezone.now()
+    )
+    print(f"Welcome message sent successfully to user {user_auth.user_id} with conversation_id: {job.conversation_id}")
+    return True
+
+
+def _mark_failed(job: PostPaymentJob, error: str):
+    """Reschedule a failed job with exponential backoff, or give up after the maximum attempts"""
+    now = timezone.now()
+
+    if job.attempts >= settings.KHODROYAR_POST_PAYMENT_MAX_ATTEMPTS:
+        PostPaymentJob.objects.filter(id=job.id).update(
+            status='failed',
+            last_error=error,
+            updated_at=now
+        )
+        return
+
+    # Back off 10s, 20s, 40s, ... between attempts
+    delay = 10 * (2 ** max(job.attempts - 1, 0))
+    PostPaymentJob.objects.filter(id=job.id).update(
+        status='pending',
+        available_at=now + timedelta(seconds=delay),
+        locked_at=None,
+        last_error=error,
+        updated_at=now
+    )
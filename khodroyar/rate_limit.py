@@ -0,0 +1,91 @@
+import math
+import threading
+import time
+from typing import Dict, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+# Reply sent (once per throttling period) instead of answering a throttled message
+THROTTLED_MESSAGE = "شما در مدت کوتاهی پیام‌های زیادی ارسال کرده‌اید. لطفاً {seconds} ثانیه دیگر دوباره پیام دهید."
+
+# Serializes read-modify-write of buckets within this process
+_bucket_lock = threading.Lock()
+
+
+def _bucket_key(user_auth_id) -> str:
+    return f"khodroyar:ratelimit:{user_auth_id}"
+
+
+def get_rate_limit(subscription: Dict) -> Dict:
+    """
+    Rate limit of a user's plan
+
+    Args:
+        subscription: Subscription state from get_subscription_state
+
+    Returns:
+        dict with `capacity` (burst size) and `refill_per_minute`
+    """
+    limits = settings.KHODROYAR_RATE_LIMITS
+    subscription_end = subscription['subscription_end']
+    if not subscription_end or subscription_end <= timezone.now():
+        return limits['default']
+    return limits.get(subscription['plan'], limits['default'])
+
+
+def check_rate_limit(user_auth, subscription: Dict) -> Tuple[bool, float]:
+    """
+    Take one token from the user's bucket
+
+    Buckets live in the KHODROYAR_RATE_LIMIT_CACHE cache alias, so every process
+    sharing that cache (e.g. Redis) shares the limit. Updates are serialized per
+    process; concurrent updates from different processes may let a burst
+    slightly exceed the capacity.
+
+    Args:
+        user_auth: UserAuth sending the message
+        subscription: Subscription state from get_subscription_state
+
+    Returns:
+        tuple: (allowed, retry_after) where retry_after is the number of seconds
+        until a token is available again (0 when allowed)
+    """
+    limit = get_rate_limit(subscription)
+    capacity = limit['capacity']
+    refill_rate = limit['refill_per_minute'] / 60.0
+    cache = caches[settings.KHODROYAR_RATE_LIMIT_CACHE]
+    key = _bucket_key(user_auth.id)
+    # Keep a bucket only as long as it takes to refill completely
+    timeout = math.ceil(capacity / refill_rate) + 1
+
+    with _bucket_lock:
+        now = time.time()
+        bucket = cache.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket['tokens'] + (now - bucket['updated_at']) * refill_rate)
+
+        if tokens < 1:
+            cache.set(key, {'tokens': tokens, 'updated_at': now}, timeout)
+            return False, (1 - tokens) / refill_rate
+
+        cache.set(key, {'tokens': tokens - 1, 'updated_at': now}, timeout)
+        return True, 0.0
+
+
+def should_notify_throttled(user_auth, retry_after: float) -> bool:
+    """
+    Whether the throttled reply should be sent for this message
+
+    Only the first throttled message of a throttling period gets a reply, so a
+    flood of messages is not answered with a flood of warnings.
+    """
+    cache = caches[settings.KHODROYAR_RATE_LIMIT_CACHE]
+    return cache.add(f"{_bucket_key(user_auth.id)}:notified", True, max(1, math.ceil(retry_after)))
+
+
+def throttled_message(retry_after: float) -> str:
+    """Templated reply for a throttled message"""
+    return THROTTLED_MESSAGE.format(seconds=max(1, math.ceil(retry_after)))
@@ -0,0 +1,374 @@
+"""
+Replay of conversations through KhodroyarAIAgent against a local stub of the
+Aval AI (OpenAI compatible) API, to measure how prompt and agent changes
+affect prompt size, tool calls, latency and database queries per turn.
+
+Used by the replay_khodroyar_conversations management command. Every replay
+runs in a transaction that is rolled back, so no conversation, message or
+usage row is left behind.
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from . import ai_agent
+from .models import Conversation, Message, UserAuth
+from .summary import update_conversation_summary
+from .tokens import count_message_tokens, count_tokens
+from .utils import to_shamsi_date
+
+DEFAULT_FIXTURE_PATH = settings.BASE_DIR / 'khodroyar' / 'data' / 'replay_fixture.json'
+
+
+def load_fixture(path=DEFAULT_FIXTURE_PATH) -> Dict:
+    """
+    Load a replay fixture
+
+    The fixture has the conversations to replay (id and user turns) and the
+    canned model responses of the stub server (see StubLLMServer).
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def conversations_from_db(conversation_ids: Optional[List[str]] = None, limit: int = 10) -> List[Dict]:
+    """
+    User turns of recorded conversations
+
+    Args:
+        conversation_ids: Divar conversation ids; the most recent conversations when omitted
+        limit: Number of recent conversations when no ids are given
+
+    Returns:
+        List of {"id", "turns"} dictionaries in the fixture format
+    """
+    conversations = Conversation.objects.all()
+    if conversation_ids:
+        conversations = conversations.filter(conversation_id__in=conversation_ids)
+    else:
+        conversations = conversations.filter(messages__message_type='user').distinct().order_by('-created_at')[:limit]
+
+    replayed = []
+    for conversation in conversations:
+        turns = list(
+            conversation.messages.filter(message_type='user')
+            .order_by('created_at', 'id')
+            .values_list('content', flat=True)
+        )
+        if turns:
+            replayed.append({'id': conversation.conversation_id, 'turns': turns})
+    return replayed
+
+
+class StubLLMServer:
+    """
+    Local OpenAI compatible chat completions server with canned responses
+
+    A response is picked by the first rule of `responses` whose "match" text
+    is in the last user message. While the model may still call tools, a rule
+    with "tool_calls" answers with those calls; after the tool results (or
+    without a matching rule) the rule's "content" or `default_content` is
+    returned. Requests without tools (conversation summaries) get
+    `summary_content`. Streamed requests are answered as server-sent events.
+    """
+
+    def __init__(
+        self,
+        responses: List[Dict],
+        default_content: str,
+        summary_content: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        port: int = 0
+    ):
+        self.responses = responses
+        self.default_content = default_content
+        self.summary_content = summary_content
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = []
+        self._requests_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def take_requests(self) -> List[Dict]:
+        """Return and forget the request bodies received so far"""
+        with self._requests_lock:
+            requests, self.requests = self.requests, []
+        return requests
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub._requests_lock:
+                    stub.requests.append(body)
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+
+                message = stub.respond(body)
+                usage = stub.usage(body, message)
+                if body.get('stream'):
+                    self._send_stream(body, message, usage)
+                else:
+                    self._send_json({
+                        'id': 'replay', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                        'choices': [{'index': 0, 'message': message, 'finish_reason': 'tool_calls' if message.get('tool_calls') else 'stop'}],
+                        'usage': usage,
+                    })
+
+            def _send_json(self, data: Dict):
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, body: Dict, message: Dict, usage: Dict):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                base = {'id': 'replay', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body['model']}
+
+                def send(choices, **extra):
+                    event = {**base, 'choices': choices, **extra}
+                    self.wfile.write(b"data: " + json.dumps(event).encode() + b"\n\n")
+                    self.wfile.flush()
+
+                if message.get('tool_calls'):
+                    for index, tool_call in enumerate(message['tool_calls']):
+                        send([{'index': 0, 'delta': {'tool_calls': [{
+                            'index': index, 'id': tool_call['id'], 'type': 'function',
+                            'function': tool_call['function'],
+                        }]}, 'finish_reason': None}])
+                    send([{'index': 0, 'delta': {}, 'finish_reason': 'tool_calls'}])
+                else:
+                    for word in message['content'].split(' '):
+                        send([{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}])
+                    send([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+
+                if (body.get('stream_options') or {}).get('include_usage'):
+                    send([], usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+    def respond(self, body: Dict) -> Dict:
+        """Canned assistant message for a chat completions request"""
+        if not body.get('tools'):
+            return {'role': 'assistant', 'content': self.summary_content}
+
+        messages = body['messages']
+        user_message = next((message['content'] for message in reversed(messages) if message['role'] == 'user'), '')
+        rule = next((rule for rule in self.responses if rule['match'] in user_message), None)
+
+        may_call_tools = messages[-1]['role'] != 'tool' and body.get('tool_choice') != 'none'
+        if rule and rule.get('tool_calls') and may_call_tools:
+            return {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [
+                    {
+                        'id': f"call_{index}",
+                        'type': 'function',
+                        'function': {'name': call['name'], 'arguments': json.dumps(call['arguments'], ensure_ascii=False)},
+                    }
+                    for index, call in enumerate(rule['tool_calls'])
+                ],
+            }
+        return {'role': 'assistant', 'content': (rule or {}).get('content') or self.default_content}
+
+    def usage(self, body: Dict, message: Dict) -> Dict:
+        """Token usage of a request, estimated like the agent counts tokens"""
+        prompt_tokens = request_prompt_tokens(body)
+        completion = message.get('content') or json.dumps(message.get('tool_calls'), ensure_ascii=False)
+        completion_tokens = count_tokens(completion)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': 0},
+        }
+
+
+def request_prompt_tokens(body: Dict) -> int:
+    """Prompt tokens of a chat completions request: messages and tool schemas"""
+    tools = body.get('tools')
+    return count_message_tokens(body['messages']) + (count_tokens(json.dumps(tools, ensure_ascii=False)) if tools else 0)
+
+
+@contextmanager
+def replay_agent(server: StubLLMServer):
+    """
+    Point a fresh KhodroyarAIAgent at the stub server
+
+    The agent also replaces the global agent (get_ai_agent) while the replay
+    runs, so conversation summaries go to the stub as well.
+    """
+    with override_settings(AVAL_AI_BASE_URL=server.url, AVAL_AI_API_KEY='replay', KHODROYAR_LLM_MAX_RETRIES=0):
+        previous_agent = ai_agent._ai_agent
+        ai_agent._ai_agent = agent = ai_agent.KhodroyarAIAgent()
+        try:
+            yield agent
+        finally:
+            ai_agent._ai_agent = previous_agent
+
+
+def _turn_route(metadata: Dict) -> str:
+    """How a turn was answered: intent router rule, tool answer template or model tier"""
+    if metadata.get('intent'):
+        return metadata['intent']
+    if metadata.get('tool_answer_template'):
+        return 'template'
+    return metadata.get('model_tier', '')
+
+
+def _replay_turn(agent, server: StubLLMServer, conversation: Conversation, user_context: Dict, text: str, stream: bool) -> Dict:
+    """Answer one user turn like the chat pipeline and measure it"""
+    user_message = Message.objects.create(conversation=conversation, message_type='user', content=text)
+    metadata = {}
+    server.take_requests()
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        if stream:
+            reply = ''.join(agent.generate_response_stream(
+                text, conversation, user_context, turn_message_ids=[user_message.id], metadata=metadata
+            ))
+        else:
+            reply = agent.generate_response(
+                text, conversation, user_context, turn_message_ids=[user_message.id], metadata=metadata
+            )
+        reply_ms = (time.perf_counter() - start) * 1000
+        Message.objects.create(conversation=conversation, message_type='bot', content=reply, metadata=metadata)
+        update_conversation_summary(conversation)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+    requests = server.take_requests()
+    agent_requests = [body for body in requests if body.get('tools')]
+    return {
+        'conversation': conversation.conversation_id,
+        'user_message': text,
+        'reply': reply,
+        'route': _turn_route(metadata),
+        'model_calls': len(agent_requests),
+        'summary_calls': len(requests) - len(agent_requests),
+        'prompt_tokens': request_prompt_tokens(agent_requests[0]) if agent_requests else 0,
+        'total_prompt_tokens': sum(request_prompt_tokens(body) for body in requests),
+        'tool_calls': sum(len(call['tool_names']) for call in metadata.get('llm_calls', [])),
+        'reply_ms': reply_ms,
+        'latency_ms': latency_ms,
+        'db_queries': len(queries.captured_queries),
+    }
+
+
+def replay_conversations(conversations: List[Dict], server: StubLLMServer, stream: bool = False) -> List[Dict]:
+    """
+    Replay conversations turn by turn through KhodroyarAIAgent
+
+    Each conversation is replayed in a new temporary conversation of a
+    temporary subscribed user; everything is rolled back afterwards.
+
+    Args:
+        conversations: {"id", "turns"} dictionaries (fixture or conversations_from_db)
+        server: Running stub server the agent is pointed at
+        stream: Use generate_response_stream instead of generate_response
+
+    Returns:
+        One measurement dictionary per turn
+    """
+    results = []
+    with replay_agent(server) as agent, transaction.atomic():
+        subscription_end = timezone.now() + timedelta(days=7)
+        user_auth = UserAuth.objects.create(
+            user_id=f"replay-{time.time_ns()}",
+            access_token='replay',
+            has_subscription=True,
+            subscription_end=subscription_end,
+            subscription_plan_name='اشتراک طلایی',
+            subscription_days=7
+        )
+        user_context = {
+            'subscription_end': to_shamsi_date(subscription_end),
+            'plan_name': user_auth.subscription_plan_name,
+            'subscription_days': user_auth.subscription_days,
+        }
+
+        for index, replayed in enumerate(conversations):
+            conversation = Conversation.objects.create(
+                user_auth=user_auth,
+                conversation_id=f"{user_auth.user_id}-{index}-{replayed['id']}"[:255]
+            )
+            for text in replayed['turns']:
+                result = _replay_turn(agent, server, conversation, user_context, text, stream)
+                result['conversation'] = replayed['id']
+                results.append(result)
+
+        transaction.set_rollback(True)
+    return results
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a list of values (0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize_replay(results: List[Dict]) -> Dict:
+    """
+    Totals and latency percentiles of a replay
+
+    Args:
+        results: Per-turn measurements of replay_conversations
+
+    Returns:
+        Dictionary with turn counts, averages and latency percentiles
+    """
+    turns = len(results) or 1
+    latencies = [result['latency_ms'] for result in results]
+    return {
+        'turns': len(results),
+        'model_calls': sum(result['model_calls'] for result in results),
+        'summary_calls': sum(result['summary_calls'] for result in results),
+        'tool_calls': sum(result['tool_calls'] for result in results),
+        'turns_without_model': sum(1 for result in results if not result['model_calls']),
+        'avg_prompt_tokens': sum(result['prompt_tokens'] for result in results) / turns,
+        'avg_total_prompt_tokens': sum(result['total_prompt_tokens'] for result in results) / turns,
+        'avg_db_queries': sum(result['db_queries'] for result in results) / turns,
+        'max_db_queries': max((result['db_queries'] for result in results), default=0),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies, default=0.0),
+        },
+    }
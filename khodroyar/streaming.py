@@ -0,0 +1,46 @@
+import re
+from typing import List
+
+# A sentence ends with Latin or Persian punctuation followed by whitespace, or at a line break
+_BOUNDARY = re.compile(r'(?:[.!?؟…]+["»)]*\s+|\n+)')
+
+
+class SentenceChunker:
+    """
+    Split streamed model output into complete sentences or paragraphs
+
+    Text is fed as it arrives from the completion stream; a chunk is released
+    at the last sentence or paragraph boundary once it is at least `min_chars`
+    long, so every Divar message is readable on its own and short sentences
+    are grouped instead of being sent one by one.
+    """
+
+    def __init__(self, min_chars: int = 60):
+        self.min_chars = min_chars
+        self.buffer = ''
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text
+
+        Returns:
+            List of complete chunks ready to be sent (possibly empty)
+        """
+        self.buffer += text
+        if len(self.buffer) < self.min_chars:
+            return []
+
+        last_boundary = None
+        for match in _BOUNDARY.finditer(self.buffer):
+            if match.end() >= self.min_chars:
+                last_boundary = match.end()
+        if last_boundary is None:
+            return []
+
+        chunk, self.buffer = self.buffer[:last_boundary], self.buffer[last_boundary:]
+        return [chunk] if chunk.strip() else []
+
+    def flush(self) -> List[str]:
+        """Release whatever is left at the end of the stream"""
+        chunk, self.buffer = self.buffer, ''
+        return [chunk] if chunk.strip() else []
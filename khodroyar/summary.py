@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .ai_agent import get_ai_agent
+from .models import Conversation, Message
+from .telemetry import record_llm_usage
+from .tokens import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+# Most messages folded into the summary with one model call; a longer backlog
+# (e.g. of conversations started before summaries existed) is folded in several calls
+MAX_FOLDED_MESSAGES = 60
+
+# Messages loaded as history (recent_messages_queryset)
+HISTORY_MAX_MESSAGES = 50
+
+# Summaries are updated one at a time on this thread, after the reply was sent
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='khodroyar-summary')
+_pending_summaries = set()
+_pending_summaries_lock = threading.Lock()
+
+
+def unsummarized_messages(conversation: Conversation):
+    """Messages of a conversation that are not covered by its summary"""
+    messages = Message.objects.filter(conversation_id=conversation.id)
+    if conversation.summarized_message_id:
+        messages = messages.filter(id__gt=conversation.summarized_message_id)
+    return messages
+
+
+def update_conversation_summary(conversation: Conversation) -> bool:
+    """
+    Fold the messages that fell out of the history window into the summary
+
+    The window is the newest messages that fit verbatim in
+    KHODROYAR_HISTORY_MAX_TOKENS, the same messages the history keeps. Every
+    older message not yet summarized is folded into the previous summary,
+    oldest first and at most MAX_FOLDED_MESSAGES per model call, so no message
+    is left out of both the history and the summary.
+
+    Args:
+        conversation: Conversation to summarize
+
+    Returns:
+        True if the summary was updated
+    """
+    if not settings.KHODROYAR_SUMMARY_ENABLED:
+        return False
+
+    newest = list(unsummarized_messages(conversation).order_by('-created_at', '-id')[:HISTORY_MAX_MESSAGES + 1])
+
+    window = 0
+    used = 0
+    for message in newest:
+        used += count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+        if used > settings.KHODROYAR_HISTORY_MAX_TOKENS or window == HISTORY_MAX_MESSAGES:
+            break
+        window += 1
+
+    if window == len(newest):
+        return False
+    # Newest message that fell out of the window; it and everything before it is folded
+    last_folded_id = newest[window].id
+
+    updated = False
+    while True:
+        folding = list(
+            unsummarized_messages(conversation)
+            .filter(id__lte=last_folded_id)
+            .order_by('id')[:MAX_FOLDED_MESSAGES]
+        )
+        if not folding:
+            return updated
+
+        telemetry = {}
+        try:
+            summary = get_ai_agent().summarize_conversation(conversation.summary, folding, metadata=telemetry)
+        except Exception as e:
+            print(f"Conversation summary failed for {conversation.conversation_id}: {str(e)}")
+            return updated
+        record_llm_usage(telemetry.get('llm_calls', []))
+
+        if not summary:
+            return updated
+
+        now = timezone.now()
+        Conversation.objects.filter(id=conversation.id).update(
+            summary=summary,
+            summarized_message_id=folding[-1].id,
+            summary_updated_at=now
+        )
+        conversation.summary = summary
+        conversation.summarized_message_id = folding[-1].id
+        conversation.summary_updated_at = now
+        updated = True
+        print(f"Conversation {conversation.conversation_id} summary updated with {len(folding)} messages")
+
+
+def schedule_conversation_summary(conversation: Conversation):
+    """
+    Update the summary of a conversation in the background
+
+    Keeps the summary model call off the webhook request and the chat job. A
+    conversation already waiting for its summary update is not queued twice.
+
+    Args:
+        conversation: Conversation to summarize
+    """
+    if not settings.KHODROYAR_SUMMARY_ENABLED:
+        return
+
+    with _pending_summaries_lock:
+        if conversation.id in _pending_summaries:
+            return
+        _pending_summaries.add(conversation.id)
+    _summary_executor.submit(_run_conversation_summary, conversation.id)
+
+
+def _run_conversation_summary(conversation_id: int):
+    """Update one conversation summary on the summary thread with its own database connection"""
+    close_old_connections()
+    try:
+        # Messages arriving from now on schedule another update
+        with _pending_summaries_lock:
+            _pending_summaries.discard(conversation_id)
+        conversation = Conversation.objects.filter(id=conversation_id).first()
+        if conversation:
+            update_conversation_summary(conversation)
+    except Exception as e:
+        print(f"Conversation summary failed for conversation {conversation_id}: {str(e)}")
+    finally:
+        close_old_connections()
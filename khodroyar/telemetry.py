@@ -0,0 +1,90 @@
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import LLMUsageDaily
+
+
+def build_llm_call(
+    model: str,
+    latency: float,
+    ttft: Optional[float] = None,
+    usage=None,
+    tool_names: Optional[List[str]] = None
+) -> Dict:
+    """
+    Telemetry record of one finished LLM call
+
+    Args:
+        model: Model the call was made to
+        latency: Seconds from the request to the end of the answer
+        ttft: Seconds to the first streamed token (the whole latency when not streamed)
+        usage: `usage` of the API response, if the endpoint returned it
+        tool_names: Names of the tools the model called
+
+    Returns:
+        Dictionary stored in Message.metadata['llm_calls']
+    """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+
+    return {
+        'model': model,
+        'latency_ms': int(latency * 1000),
+        'ttft_ms': int((latency if ttft is None else ttft) * 1000),
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens,
+        'completion_tokens': completion_tokens,
+        'tool_names': tool_names or [],
+        'cost_usd': estimate_cost(model, prompt_tokens, cached_tokens, completion_tokens),
+    }
+
+
+def estimate_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """Cost of a call from KHODROYAR_LLM_PRICES (USD per million tokens); 0 for unknown models"""
+    prices = settings.KHODROYAR_LLM_PRICES.get(model)
+    if not prices:
+        return 0.0
+    cost = (
+        (prompt_tokens - cached_tokens) * prices['prompt'] +
+        cached_tokens * prices['cached'] +
+        completion_tokens * prices['completion']
+    ) / 1_000_000
+    return round(cost, 6)
+
+
+def record_llm_usage(llm_calls: List[Dict]):
+    """
+    Add LLM calls to the daily totals of their models
+
+    Args:
+        llm_calls: Records built by build_llm_call
+    """
+    today = timezone.localdate()
+    totals = {}
+    for call in llm_calls:
+        total = totals.setdefault(call['model'], {
+            'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0,
+            'tool_calls': 0, 'total_latency_ms': 0, 'total_ttft_ms': 0, 'max_latency_ms': 0, 'cost_usd': 0.0,
+        })
+        total['calls'] += 1
+        total['prompt_tokens'] += call['prompt_tokens']
+        total['cached_tokens'] += call['cached_tokens']
+        total['completion_tokens'] += call['completion_tokens']
+        total['tool_calls'] += len(call['tool_names'])
+        total['total_latency_ms'] += call['latency_ms']
+        total['total_ttft_ms'] += call['ttft_ms']
+        total['max_latency_ms'] = max(total['max_latency_ms'], call['latency_ms'])
+        total['cost_usd'] += call['cost_usd']
+
+    for model, total in totals.items():
+        LLMUsageDaily.objects.get_or_create(date=today, model=model)
+        max_latency_ms = total.pop('max_latency_ms')
+        LLMUsageDaily.objects.filter(date=today, model=model).update(
+            max_latency_ms=Greatest(F('max_latency_ms'), max_latency_ms),
+            updated_at=timezone.now(),
+            **{field: F(field) + value for field, value in total.items()}
+        )
@@ -0,0 +1,141 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from khodroyar.ai_agent import KhodroyarAIAgent, TOOL_LIMIT_MESSAGE
+from khodroyar.circuit_breaker import CircuitOpen
+from khodroyar.llm_limiter import LLMOverloaded
+
+
+def fake_response(model):
+    message = SimpleNamespace(content=f"answer from {model}", tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@override_settings(AVAL_AI_API_KEY='test', KHODROYAR_LLM_HEDGE_DELAY=2.0)
+class HedgedCompletionTests(SimpleTestCase):
+    def setUp(self):
+        self.agent = KhodroyarAIAgent()
+        self.calls = []
+
+    def create_completion(self, failures, slow=()):
+        def create(metadata=None, *, model, **kwargs):
+            self.calls.append(model)
+            if model in slow:
+                time.sleep(0.5)
+            if model in failures:
+                raise failures[model]
+            return fake_response(model)
+        return create
+
+    def test_fast_failure_falls_back_without_waiting_for_delay(self):
+        failures = {'primary': CircuitOpen('circuit open for primary')}
+        with mock.patch.object(self.agent, '_create_completion', side_effect=self.create_completion(failures)):
+            start = time.monotonic()
+            response, model = self.agent._first_completion(['primary', 'fallback'], {}, messages=[])
+        self.assertEqual(model, 'fallback')
+        self.assertEqual(self.calls, ['primary', 'fallback'])
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    @override_settings(KHODROYAR_LLM_HEDGE_DELAY=0.1)
+    def test_slow_first_model_is_hedged(self):
+        metadata = {}
+        with mock.patch.object(self.agent, '_create_completion', side_effect=self.create_completion({}, slow={'primary'})):
+            response, model = self.agent._first_completion(['primary', 'fallback'], metadata, messages=[])
+        self.assertEqual(model, 'fallback')
+        self.assertTrue(metadata['hedged'])
+
+    def test_remaining_models_are_tried_when_both_hedged_models_fail(self):
+        failures = {'routed': CircuitOpen('routed'), 'primary': RuntimeError('500')}
+        with mock.patch.object(self.agent, '_create_completion', side_effect=self.create_completion(failures)):
+            response, model = self.agent._first_completion(['routed', 'primary', 'fallback'], {}, messages=[])
+        self.assertEqual(model, 'fallback')
+
+    def test_overloaded_is_not_hedged(self):
+        failures = {'primary': LLMOverloaded('busy')}
+        with mock.patch.object(self.agent, '_create_completion', side_effect=self.create_completion(failures)):
+            with self.assertRaises(LLMOverloaded):
+                self.agent._first_completion(['primary', 'fallback'], {}, messages=[])
+        self.assertEqual(self.calls, ['primary'])
+
+
+def fake_stream_event(text):
+    delta = SimpleNamespace(content=text, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+@override_settings(
+    AVAL_AI_API_KEY='test', KHODROYAR_INTENT_ROUTER_ENABLED=False, KHODROYAR_MODEL_ROUTING_ENABLED=False,
+    KHODROYAR_PRIMARY_MODEL='primary', KHODROYAR_FALLBACK_MODEL='fallback', KHODROYAR_STREAM_MIN_CHARS=1
+)
+class StreamFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.agent = KhodroyarAIAgent()
+        self.conversation = SimpleNamespace(summary='')
+        self.calls = []
+
+    def stream_completion(self, fail_after_first_chunk=False):
+        def stream(metadata=None, *, model, **kwargs):
+            self.calls.append(model)
+            if model == 'primary':
+                if fail_after_first_chunk:
+                    yield fake_stream_event('بخش اول.\n\n')
+                raise CircuitOpen('circuit open for primary')
+            yield fake_stream_event(f"پاسخ {model}.")
+        return stream
+
+    def test_stream_falls_back_before_the_first_chunk(self):
+        with mock.patch.object(self.agent, '_stream_completion', side_effect=self.stream_completion()):
+            chunks = list(self.agent.generate_response_stream('قیمت خودرو', self.conversation, history=[]))
+        self.assertEqual(self.calls, ['primary', 'fallback'])
+        self.assertEqual(''.join(chunks), 'پاسخ fallback.')
+
+    def test_stream_does_not_switch_model_after_the_first_chunk(self):
+        with mock.patch.object(self.agent, '_stream_completion', side_effect=self.stream_completion(True)):
+            chunks = list(self.agent.generate_response_stream('قیمت خودرو', self.conversation, history=[]))
+        self.assertEqual(self.calls, ['primary'])
+        self.assertEqual([chunk.strip() for chunk in chunks], ['بخش اول.'])
+
+    def test_empty_stream_falls_back_to_tool_limit_message(self):
+        def empty_stream(metadata=None, *, model, **kwargs):
+            yield fake_stream_event('')
+            yield fake_stream_event('  \n')
+        with mock.patch.object(self.agent, '_stream_completion', side_effect=empty_stream):
+            chunks = list(self.agent.generate_response_stream('قیمت خودرو', self.conversation, history=[]))
+        self.assertEqual(chunks, [TOOL_LIMIT_MESSAGE])
+
+
+def fake_tool_call(call_id, delay):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name='search_cars', arguments=f'{{"delay": {delay}}}'))
+
+
+@override_settings(AVAL_AI_API_KEY='test')
+class ToolExecutionTests(SimpleTestCase):
+    def setUp(self):
+        self.agent = KhodroyarAIAgent()
+
+    def execute_function_call(self, function, user_message, conversation):
+        delay = json.loads(function.arguments)['delay']
+        if delay < 0:
+            raise ValueError('catalog unavailable')
+        time.sleep(delay)
+        return {'delay': delay}
+
+    def test_parallel_tool_calls_keep_the_order_of_the_calls(self):
+        tool_calls = [fake_tool_call('call-1', 0.3), fake_tool_call('call-2', 0.0), fake_tool_call('call-3', 0.1)]
+        with mock.patch.object(self.agent, '_execute_function_call', side_effect=self.execute_function_call):
+            start = time.monotonic()
+            messages = self.agent._execute_tool_calls(tool_calls, 'سوال', None)
+
+        self.assertEqual([message['tool_call_id'] for message in messages], ['call-1', 'call-2', 'call-3'])
+        self.assertEqual([json.loads(message['content']) for message in messages], [{'delay': 0.3}, {'delay': 0.0}, {'delay': 0.1}])
+        self.assertLess(time.monotonic() - start, 0.35)
+
+    def test_failed_tool_call_is_reported_in_its_own_result(self):
+        tool_calls = [fake_tool_call('call-1', -1), fake_tool_call('call-2', 0.0)]
+        with mock.patch.object(self.agent, '_execute_function_call', side_effect=self.execute_function_call):
+            messages = self.agent._execute_tool_calls(tool_calls, 'سوال', None)
+
+        self.assertIn('catalog unavailable', json.loads(messages[0]['content'])['error'])
+        self.assertEqual(json.loads(messages[1]['content']), {'delay': 0.0})
@@ -0,0 +1,101 @@
+import time
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from khodroyar.bulk_messaging import claim_bulk_message_job, create_bulk_message_job, run_bulk_message_job
+from khodroyar.models import BulkMessageJob, Conversation, Message, UserAuth
+
+
+def deliver(job, conversation):
+    return Message(conversation=conversation, message_type='bot', content=job.message)
+
+
+def slow_deliver(job, conversation):
+    time.sleep(0.05)
+    return deliver(job, conversation)
+
+
+class BulkMessagingTests(TestCase):
+    def setUp(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.conversations = [
+            Conversation.objects.create(user_auth=user_auth, conversation_id=f'conversation-{index}')
+            for index in range(3)
+        ]
+
+    def create_job(self):
+        return create_bulk_message_job(
+            'conversation_message', [conversation.id for conversation in self.conversations], message='سلام'
+        )
+
+    @override_settings(KHODROYAR_BULK_MESSAGE_INLINE=True)
+    def test_job_starts_inline_without_a_worker(self):
+        with mock.patch('khodroyar.bulk_messaging.threading.Thread') as thread:
+            with self.captureOnCommitCallbacks(execute=True):
+                job = self.create_job()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        thread.return_value.start.assert_called_once()
+        self.assertIsNone(claim_bulk_message_job())
+
+    @override_settings(KHODROYAR_BULK_MESSAGE_INLINE=False)
+    @mock.patch('khodroyar.bulk_messaging._deliver_conversation_message', side_effect=deliver)
+    def test_worker_runs_a_queued_job(self, _):
+        self.create_job()
+        job = claim_bulk_message_job()
+
+        run_bulk_message_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent_count, job.failed_count), ('done', 3, 0))
+        self.assertEqual(Message.objects.filter(content='سلام').count(), 3)
+
+    @override_settings(KHODROYAR_BULK_MESSAGE_INLINE=False, KHODROYAR_BULK_MESSAGE_LOCK_TIMEOUT=120)
+    def test_job_without_heartbeat_is_given_up(self):
+        self.create_job()
+        job = claim_bulk_message_job()
+
+        BulkMessageJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(seconds=60))
+        claim_bulk_message_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+        BulkMessageJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(seconds=180))
+        claim_bulk_message_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    @override_settings(KHODROYAR_BULK_MESSAGE_INLINE=False)
+    @mock.patch('khodroyar.bulk_messaging._deliver_conversation_message', side_effect=deliver)
+    def test_job_given_up_while_running_is_not_marked_done(self, _):
+        self.create_job()
+        job = claim_bulk_message_job()
+        BulkMessageJob.objects.filter(id=job.id).update(status='failed')
+
+        run_bulk_message_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.sent_count, 3)
+
+    @override_settings(KHODROYAR_BULK_MESSAGE_INLINE=False, KHODROYAR_BULK_MESSAGE_CONCURRENCY=1)
+    @mock.patch('khodroyar.bulk_messaging._deliver_conversation_message', side_effect=slow_deliver)
+    def test_delivered_messages_are_saved_with_each_progress_save(self, _):
+        self.create_job()
+        job = claim_bulk_message_job()
+        saved_counts = []
+
+        def save_progress(job):
+            saved_counts.append(Message.objects.filter(content='سلام').count())
+
+        # Every progress check sees two more seconds passed
+        clock = iter(range(0, 1000, 2))
+        with mock.patch('khodroyar.bulk_messaging.time') as fake_time, \
+                mock.patch('khodroyar.bulk_messaging._save_progress', side_effect=save_progress):
+            fake_time.monotonic.side_effect = lambda: next(clock)
+            run_bulk_message_job(job)
+
+        self.assertEqual(saved_counts[0], 1)
+        self.assertEqual(saved_counts[-1], 3)
@@ -0,0 +1,63 @@
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from khodroyar.car_details_service import CarDetailsService
+
+
+@override_settings(
+    KHODROYAR_CAR_DETAILS_FIELDS=['car_name', 'advantages'],
+    KHODROYAR_CAR_DETAILS_MAX_CHARS={'advantages': 50},
+    KHODROYAR_CAR_DETAILS_ALTERNATIVES=2
+)
+class CarDetailsProjectionTests(SimpleTestCase):
+    def setUp(self):
+        with mock.patch.object(CarDetailsService, '_load_cars_details', return_value=[]):
+            self.service = CarDetailsService()
+        self.details = {
+            'found': True,
+            'car_name': 'پژو ۲۰۶ تیپ ۲',
+            'brand': 'پژو',
+            'technical_specs': 'موتور TU3',
+            'advantages': 'مصرف سوخت پایین و قطعات ارزان ' * 5,
+            'disadvantages': 'ایمنی پایین',
+            'similarity_score': 0.91234,
+            'all_matches': [
+                {'full_car_name': f'پژو ۲۰۶ تیپ {index}', 'similarity_score': 0.9 - index / 10, 'advantages': '...'}
+                for index in range(5)
+            ]
+        }
+
+    def test_only_the_configured_fields_are_kept(self):
+        projected = self.service.project_car_details(self.details)
+
+        self.assertEqual(set(projected), {'found', 'car_name', 'advantages', 'similarity_score', 'alternatives'})
+        self.assertEqual(projected['similarity_score'], 0.91)
+
+    def test_long_fields_are_capped(self):
+        projected = self.service.project_car_details(self.details)
+
+        self.assertLessEqual(len(projected['advantages']), 52)
+        self.assertTrue(projected['advantages'].endswith(' …'))
+
+    def test_alternatives_skip_the_best_match_and_keep_names_and_scores(self):
+        projected = self.service.project_car_details(self.details)
+
+        self.assertEqual(projected['alternatives'], [
+            {'car_name': 'پژو ۲۰۶ تیپ 1', 'similarity_score': 0.8},
+            {'car_name': 'پژو ۲۰۶ تیپ 2', 'similarity_score': 0.7},
+        ])
+
+    def test_not_found_details_are_returned_unchanged(self):
+        details = {'found': False, 'message': 'یافت نشد', 'suggestions': []}
+
+        self.assertEqual(self.service.project_car_details(details), details)
+
+    def test_truncate_cuts_at_a_line_break_near_the_limit(self):
+        text = 'الف' * 30 + '\n' + 'ب' * 40
+
+        self.assertEqual(self.service._truncate(text, 200), text)
+        self.assertEqual(self.service._truncate(text, 100), 'الف' * 30 + ' …')
+
+    def test_truncate_ignores_a_line_break_near_the_start(self):
+        text = 'عنوان\n' + 'ب' * 200
+
+        self.assertEqual(self.service._truncate(text, 100), text[:100] + ' …')
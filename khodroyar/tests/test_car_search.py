@@ -0,0 +1,49 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from khodroyar.car_search import CarSearchService
+
+CARS = [
+    {'full_car_name': 'پژو ۲۰۶ تیپ ۲', 'brand': 'ایران خودرو', 'current_price': 700_000_000},
+    {'full_car_name': 'دنا پلاس', 'brand': 'ایران خودرو', 'current_price': 1_000_000_000},
+    {'full_car_name': 'شاهین', 'brand': 'سایپا', 'current_price': 900_000_000},
+    {'full_car_name': 'کوییک', 'brand': 'سایپا', 'current_price': 500_000_000},
+    {'full_car_name': 'تارا', 'brand': 'ایران خودرو', 'current_price': 1_200_000_000},
+]
+
+
+class BudgetSearchTests(SimpleTestCase):
+    def setUp(self):
+        with mock.patch.object(CarSearchService, '_load_cars_data', return_value=CARS):
+            self.service = CarSearchService()
+
+    def names(self, result):
+        return [car['name'] for car in result['cars']]
+
+    def test_range_bounds_are_inclusive(self):
+        result = self.service.search_cars_by_budget(max_price=1_000_000_000, min_price=700_000_000)
+
+        self.assertEqual(self.names(result), ['دنا پلاس', 'شاهین', 'پژو ۲۰۶ تیپ ۲'])
+        self.assertEqual(result['total_matches'], 3)
+
+    def test_limit_keeps_the_cars_closest_to_the_top_of_the_budget(self):
+        result = self.service.search_cars_by_budget(max_price=2_000_000_000, limit=2)
+
+        self.assertEqual(self.names(result), ['تارا', 'دنا پلاس'])
+        self.assertEqual(result['total_matches'], 5)
+
+    def test_brand_filter_accepts_partial_names(self):
+        result = self.service.search_cars_by_budget(max_price=1_000_000_000, brands=['ايران'])
+
+        self.assertEqual(self.names(result), ['دنا پلاس', 'پژو ۲۰۶ تیپ ۲'])
+
+    def test_range_without_cars(self):
+        result = self.service.search_cars_by_budget(max_price=400_000_000)
+
+        self.assertFalse(result['found'])
+        self.assertEqual(result['total_matches'], 0)
+
+    def test_unknown_brand_lists_the_available_brands(self):
+        result = self.service.search_cars_by_budget(max_price=1_000_000_000, brands=['تسلا'])
+
+        self.assertFalse(result['found'])
+        self.assertEqual(result['available_brands'], ['ایران خودرو', 'سایپا'])
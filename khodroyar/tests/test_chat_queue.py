@@ -0,0 +1,104 @@
+import time
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from khodroyar.chat_queue import claim_chat_jobs, enqueue_chat_job, get_unanswered_messages, process_chat_job
+from khodroyar.models import ChatJob, Conversation, Message, UserAuth
+
+
+@override_settings(
+    KHODROYAR_COALESCE_WINDOW=2.0,
+    KHODROYAR_COALESCE_MAX_DELAY=8.0,
+    KHODROYAR_CHAT_JOB_LOCK_TIMEOUT=300,
+    KHODROYAR_CHAT_JOB_MAX_ATTEMPTS=3
+)
+class ChatQueueTests(TestCase):
+    def setUp(self):
+        self.user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.conversation = self.create_conversation('conversation-1')
+
+    def create_conversation(self, conversation_id):
+        return Conversation.objects.create(user_auth=self.user_auth, conversation_id=conversation_id)
+
+    def user_message(self, content, conversation=None):
+        return Message.objects.create(conversation=conversation or self.conversation, message_type='user', content=content)
+
+    def make_due(self, *jobs):
+        ChatJob.objects.filter(id__in=[job.id for job in jobs]).update(available_at=timezone.now() - timedelta(seconds=1))
+
+    def test_messages_within_the_window_share_one_job(self):
+        first = enqueue_chat_job(self.conversation, self.user_message('سلام'))
+        second = enqueue_chat_job(self.conversation, self.user_message('قیمت دنا پلاس چنده؟'))
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(ChatJob.objects.count(), 1)
+        self.assertEqual(second.user_message.content, 'قیمت دنا پلاس چنده؟')
+        self.make_due(second)
+        [job] = claim_chat_jobs(10)
+        self.assertEqual([message.content for message in get_unanswered_messages(job)], ['سلام', 'قیمت دنا پلاس چنده؟'])
+
+    def test_coalescing_delay_is_capped(self):
+        job = enqueue_chat_job(self.conversation, self.user_message('سلام'))
+        ChatJob.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(seconds=7))
+
+        job = enqueue_chat_job(self.conversation, self.user_message('هنوز هستید؟'))
+
+        self.assertLessEqual(job.available_at, job.created_at + timedelta(seconds=8))
+
+    def test_jobs_are_claimed_once_due(self):
+        job = enqueue_chat_job(self.conversation, self.user_message('سلام'))
+        self.assertEqual(claim_chat_jobs(10), [])
+
+        self.make_due(job)
+        [claimed] = claim_chat_jobs(10)
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, 'running', 1))
+        self.assertEqual(claim_chat_jobs(10), [])
+
+    def test_one_job_per_conversation_runs_at_a_time(self):
+        other_conversation = self.create_conversation('conversation-2')
+        first = enqueue_chat_job(self.conversation, self.user_message('سلام'))
+        other = enqueue_chat_job(other_conversation, self.user_message('سلام', other_conversation))
+        self.make_due(first, other)
+        self.assertEqual(len(claim_chat_jobs(10)), 2)
+
+        # A new message while the first job runs waits for it
+        second = enqueue_chat_job(self.conversation, self.user_message('قیمت سورن'))
+        self.make_due(second)
+        self.assertEqual(claim_chat_jobs(10), [])
+
+        ChatJob.objects.filter(id=first.id).update(status='done')
+        self.assertEqual([job.id for job in claim_chat_jobs(10)], [second.id])
+
+    def test_stale_job_is_reclaimed_until_max_attempts(self):
+        job = enqueue_chat_job(self.conversation, self.user_message('سلام'))
+        self.make_due(job)
+        claim_chat_jobs(10)
+        stale = timezone.now() - timedelta(seconds=301)
+
+        ChatJob.objects.filter(id=job.id).update(locked_at=stale)
+        [reclaimed] = claim_chat_jobs(10)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        ChatJob.objects.filter(id=job.id).update(locked_at=stale, attempts=3)
+        self.assertEqual(claim_chat_jobs(10), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+
+@override_settings(KHODROYAR_COALESCE_WINDOW=0, KHODROYAR_CHAT_JOB_HEARTBEAT=0.05)
+class ChatJobHeartbeatTests(TransactionTestCase):
+    def test_lock_is_renewed_while_the_reply_is_generated(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        conversation = Conversation.objects.create(user_auth=user_auth, conversation_id='conversation-1')
+        message = Message.objects.create(conversation=conversation, message_type='user', content='سلام')
+        enqueue_chat_job(conversation, message)
+        [job] = claim_chat_jobs(1)
+        claimed_at = job.locked_at
+
+        with mock.patch('khodroyar.views.reply_to_message', side_effect=lambda *args, **kwargs: time.sleep(0.3)):
+            self.assertTrue(process_chat_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertGreater(job.locked_at, claimed_at)
@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase, override_settings
+from khodroyar.intent_router import GREETING_ANSWER, route_intent
+
+USER_CONTEXT = {'subscription_end': '1405/08/01', 'plan_name': 'اشتراک ماهانه'}
+
+
+@override_settings(KHODROYAR_INTENT_ROUTER_ENABLED=True)
+class IntentRouterTests(SimpleTestCase):
+    def route(self, message, user_context=USER_CONTEXT):
+        return route_intent(message, user_context, '1405/07/26')
+
+    def test_plain_greetings_are_answered(self):
+        for message in ('سلام', 'سلام وقت بخیر', 'Hello'):
+            self.assertEqual(self.route(message), ('greeting', GREETING_ANSWER), message)
+
+    def test_greeting_with_a_question_goes_to_the_model(self):
+        self.assertIsNone(self.route('سلام قیمت دنا'))
+        self.assertIsNone(self.route('وقت بخیر'))
+
+    def test_subscription_end_is_answered_from_the_context(self):
+        intent, answer = self.route('اشتراکم تا کی اعتبار داره؟')
+        self.assertEqual(intent, 'subscription_end')
+        self.assertIn('1405/08/01', answer)
+        self.assertIn('اشتراک ماهانه', answer)
+
+    def test_subscription_questions_about_renewal_go_to_the_model(self):
+        self.assertIsNone(self.route('تمدید اشتراک تا کی امکان داره؟'))
+        self.assertIsNone(self.route('اشتراکم تا کی اعتبار داره؟', user_context={}))
+
+    def test_unambiguous_car_price_is_answered(self):
+        intent, answer = self.route('قیمت سورن')
+        self.assertEqual(intent, 'car_price')
+        self.assertIn('1405/07/26', answer)
+        self.assertIn('سورن', answer)
+
+    def test_ambiguous_or_used_car_prices_go_to_the_model(self):
+        self.assertIsNone(self.route('قیمت دنا پلاس'))
+        self.assertIsNone(self.route('قیمت پراید ۱۳۹۰'))
+        self.assertIsNone(self.route('قیمت سورن با ۶۰ هزار کیلومتر کارکرد'))
+
+    @override_settings(KHODROYAR_INTENT_ROUTER_ENABLED=False)
+    def test_disabled_router_answers_nothing(self):
+        self.assertIsNone(self.route('سلام'))
@@ -0,0 +1,58 @@
+import tempfile
+import threading
+import time
+from django.test import SimpleTestCase
+from khodroyar.llm_limiter import LLMLimiter, LLMOverloaded
+
+
+class LLMLimiterTests(SimpleTestCase):
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.limiter = LLMLimiter(max_concurrency=1, lock_dir=lock_dir.name, wait_budget=0.2, poll_interval=0.01)
+
+    def test_slot_is_released_after_the_block(self):
+        with self.limiter.slot():
+            self.assertEqual(self.limiter.in_flight(), 1)
+        self.assertEqual(self.limiter.in_flight(), 0)
+
+    def test_slot_is_released_when_the_call_fails(self):
+        with self.assertRaises(ValueError):
+            with self.limiter.slot():
+                raise ValueError('model error')
+        self.assertEqual(self.limiter.in_flight(), 0)
+
+    def test_waiting_call_gets_the_released_slot(self):
+        holding = threading.Event()
+
+        def hold_slot():
+            with self.limiter.slot():
+                holding.set()
+                time.sleep(0.05)
+
+        holder = threading.Thread(target=hold_slot)
+        holder.start()
+        holding.wait()
+        with self.limiter.slot():
+            self.assertEqual(self.limiter.in_flight(), 1)
+        holder.join()
+        self.assertEqual(self.limiter.stats()['queue_depth'], 0)
+
+    def test_call_waiting_past_the_budget_is_shed(self):
+        with self.limiter.slot():
+            started = time.monotonic()
+            with self.assertRaises(LLMOverloaded):
+                with self.limiter.slot():
+                    pass
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+            self.assertEqual(self.limiter.queue_depth(), 0)
+        self.assertEqual(self.limiter.in_flight(), 0)
+
+    def test_call_is_shed_at_once_when_the_expected_wait_exceeds_the_budget(self):
+        self.limiter._avg_call_seconds = 10.0
+        with self.limiter.slot():
+            started = time.monotonic()
+            with self.assertRaises(LLMOverloaded):
+                with self.limiter.slot():
+                    pass
+            self.assertLess(time.monotonic() - started, 0.2)
@@ -0,0 +1,19 @@
+from django.test import SimpleTestCase, override_settings
+from khodroyar.model_router import choose_model, is_trivial_turn
+
+
+@override_settings(
+    KHODROYAR_MODEL_ROUTING_ENABLED=True, KHODROYAR_FAST_MODEL='fast', KHODROYAR_PRIMARY_MODEL='primary'
+)
+class ModelRouterTests(SimpleTestCase):
+    def test_greetings_and_thanks_use_the_fast_model(self):
+        self.assertEqual(choose_model('سلام'), ('fast', 'fast'))
+        self.assertEqual(choose_model('خیلی ممنون'), ('fast', 'fast'))
+
+    def test_yes_no_answers_use_the_primary_model(self):
+        for message in ('بله', 'آره', 'نه', 'باشه', 'اوکی', 'ok'):
+            self.assertFalse(is_trivial_turn(message), message)
+            self.assertEqual(choose_model(message), ('primary', 'primary'))
+
+    def test_numbers_are_never_trivial(self):
+        self.assertFalse(is_trivial_turn('سلام 206'))
@@ -0,0 +1,60 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from khodroyar.models import Conversation, OutgoingMessage, UserAuth
+from khodroyar.outbox import claim_outgoing_messages, deliver_outgoing_message, queue_bot_message
+
+
+@mock.patch('khodroyar.views._divar_chat_request', return_value=('https://divar.test', {}, {}))
+@mock.patch('khodroyar.outbox.get_divar_client')
+class OutboxDeliveryTests(TestCase):
+    def setUp(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.conversation = Conversation.objects.create(user_auth=user_auth, conversation_id='conversation-1')
+
+    @override_settings(KHODROYAR_OUTBOX_INLINE_DELIVERY=True)
+    def test_inline_delivery_sends_the_message(self, get_client, _):
+        get_client.return_value.post.return_value = mock.Mock(status_code=200)
+        message = queue_bot_message(self.conversation, 'سلام')
+
+        self.assertTrue(deliver_outgoing_message(message.outgoing))
+        self.assertEqual(OutgoingMessage.objects.get(id=message.outgoing.id).status, 'sent')
+
+    @override_settings(KHODROYAR_OUTBOX_INLINE_DELIVERY=False)
+    def test_claim_respects_the_limit(self, get_client, _):
+        for index in range(3):
+            queue_bot_message(self.conversation, f'پیام {index}')
+
+        self.assertEqual(len(claim_outgoing_messages(2)), 2)
+        self.assertEqual(len(claim_outgoing_messages(0)), 0)
+        self.assertEqual(len(claim_outgoing_messages(5)), 1)
+
+    @override_settings(KHODROYAR_OUTBOX_INLINE_DELIVERY=False, KHODROYAR_OUTBOX_LOCK_TIMEOUT=60)
+    def test_entry_claimed_again_while_waiting_is_not_sent_twice(self, get_client, _):
+        get_client.return_value.post.return_value = mock.Mock(status_code=200)
+        queue_bot_message(self.conversation, 'سلام')
+        [waiting] = claim_outgoing_messages(1)
+
+        # The claim goes stale while the entry waits for a thread and another sender takes it
+        OutgoingMessage.objects.filter(id=waiting.id).update(locked_at=timezone.now() - timedelta(seconds=120))
+        [reclaimed] = claim_outgoing_messages(1)
+
+        self.assertFalse(deliver_outgoing_message(waiting))
+        self.assertTrue(deliver_outgoing_message(reclaimed))
+        self.assertEqual(get_client.return_value.post.call_count, 1)
+
+    @override_settings(KHODROYAR_OUTBOX_INLINE_DELIVERY=False, KHODROYAR_OUTBOX_LOCK_TIMEOUT=60, KHODROYAR_OUTBOX_MAX_ATTEMPTS=2)
+    def test_stale_entry_is_failed_after_the_maximum_attempts(self, get_client, _):
+        message = queue_bot_message(self.conversation, 'سلام')
+        stale = timezone.now() - timedelta(seconds=120)
+
+        # The sender dies while delivering, twice
+        for _attempt in range(2):
+            self.assertEqual(len(claim_outgoing_messages(1)), 1)
+            OutgoingMessage.objects.filter(id=message.outgoing.id).update(locked_at=stale)
+
+        self.assertEqual(claim_outgoing_messages(1), [])
+        outgoing = OutgoingMessage.objects.get(id=message.outgoing.id)
+        self.assertEqual(outgoing.status, 'failed')
+        self.assertEqual(outgoing.attempts, 2)
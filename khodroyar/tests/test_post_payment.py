@@ -0,0 +1,71 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from khodroyar.models import Conversation, Message, Payment, PostPaymentJob, UserAuth
+from khodroyar.post_payment import (
+    claim_post_payment_jobs, enqueue_post_payment_job, process_post_payment_job, start_post_payment_job
+)
+
+
+class InlinePostPaymentTests(TestCase):
+    def setUp(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.payment = Payment.objects.create(
+            user_auth=user_auth,
+            amount=1000000,
+            ref_id='12345',
+            status='completed',
+            subscription_start=timezone.now(),
+            subscription_end=timezone.now()
+        )
+
+    def start_job(self, job):
+        """Start a job and run its thread's work in the test, returning whether it was started"""
+        with mock.patch('khodroyar.post_payment.threading.Thread') as thread:
+            started = start_post_payment_job(job)
+        if started:
+            thread.return_value.start.assert_called_once()
+            process_post_payment_job(*thread.call_args.kwargs['args'])
+        return started
+
+    @mock.patch('khodroyar.views.deliver_welcome_message', return_value='conversation-1')
+    def test_welcome_message_is_sent_without_a_worker(self, deliver):
+        job = enqueue_post_payment_job(self.payment)
+
+        self.assertTrue(self.start_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.attempts, 1)
+        conversation = Conversation.objects.get(conversation_id='conversation-1')
+        self.assertTrue(Message.objects.filter(conversation=conversation, message_type='bot').exists())
+
+    @mock.patch('khodroyar.views.deliver_welcome_message', return_value='conversation-1')
+    def test_job_claimed_by_a_worker_is_not_sent_again(self, deliver):
+        job = enqueue_post_payment_job(self.payment)
+        PostPaymentJob.objects.filter(id=job.id).update(status='running', locked_at=timezone.now())
+
+        self.assertFalse(self.start_job(job))
+        deliver.assert_not_called()
+
+    @mock.patch('khodroyar.views.deliver_welcome_message', return_value=None)
+    def test_failed_attempt_is_left_to_the_worker(self, deliver):
+        job = enqueue_post_payment_job(self.payment)
+
+        self.assertTrue(self.start_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.available_at, timezone.now())
+
+    @override_settings(KHODROYAR_POST_PAYMENT_MAX_ATTEMPTS=2)
+    def test_stale_job_is_given_up_after_max_attempts(self):
+        job = enqueue_post_payment_job(self.payment)
+        PostPaymentJob.objects.filter(id=job.id).update(
+            status='running', attempts=2, locked_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(claim_post_payment_jobs(10), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
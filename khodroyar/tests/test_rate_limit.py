@@ -0,0 +1,66 @@
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from khodroyar.rate_limit import check_rate_limit, get_rate_limit, should_notify_throttled
+
+
+@override_settings(KHODROYAR_RATE_LIMITS={
+    'default': {'capacity': 2, 'refill_per_minute': 6},
+    'golden': {'capacity': 4, 'refill_per_minute': 12},
+})
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.addCleanup(caches['ratelimit'].clear)
+        self.user_auth = mock.Mock(id=1)
+        self.subscription = {'plan': None, 'subscription_end': None}
+        patcher = mock.patch('khodroyar.rate_limit.time')
+        self.time = patcher.start()
+        self.time.time.return_value = 1000.0
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_rejects_once_the_burst_is_used(self):
+        self.assertEqual(check_rate_limit(self.user_auth, self.subscription), (True, 0.0))
+        self.assertEqual(check_rate_limit(self.user_auth, self.subscription), (True, 0.0))
+
+        allowed, retry_after = check_rate_limit(self.user_auth, self.subscription)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 10.0)
+
+    def test_bucket_refills_over_time(self):
+        check_rate_limit(self.user_auth, self.subscription)
+        check_rate_limit(self.user_auth, self.subscription)
+
+        self.time.time.return_value = 1005.0
+        allowed, retry_after = check_rate_limit(self.user_auth, self.subscription)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 5.0)
+
+        self.time.time.return_value = 1010.0
+        self.assertEqual(check_rate_limit(self.user_auth, self.subscription), (True, 0.0))
+
+    def test_refill_does_not_exceed_the_capacity(self):
+        check_rate_limit(self.user_auth, self.subscription)
+
+        self.time.time.return_value = 5000.0
+        results = [check_rate_limit(self.user_auth, self.subscription)[0] for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_buckets_are_per_user(self):
+        check_rate_limit(self.user_auth, self.subscription)
+        check_rate_limit(self.user_auth, self.subscription)
+
+        self.assertTrue(check_rate_limit(mock.Mock(id=2), self.subscription)[0])
+
+    def test_active_plan_gets_its_own_limit(self):
+        active = {'plan': 'golden', 'subscription_end': timezone.now() + timedelta(days=1)}
+        expired = {'plan': 'golden', 'subscription_end': timezone.now() - timedelta(days=1)}
+
+        self.assertEqual(get_rate_limit(active)['capacity'], 4)
+        self.assertEqual(get_rate_limit(expired)['capacity'], 2)
+
+    def test_throttled_reply_is_sent_once_per_period(self):
+        self.assertTrue(should_notify_throttled(self.user_auth, 10.0))
+        self.assertFalse(should_notify_throttled(self.user_auth, 10.0))
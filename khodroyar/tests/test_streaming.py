@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+from khodroyar.streaming import SentenceChunker
+
+
+class SentenceChunkerTests(SimpleTestCase):
+    def test_short_text_is_held_until_flush(self):
+        chunker = SentenceChunker(min_chars=20)
+        self.assertEqual(chunker.feed('سلام. '), [])
+        self.assertEqual(chunker.flush(), ['سلام. '])
+
+    def test_chunk_is_released_at_the_last_boundary(self):
+        chunker = SentenceChunker(min_chars=10)
+        self.assertEqual(chunker.feed('جمله اول. جمله دوم! جمله'), ['جمله اول. جمله دوم! '])
+        self.assertEqual(chunker.feed(' سوم'), [])
+        self.assertEqual(chunker.flush(), ['جمله سوم'])
+
+    def test_paragraph_break_is_a_boundary(self):
+        chunker = SentenceChunker(min_chars=5)
+        self.assertEqual(chunker.feed('پاراگراف اول\n\nادامه'), ['پاراگراف اول\n\n'])
+
+    def test_pieces_join_back_to_the_full_text(self):
+        text = 'پژو ۲۰۷ مصرف کمتری دارد. دنا پلاس فضای بیشتری دارد.\nکدام را بررسی کنیم؟'
+        chunker = SentenceChunker(min_chars=15)
+        chunks = []
+        for index in range(0, len(text), 7):
+            chunks.extend(chunker.feed(text[index:index + 7]))
+        chunks.extend(chunker.flush())
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), text)
+
+    def test_blank_text_is_never_released(self):
+        chunker = SentenceChunker(min_chars=2)
+        self.assertEqual(chunker.feed('\n\n\n'), [])
+        self.assertEqual(chunker.flush(), [])
@@ -0,0 +1,78 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from khodroyar import summary
+from khodroyar.context import recent_messages_queryset
+from khodroyar.models import Conversation, Message, UserAuth
+from khodroyar.summary import schedule_conversation_summary, update_conversation_summary
+
+
+@override_settings(KHODROYAR_SUMMARY_ENABLED=True, KHODROYAR_HISTORY_MAX_TOKENS=300)
+class ConversationSummaryTests(TestCase):
+    def setUp(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.conversation = Conversation.objects.create(user_auth=user_auth, conversation_id='conversation-1')
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation,
+                message_type='user' if index % 2 == 0 else 'bot',
+                content=f"پیام شماره {index} " + 'درباره قیمت خودرو ' * 8
+            )
+            for index in range(12)
+        ]
+        agent = mock.Mock()
+        agent.summarize_conversation.return_value = 'کاربر درباره قیمت خودرو پرسیده است.'
+        patcher = mock.patch('khodroyar.summary.get_ai_agent', return_value=agent)
+        self.agent = patcher.start()()
+        self.addCleanup(patcher.stop)
+
+    def test_folding_advances_summarized_message_id(self):
+        self.assertTrue(update_conversation_summary(self.conversation))
+
+        self.conversation.refresh_from_db()
+        folded = self.agent.summarize_conversation.call_args.args[1]
+        self.assertEqual(folded[0], self.messages[0])
+        self.assertEqual(self.conversation.summarized_message_id, folded[-1].id)
+        self.assertEqual(self.conversation.summary, 'کاربر درباره قیمت خودرو پرسیده است.')
+
+    def test_history_excludes_summarized_messages(self):
+        update_conversation_summary(self.conversation)
+
+        history = list(recent_messages_queryset(self.conversation))
+        self.assertTrue(history)
+        self.assertTrue(all(message.id > self.conversation.summarized_message_id for message in history))
+        self.assertEqual(history[0], self.messages[-1])
+
+    def test_nothing_is_folded_while_the_history_fits(self):
+        Message.objects.filter(id__in=[message.id for message in self.messages[2:]]).delete()
+
+        self.assertFalse(update_conversation_summary(self.conversation))
+        self.agent.summarize_conversation.assert_not_called()
+        self.assertIsNone(self.conversation.summarized_message_id)
+
+    def test_a_single_message_out_of_the_window_is_folded(self):
+        Message.objects.filter(id__in=[message.id for message in self.messages[:-3]]).delete()
+        with override_settings(KHODROYAR_HISTORY_MAX_TOKENS=150):
+            self.assertTrue(update_conversation_summary(self.conversation))
+
+        folded = self.agent.summarize_conversation.call_args.args[1]
+        self.assertEqual(folded, [self.messages[-3]])
+        history = list(recent_messages_queryset(self.conversation))
+        self.assertEqual(history, [self.messages[-1], self.messages[-2]])
+
+    def test_a_long_backlog_is_folded_in_several_calls(self):
+        with mock.patch.object(summary, 'MAX_FOLDED_MESSAGES', 3):
+            self.assertTrue(update_conversation_summary(self.conversation))
+
+        calls = self.agent.summarize_conversation.call_args_list
+        self.assertGreater(len(calls), 1)
+        folded = [message for call in calls for message in call.args[1]]
+        self.assertEqual(folded, self.messages[:len(folded)])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summarized_message_id, folded[-1].id)
+
+    def test_schedule_queues_a_conversation_once(self):
+        with mock.patch.object(summary._summary_executor, 'submit') as submit:
+            schedule_conversation_summary(self.conversation)
+            schedule_conversation_summary(self.conversation)
+        submit.assert_called_once_with(summary._run_conversation_summary, self.conversation.id)
+        summary._pending_summaries.discard(self.conversation.id)
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from khodroyar.models import LLMUsageDaily
+from khodroyar.telemetry import build_llm_call, record_llm_usage
+
+
+@override_settings(KHODROYAR_LLM_PRICES={'gpt-4.1': {'prompt': 2.0, 'cached': 0.5, 'completion': 8.0}})
+class LLMTelemetryTests(TestCase):
+    def call(self, model='gpt-4.1', latency=1.0, tool_names=None):
+        usage = SimpleNamespace(
+            prompt_tokens=1000,
+            completion_tokens=200,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=400)
+        )
+        return build_llm_call(model, latency, ttft=0.25, usage=usage, tool_names=tool_names)
+
+    def test_call_record_estimates_the_cost(self):
+        call = self.call(tool_names=['search_cars'])
+
+        self.assertEqual(call['latency_ms'], 1000)
+        self.assertEqual(call['ttft_ms'], 250)
+        self.assertEqual(call['cached_tokens'], 400)
+        # 600 uncached, 400 cached and 200 completion tokens
+        self.assertAlmostEqual(call['cost_usd'], (600 * 2.0 + 400 * 0.5 + 200 * 8.0) / 1_000_000)
+
+    def test_unknown_model_and_missing_usage_cost_nothing(self):
+        call = build_llm_call('other-model', 0.5)
+
+        self.assertEqual(call['prompt_tokens'], 0)
+        self.assertEqual(call['ttft_ms'], 500)
+        self.assertEqual(call['cost_usd'], 0.0)
+
+    def test_calls_are_aggregated_per_model_and_day(self):
+        record_llm_usage([
+            self.call(latency=1.0, tool_names=['search_cars', 'get_car_price']),
+            self.call(latency=3.0),
+            self.call(model='gpt-4.1-mini', latency=0.5),
+        ])
+
+        usage = LLMUsageDaily.objects.get(date=timezone.localdate(), model='gpt-4.1')
+        self.assertEqual(usage.calls, 2)
+        self.assertEqual(usage.prompt_tokens, 2000)
+        self.assertEqual(usage.cached_tokens, 800)
+        self.assertEqual(usage.completion_tokens, 400)
+        self.assertEqual(usage.tool_calls, 2)
+        self.assertEqual(usage.total_latency_ms, 4000)
+        self.assertEqual(usage.max_latency_ms, 3000)
+        self.assertEqual(usage.avg_latency_ms, 2000)
+        self.assertEqual(LLMUsageDaily.objects.get(model='gpt-4.1-mini').calls, 1)
+
+    def test_later_calls_are_added_to_the_existing_row(self):
+        record_llm_usage([self.call(latency=2.0)])
+        record_llm_usage([self.call(latency=1.0), self.call(latency=1.5)])
+
+        self.assertEqual(LLMUsageDaily.objects.count(), 1)
+        usage = LLMUsageDaily.objects.get()
+        self.assertEqual(usage.calls, 3)
+        self.assertEqual(usage.total_latency_ms, 4500)
+        self.assertEqual(usage.max_latency_ms, 2000)
+        self.assertAlmostEqual(usage.cost_usd, 3 * self.call()['cost_usd'])
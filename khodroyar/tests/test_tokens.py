@@ -0,0 +1,46 @@
+from django.test import SimpleTestCase
+from khodroyar.tokens import (
+    MESSAGE_OVERHEAD_TOKENS, MIN_TRIMMED_TOKENS, TRIMMED_MARKER, count_message_tokens, count_tokens,
+    fit_history_to_budget
+)
+
+
+def chat(*contents):
+    return [
+        {'role': 'user' if index % 2 == 0 else 'assistant', 'content': content}
+        for index, content in enumerate(contents)
+    ]
+
+
+class FitHistoryToBudgetTests(SimpleTestCase):
+    def test_history_within_budget_is_kept_verbatim(self):
+        messages = chat('سلام', 'سلام! چطور می‌توانم کمک کنم؟', 'قیمت سورن')
+        kept, used = fit_history_to_budget(messages, 1000)
+        self.assertEqual(kept, messages)
+        self.assertEqual(used, count_message_tokens(messages))
+
+    def test_newest_messages_are_kept_and_older_ones_dropped(self):
+        messages = chat('پیام قدیمی ' * 200, 'پیام میانی ' * 200, 'پیام جدید')
+        budget = count_message_tokens(messages[2:]) + MESSAGE_OVERHEAD_TOKENS + 10
+        kept, used = fit_history_to_budget(messages, budget)
+        self.assertEqual(kept, messages[2:])
+        self.assertLessEqual(used, budget)
+
+    def test_first_message_over_budget_is_trimmed(self):
+        messages = chat('پیام قدیمی ' * 200, 'پیام میانی ' * 200, 'پیام جدید')
+        budget = count_message_tokens(messages[2:]) + MESSAGE_OVERHEAD_TOKENS + MIN_TRIMMED_TOKENS + 20
+        kept, used = fit_history_to_budget(messages, budget)
+
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(kept[1], messages[2])
+        self.assertEqual(kept[0]['role'], messages[1]['role'])
+        self.assertTrue(kept[0]['content'].endswith(TRIMMED_MARKER))
+        self.assertTrue(messages[1]['content'].startswith(kept[0]['content'][:-len(TRIMMED_MARKER)]))
+        self.assertLessEqual(used, budget)
+        self.assertEqual(used, count_message_tokens(kept))
+
+    def test_empty_budget_keeps_nothing(self):
+        self.assertEqual(fit_history_to_budget(chat('سلام'), 0), ([], 0))
+
+    def test_count_tokens_of_empty_text(self):
+        self.assertEqual(count_tokens(''), 0)
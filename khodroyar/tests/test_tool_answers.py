@@ -0,0 +1,37 @@
+from django.test import SimpleTestCase
+from khodroyar.tool_answers import render_tool_answer
+
+USED_CAR_PRICE = {
+    'price_range_lower': 612_345_678,
+    'price_range_upper': 648_700_000,
+    'base_price': 900_000_000,
+    'annual_depreciation': 0.15,
+    'kilometer_depreciation': 0.05,
+    'condition_factor': 0.9,
+}
+
+
+class ToolAnswerTests(SimpleTestCase):
+    def test_used_car_price_is_rendered_from_the_template(self):
+        answer = render_tool_answer('calculate_used_car_price', USED_CAR_PRICE, 'پژو ۲۰۶ مدل ۹۸ چند؟', '۱۴۰۵/۰۷/۲۶')
+
+        self.assertIn('در تاریخ ۱۴۰۵/۰۷/۲۶', answer)
+        self.assertIn('از ۶۱۲ میلیون تومان تا ۶۴۹ میلیون تومان', answer)
+        self.assertIn('قیمت صفر: ۹۰۰ میلیون تومان', answer)
+        self.assertIn('افت قیمت بابت سن خودرو: ۱۵ درصد', answer)
+        self.assertIn('اثر وضعیت بدنه و رنگ: ۱۰ درصد کاهش', answer)
+
+    def test_questions_that_need_reasoning_are_left_to_the_model(self):
+        answer = render_tool_answer('calculate_used_car_price', USED_CAR_PRICE, 'پژو ۲۰۶ بخرم یا پراید؟', '۱۴۰۵/۰۷/۲۶')
+
+        self.assertIsNone(answer)
+
+    def test_failed_calculation_is_left_to_the_model(self):
+        answer = render_tool_answer('calculate_used_car_price', {'error': 'خودرو یافت نشد'}, 'پژو ۲۰۶ چند؟', '۱۴۰۵/۰۷/۲۶')
+
+        self.assertIsNone(answer)
+
+    def test_tools_without_a_template_are_left_to_the_model(self):
+        answer = render_tool_answer('get_car_details_and_pros_cons', {'found': True}, 'پژو ۲۰۶', '۱۴۰۵/۰۷/۲۶')
+
+        self.assertIsNone(answer)
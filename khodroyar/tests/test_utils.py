@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from khodroyar.models import Payment, UserAuth
+from khodroyar.utils import get_subscription_state
+
+
+class SubscriptionStateTests(TestCase):
+    def test_state_follows_refresh_subscription(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.assertFalse(get_subscription_state(user_auth)['has_subscription'])
+
+        subscription_end = timezone.now() + timedelta(days=30)
+        Payment.objects.create(
+            user_auth=user_auth,
+            amount=1000000,
+            status='completed',
+            subscription_end=subscription_end,
+            metadata={'plan': 'monthly', 'plan_name': 'اشتراک ماهانه', 'subscription_days': 30}
+        )
+        user_auth.refresh_subscription()
+
+        state = get_subscription_state(user_auth)
+        self.assertTrue(state['has_subscription'])
+        self.assertEqual(state['subscription_end'], subscription_end)
+        self.assertEqual(state['plan_name'], 'اشتراک ماهانه')
+        self.assertEqual(state['subscription_days'], 30)
@@ -0,0 +1,68 @@
+import json
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from khodroyar.context import load_conversation_context
+from khodroyar.models import ChatJob, Conversation, Message, UserAuth
+
+
+@override_settings(
+    DIVAR_AUTHORIZATION_TOKEN='divar-token',
+    KHODROYAR_ASYNC_WEBHOOK=True,
+    KHODROYAR_RATE_LIMIT_ENABLED=False
+)
+class ChatWebhookDedupeTests(TestCase):
+    def setUp(self):
+        user_auth = UserAuth.objects.create(user_id='user-1', access_token='token')
+        self.conversation = Conversation.objects.create(user_auth=user_auth, conversation_id='conversation-1')
+
+    def post_message(self, message_id):
+        body = {
+            'new_chatbot_message': {
+                'id': message_id,
+                'conversation': {'id': 'conversation-1', 'type': 'chatbot'},
+                'sender': {'type': 'user'},
+                'type': 'TEXT',
+                'text': 'قیمت پژو ۲۰۶ چنده؟',
+            }
+        }
+        return self.client.post(
+            reverse('khodroyar:receive_message'),
+            data=json.dumps(body),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='divar-token'
+        )
+
+    def test_first_delivery_is_stored_and_queued(self):
+        response = self.post_message('divar-message-1')
+
+        self.assertEqual(response.json(), {'success': True, 'queued': True})
+        self.assertEqual(Message.objects.filter(divar_message_id='divar-message-1').count(), 1)
+        self.assertEqual(ChatJob.objects.count(), 1)
+
+    def test_retry_of_a_stored_message_is_a_duplicate(self):
+        self.post_message('divar-message-1')
+        response = self.post_message('divar-message-1')
+
+        self.assertEqual(response.json(), {'success': True, 'duplicate': True})
+        self.assertEqual(Message.objects.filter(divar_message_id='divar-message-1').count(), 1)
+        self.assertEqual(ChatJob.objects.count(), 1)
+
+    def test_concurrent_retry_that_wins_the_insert_is_a_duplicate(self):
+        def retry_lands_first(conversation_id):
+            # The other request stores the message after this one checked for it
+            Message.objects.create(
+                conversation=self.conversation,
+                message_type='user',
+                content='قیمت پژو ۲۰۶ چنده؟',
+                divar_message_id='divar-message-1'
+            )
+            return load_conversation_context(conversation_id)
+
+        with mock.patch('khodroyar.views.load_conversation_context', side_effect=retry_lands_first):
+            response = self.post_message('divar-message-1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'success': True, 'duplicate': True})
+        self.assertEqual(Message.objects.filter(divar_message_id='divar-message-1').count(), 1)
+        self.assertFalse(ChatJob.objects.exists())
@@ -0,0 +1,89 @@
+import math
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Tokens added by the chat format around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Characters per token when tiktoken is not installed; Persian text is split
+# into more tokens than English, so the estimate errs on the high side
+APPROX_CHARS_PER_TOKEN = 3
+
+# Older messages are only cut down if at least this much of the budget is left
+MIN_TRIMMED_TOKENS = 40
+
+TRIMMED_MARKER = ' …'
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """tiktoken encoding of the GPT-4.1 family, or None if tiktoken is not installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding('o200k_base')
+
+
+def count_tokens(text: str) -> int:
+    """
+    Number of tokens in a text
+
+    Uses tiktoken when it is installed, otherwise an approximation from the
+    number of characters.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    """Number of tokens of chat messages, including the per-message overhead"""
+    return sum(count_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the beginning of a text that fits in `max_tokens` tokens"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * APPROX_CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def fit_history_to_budget(messages: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+    """
+    Keep the newest chat messages that fit in a token budget
+
+    Messages are taken from the newest backwards and kept verbatim while they
+    fit. The first older message that does not fit is cut down to the budget
+    left (if a useful part of it fits), and everything older is dropped.
+
+    Args:
+        messages: Chronological {"role", "content"} messages
+        max_tokens: Token budget of the history
+
+    Returns:
+        tuple: (kept messages in chronological order, their token count)
+    """
+    kept = []
+    used = 0
+
+    for message in reversed(messages):
+        tokens = count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens <= max_tokens:
+            kept.append(message)
+            used += tokens
+            continue
+
+        remaining = max_tokens - used - MESSAGE_OVERHEAD_TOKENS
+        if remaining >= MIN_TRIMMED_TOKENS:
+            content = truncate_to_tokens(message['content'], remaining - count_tokens(TRIMMED_MARKER))
+            kept.append({**message, 'content': content + TRIMMED_MARKER})
+            used += count_tokens(kept[-1]['content']) + MESSAGE_OVERHEAD_TOKENS
+        break
+
+    kept.reverse()
+    return kept, used
@@ -0,0 +1,77 @@
+from typing import Callable, Dict, Optional
+from .car_search import get_car_search_service
+
+# Questions with these words need the model to reason beyond a tool result
+# (comparisons, advice, specifications), so their tool results are not templated
+NEEDS_MODEL_KEYWORDS = (
+    'مقایسه', 'فرق', 'تفاوت', 'بهتر', 'پیشنهاد', 'ارزش', 'بخرم', 'بفروشم',
+    'مشخصات', 'مزایا', 'معایب', 'چرا', ' یا ',
+)
+
+PERSIAN_DIGITS = str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹')
+
+
+def _format_estimate(price: float) -> str:
+    """Persian price rounded to the million, as an estimate should be"""
+    return get_car_search_service().format_price(int(round(price / 1_000_000)) * 1_000_000)
+
+
+def _format_percent(fraction: float) -> str:
+    return f"{fraction * 100:.0f}".translate(PERSIAN_DIGITS) + ' درصد'
+
+
+def render_used_car_price(result: Dict, current_date: str) -> Optional[str]:
+    """
+    Answer of a used car price calculation
+
+    Args:
+        result: Result of KhodroyarAIAgent.calculate_used_car_price
+        current_date: Current Shamsi date shown with the price
+
+    Returns:
+        The answer text, or None if the calculation failed
+    """
+    if result.get('error'):
+        return None
+
+    return (
+        f"💰 قیمت تخمینی این خودرو در تاریخ {current_date}:\n"
+        f"از {_format_estimate(result['price_range_lower'])} تا {_format_estimate(result['price_range_upper'])}\n\n"
+        f"مبنای محاسبه:\n"
+        f"- قیمت صفر: {_format_estimate(result['base_price'])}\n"
+        f"- افت قیمت بابت سن خودرو: {_format_percent(result['annual_depreciation'])}\n"
+        f"- افت قیمت بابت کارکرد: {_format_percent(result['kilometer_depreciation'])}\n"
+        f"- اثر وضعیت بدنه و رنگ: {_format_percent(1 - result['condition_factor'])} کاهش\n\n"
+        f"این قیمت تخمینی است و بسته به وضعیت فنی، آپشن‌ها و شهر محل معامله ممکن است کمی متفاوت باشد."
+    )
+
+
+# Tools whose result can be sent to the user without another model call
+TOOL_ANSWER_TEMPLATES: Dict[str, Callable[[Dict, str], Optional[str]]] = {
+    'calculate_used_car_price': render_used_car_price,
+}
+
+
+def needs_model(user_message: str) -> bool:
+    """Whether the user's question asks for more than a tool result"""
+    text = f" {user_message} "
+    return any(keyword in text for keyword in NEEDS_MODEL_KEYWORDS)
+
+
+def render_tool_answer(tool_name: str, result: Dict, user_message: str, current_date: str) -> Optional[str]:
+    """
+    Render the answer of a turn from its single tool result when possible
+
+    Args:
+        tool_name: Name of the tool the model called
+        result: The tool result
+        user_message: The user's message of the turn
+        current_date: Current Shamsi date
+
+    Returns:
+        The answer text, or None if the model has to write the answer
+    """
+    render = TOOL_ANSWER_TEMPLATES.get(tool_name)
+    if render is None or needs_model(user_message):
+        return None
+    return render(result, current_date)
@@ -16,4 +16,5 @@ urlpatterns = [
     
     # Chatbot API endpoints
     path('api/chat/receive/', views.receive_message, name='receive_message'),
+    path('api/chat/llm-status/', views.llm_status, name='llm_status'),
 ] 
\ No newline at end of file
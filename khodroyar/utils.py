@@ -1,6 +1,5 @@
 import jdatetime
 from datetime import datetime
-from .models import Payment
 from django.utils import timezone
 import pytz
 
@@ -185,27 +184,60 @@ def check_subscription_status(user_auth):
     if not user_auth:
         return False, None
     
-    # Get the most recent completed payment
-    latest_payment = Payment.objects.filter(
-        user_auth=user_auth,
-        status='completed'
-    ).order_by('-created_at').first()
+    state = get_subscription_state(user_auth)
+    return get_subscription_status(state['has_subscription'], state['subscription_end'])
+
+
+def get_subscription_state(user_auth):
+    """
+    Get the user's subscription state
     
-    if not latest_payment:
+    The state is built from the denormalized UserAuth subscription fields, so
+    it costs no query and is always as fresh as the loaded UserAuth row.
+    
+    Args:
+        user_auth: UserAuth object
+        
+    Returns:
+        dict with has_subscription, subscription_end, plan, plan_name,
+        subscription_days and the Shamsi formatted subscription_end_display
+    """
+    return {
+        'has_subscription': user_auth.has_subscription,
+        'subscription_end': user_auth.subscription_end,
+        'subscription_end_display': to_shamsi_date(user_auth.subscription_end),
+        'plan': user_auth.subscription_plan,
+        'plan_name': user_auth.subscription_plan_name,
+        'subscription_days': user_auth.subscription_days,
+    }
+
+
+def get_subscription_status(has_payment, subscription_end):
+    """
+    Subscription check for already loaded subscription data
+    
+    Args:
+        has_payment: Whether the user has any completed payment
+        subscription_end: End of the latest completed subscription (may be None)
+        
+    Returns:
+        tuple: (has_ended, message) where has_ended is boolean and message is string or None
+    """
+    if not has_payment:
         # No payment found - treat as no subscription
         return True, """🔒 شما هنوز اشتراک خودرویار ندارید!
 💳 برای استفاده از خدمات خودرویار، لطفاً اشتراک تهیه کنید:
 """
     
     # Check if subscription has ended
-    if latest_payment.subscription_end and latest_payment.subscription_end < timezone.now():
+    if subscription_end and subscription_end < timezone.now():
         # Subscription has ended
         ended_message = f"""⏰ اشتراک شما به پایان رسیده است!
-📅 اشتراک شما در تاریخ {to_shamsi_date(latest_payment.subscription_end)} منقضی شده است.
+📅 اشتراک شما در تاریخ {to_shamsi_date(subscription_end)} منقضی شده است.
 🔄 برای ادامه استفاده از خدمات خودرویار، لطفاً اشتراک خود را تمدید کنید:
 """
         
         return True, ended_message
     
     # Subscription is still active
-    return False, None 
\ No newline at end of file
+    return False, None
@@ -7,21 +7,29 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction, IntegrityError
 import json
 import uuid
 from datetime import datetime, timedelta
 from .models import UserAuth, Conversation, Message, Payment
 from .utils import (
-    to_shamsi_date, 
     to_shamsi_datetime_full, 
     format_amount_in_toman,
     get_current_tehran_datetime,
-    check_subscription_status,
     to_shamsi_date_short
 )
+from data_line.divar_client import get_divar_client
 from .ai_agent import get_ai_agent
+from .llm_limiter import get_llm_limiter
+from .circuit_breaker import circuit_breaker_stats
+from .rate_limit import check_rate_limit, should_notify_throttled, throttled_message
+from .chat_queue import enqueue_chat_job
+from .post_payment import enqueue_post_payment_job, start_post_payment_job
+from .outbox import queue_bot_message, deliver_outgoing_message
+from .context import load_conversation_context
+from .summary import schedule_conversation_summary
 from django.utils import timezone
-import time
 import pytz
 # Create your views here.
 
@@ -106,9 +114,11 @@ def oauth_callback(request):
         'grant_type': 'authorization_code',
     }
     
+    divar_client = get_divar_client()
+    
     try:
         # First try to get access token
-        response = requests.post(settings.OAUTH_TOKEN_URL, data=token_data)
+        response = divar_client.post(settings.OAUTH_TOKEN_URL, endpoint='oauth_token', data=token_data)
         response.raise_for_status()
         token_info = response.json()
         
@@ -125,8 +135,9 @@ def oauth_callback(request):
                 'Authorization': f'Bearer {access_token}',
                 'X-API-Key': oauth_settings['api_key']
             }
-            user_info_response = requests.get(
+            user_info_response = divar_client.get(
                 settings.OAUTH_USER_INFO_URL,
+                endpoint='user_info',
                 headers=headers
             )
             user_info_response.raise_for_status()
@@ -395,18 +406,18 @@ def payment_callback(request):
                 payment.subscription_end = datetime.now(pytz.timezone('Asia/Tehran')) + timedelta(days=subscription_days)
                 payment.save()
                 
-                # Send welcome message to user after successful payment
+                # Keep the denormalized subscription on UserAuth current
+                payment.user_auth.refresh_subscription()
+                
+                # The welcome message is queued for the background worker (with retries);
+                # without a worker its first attempt runs on a thread, so the user is
+                # redirected without waiting on the Divar API
                 try:
-                    if send_welcome_message_after_payment(payment.user_auth, payment):
-                        print("Welcome message sent successfully")
-                    else:
-                        time.sleep(2)
-                        if send_welcome_message_after_payment(payment.user_auth, payment):
-                            print("Welcome message sent successfully")
-                        else:
-                            print("Failed to send welcome message for user", payment.user_auth.user_id)
+                    job = enqueue_post_payment_job(payment)
+                    if settings.KHODROYAR_POST_PAYMENT_INLINE_DELIVERY:
+                        transaction.on_commit(lambda: start_post_payment_job(job))
                 except Exception as e:
-                    print(f"Failed to send welcome message after payment: {str(e)}")
+                    print(f"Failed to queue welcome message after payment: {str(e)}")
                     # Don't fail the payment process if message sending fails
                 
                 messages.success(request, f'پرداخت با موفقیت انجام شد. شماره پیگیری: {payment.ref_id}')
@@ -493,94 +504,161 @@ def payment_failed(request):
 
 # Chatbot API Views
 
+def _parse_chat_webhook(request):
+    """
+    Validate the Divar chatbot webhook request and extract the incoming message
+    
+    Returns:
+        tuple: (error_response, incoming) where error_response is a JsonResponse
+        to return immediately, or None and incoming is a dict of message fields
+    """
+    # Check for Authorization header
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return JsonResponse({
+            'success': False,
+            'error': 'Authorization header is required'
+        }, status=401), None
+    
+
+    # Validate token against Divar authorization token
+    expected_token = settings.DIVAR_AUTHORIZATION_TOKEN
+    
+    if auth_header != expected_token:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid authorization token'
+        }, status=401), None
+    
+    data = json.loads(request.body)
+    
+    # Handle the new message format
+    new_message = data.get('new_chatbot_message', {})
+    
+    # Extract fields from the new message format
+    conversation_data = new_message.get('conversation', {})
+    incoming = {
+        'message_id': new_message.get('id'),
+        'conversation_id': conversation_data.get('id'),
+        'conversation_type': conversation_data.get('type'),
+        'sender': new_message.get('sender', {}),
+        'message_type': new_message.get('type'),
+        'sent_at': new_message.get('sent_at'),
+        'text': new_message.get('text'),
+    }
+    
+    # Validate required fields
+    if not incoming['text']:
+        return JsonResponse({
+            'success': False,
+            'error': 'Message text is required'
+        }, status=400), None
+    
+    if not incoming['conversation_id']:
+        return JsonResponse({
+            'success': False,
+            'error': 'Conversation ID is required'
+        }, status=400), None
+    
+    return None, incoming
+
+
+def _store_user_message(conversation, incoming):
+    """
+    Save the incoming user message (and queue it in async acknowledgement mode)
+    
+    Returns:
+        The saved Message, or None if Divar already delivered this message
+    """
+    try:
+        with transaction.atomic():
+            # Save user message with metadata from the new format
+            user_message = Message.objects.create(
+                conversation=conversation,
+                message_type='user',
+                content=incoming['text'],
+                divar_message_id=incoming['message_id'] or None,
+                metadata={
+                    'message_id': incoming['message_id'],
+                    'sent_at': incoming['sent_at'],
+                    'message_type': incoming['message_type'],
+                    'sender_type': incoming['sender'].get('type'),
+                    'conversation_type': incoming['conversation_type'],
+                    'timestamp': datetime.now().isoformat()
+                }
+            )
+            
+            # In async mode the reply is produced by the background workers
+            if settings.KHODROYAR_ASYNC_WEBHOOK:
+                enqueue_chat_job(conversation, user_message)
+    except IntegrityError:
+        # A concurrent retry of the same message won the race
+        return None
+    
+    return user_message
+
+
+def _throttle_response(context):
+    """
+    Take a token from the user's rate limit bucket
+    
+    Returns:
+        JsonResponse for a throttled message (after sending the templated reply
+        once per throttling period), or None if the message may be processed
+    """
+    if not settings.KHODROYAR_RATE_LIMIT_ENABLED:
+        return None
+    
+    allowed, retry_after = check_rate_limit(context.user_auth, context.subscription)
+    if allowed:
+        return None
+    
+    print(f"Rate limited user {context.user_auth.user_id} for {retry_after:.1f}s")
+    if should_notify_throttled(context.user_auth, retry_after):
+        send_bot_message(context.user_auth, context.conversation_id, throttled_message(retry_after))
+    
+    return JsonResponse({'success': True, 'throttled': True}, status=200)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def receive_message(request):
     """API endpoint to receive messages from users"""
     try:
-        # Check for Authorization header
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return JsonResponse({
-                'success': False,
-                'error': 'Authorization header is required'
-            }, status=401)
-        
-
-        # Validate token against Divar authorization token
-        expected_token = settings.DIVAR_AUTHORIZATION_TOKEN
-        
-        if auth_header != expected_token:
-            return JsonResponse({
-                'success': False,
-                'error': 'Invalid authorization token'
-            }, status=401)
-        
-        data = json.loads(request.body)
-        
-        # Handle the new message format
-        new_message = data.get('new_chatbot_message', {})
+        error_response, incoming = _parse_chat_webhook(request)
+        if error_response:
+            return error_response
         
-        # Extract fields from the new message format
-        message_id = new_message.get('id')
-        conversation_data = new_message.get('conversation', {})
-        conversation_id = conversation_data.get('id')
-        sender = new_message.get('sender', {})
-        message_type = new_message.get('type')
-        sent_at = new_message.get('sent_at')
-        text = new_message.get('text')
-        
-        # Validate required fields
-        if not text:
-            return JsonResponse({
-                'success': False,
-                'error': 'Message text is required'
-            }, status=400)
+        message_id = incoming['message_id']
+        conversation_id = incoming['conversation_id']
         
-        if not conversation_id:
-            return JsonResponse({
-                'success': False,
-                'error': 'Conversation ID is required'
-            }, status=400)
+        # Divar retries the webhook when we answer slowly; a message we already
+        # stored must not be answered twice
+        if message_id and Message.objects.filter(divar_message_id=message_id).exists():
+            return JsonResponse({'success': True, 'duplicate': True}, status=200)
         
-        # Get existing conversation (assume it exists)
-        try:
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
-            user_auth = conversation.user_auth
-        except Conversation.DoesNotExist:
+        # Load the conversation with its user and subscription in one query
+        context = load_conversation_context(conversation_id)
+        if context is None:
             return JsonResponse({
                 'success': False,
                 'error': f'Conversation with ID {conversation_id} not found'
             }, status=404)
         
-        # Save user message with metadata from the new format
-        user_message = Message.objects.create(
-            conversation=conversation,
-            message_type='user',
-            content=text,
-            metadata={
-                'message_id': message_id,
-                'sent_at': sent_at,
-                'message_type': message_type,
-                'sender_type': sender.get('type'),
-                'conversation_type': conversation_data.get('type'),
-                'timestamp': datetime.now().isoformat()
-            }
-        )
+        # Flooding users are answered with a template before anything is stored
+        throttle_response = _throttle_response(context)
+        if throttle_response:
+            return throttle_response
         
-        # Process message and generate bot response
-        bot_response = generate_response(text, user_auth, conversation_id)
+        user_message = _store_user_message(context.conversation, incoming)
+        if user_message is None:
+            return JsonResponse({'success': True, 'duplicate': True}, status=200)
         
-        # Save bot response
-        bot_message = Message.objects.create(
-            conversation=conversation,
-            message_type='bot',
-            content=bot_response,
-            metadata={
-                'sent_at': datetime.now().isoformat(),
-                'timestamp': datetime.now().isoformat()
-            }
-        )
+        if settings.KHODROYAR_ASYNC_WEBHOOK:
+            return JsonResponse({'success': True, 'queued': True}, status=200)
+        
+        # Process message, generate and save bot response
+        reply_to_message(context, incoming['text'], turn_message_ids=[user_message.id])
         
         return JsonResponse({'success': True}, status=200)
         
@@ -596,92 +674,143 @@ def receive_message(request):
         }, status=500)
 
 
-def generate_response(message, user_auth, conversation_id=None):
-    """Process user message using AI agent and send bot response"""
+def reply_to_message(context, text, turn_message_ids=None):
+    """
+    Generate the bot response for a user turn and save it to the conversation
+    
+    The reply is stored together with its outbox entry, so a failed delivery is
+    retried by the outbox worker instead of being lost.
+    """
+    if settings.KHODROYAR_STREAM_REPLIES and not context.subscription_status()[0]:
+        return stream_reply_to_message(context, text, turn_message_ids=turn_message_ids)
+    
+    metadata = {}
+    bot_response = generate_response(text, context, turn_message_ids=turn_message_ids, metadata=metadata)
+    
+    bot_message = queue_bot_message(context.conversation, bot_response, metadata=metadata)
+    if settings.KHODROYAR_OUTBOX_INLINE_DELIVERY:
+        deliver_outgoing_message(bot_message.outgoing)
+    
+    schedule_conversation_summary(context.conversation)
+    return bot_message
+
+
+def stream_reply_to_message(context, text, turn_message_ids=None):
+    """
+    Streaming version of reply_to_message
+    
+    Every complete sentence or paragraph is sent to the conversation as soon as
+    the model produces it, and the concatenated reply is stored once. If a piece
+    cannot be sent, it and the rest of the reply are left to the outbox.
+    """
+    user_auth = context.user_auth
+    conversation_id = context.conversation_id
+    sent_chunks = []
+    unsent_chunks = []
+    metadata = {}
+    
+    try:
+        chunks = get_ai_agent().generate_response_stream(
+            text,
+            context.conversation,
+            context.user_context(),
+            turn_message_ids=turn_message_ids,
+            history=context.load_history(exclude_message_ids=turn_message_ids),
+            metadata=metadata
+        )
+        for chunk in chunks:
+            if not unsent_chunks and send_bot_message(user_auth, conversation_id, chunk.strip()):
+                sent_chunks.append(chunk)
+            else:
+                unsent_chunks.append(chunk)
+    except Exception as e:
+        print(f"Streaming reply error: {str(e)}")
+        if not sent_chunks and not unsent_chunks:
+            unsent_chunks.append(f"متأسفانه مشکلی در پردازش پیام شما پیش آمد")
+    
+    bot_message = queue_bot_message(
+        context.conversation,
+        ''.join(sent_chunks + unsent_chunks).strip(),
+        metadata={**metadata, 'streamed_parts': len(sent_chunks)},
+        outgoing_text=''.join(unsent_chunks).strip()
+    )
+    if unsent_chunks and settings.KHODROYAR_OUTBOX_INLINE_DELIVERY:
+        deliver_outgoing_message(bot_message.outgoing)
+    
+    schedule_conversation_summary(context.conversation)
+    return bot_message
+
+
+def generate_response(message, context, turn_message_ids=None, metadata=None):
+    """
+    Process user message using AI agent and return the bot response
+    
+    Args:
+        message: The user's message text for this turn
+        context: ConversationContext from load_conversation_context
+        turn_message_ids: IDs of the stored user messages making up this turn
+        metadata: Bot message metadata, filled by the AI agent with details of the call
+    
+    Returns:
+        Bot response text (to be delivered through the outbox)
+    """
     try:
-        # Get conversation if conversation_id is provided
-        conversation = None
-        if conversation_id:
-            try:
-                conversation = Conversation.objects.get(conversation_id=conversation_id)
-            except Conversation.DoesNotExist:
-                print(f"Conversation {conversation_id} not found")
-        
         # Check subscription status first
-        if user_auth:
-            # Use the utility function to check subscription status
-            has_ended, subscription_message = check_subscription_status(user_auth)
-            
-            if has_ended:
-                # Subscription has ended or doesn't exist - return predefined message without engaging AI
-                if conversation_id:
-                    send_bot_message(user_auth, conversation_id, subscription_message)
-                return subscription_message
-        
-        # Get user context (subscription info, etc.) for active subscriptions
-        user_context = {}
-        if user_auth:
-            # Get active subscription
-            active_payment = Payment.objects.filter(
-                user_auth=user_auth,
-                status='completed',
-                subscription_end__gt=datetime.now()
-            ).first()
-            
-            if active_payment:
-                user_context = {
-                    'subscription_end': to_shamsi_date(active_payment.subscription_end),
-                    'plan_name': active_payment.metadata.get('plan_name', 'اشتراک طلایی'),
-                    'subscription_days': active_payment.metadata.get('subscription_days', 1)
-                }
+        has_ended, subscription_message = context.subscription_status()
         
-        # Use the AI agent to generate the response
-        ai_agent = get_ai_agent()
+        if has_ended:
+            # Subscription has ended or doesn't exist - return predefined message without engaging AI
+            return subscription_message
         
-        if conversation:
-            bot_response = ai_agent.generate_response(message, conversation, user_context)
-        else:
-            # Fallback response if no conversation context
-            bot_response = "سلام! من ربات خودرویار هستم. برای شروع مکالمه، لطفاً پیام خود را ارسال کنید."
+        # Use the AI agent to generate the response
+        bot_response = get_ai_agent().generate_response(
+            message,
+            context.conversation,
+            context.user_context(),
+            turn_message_ids=turn_message_ids,
+            history=context.load_history(exclude_message_ids=turn_message_ids),
+            metadata=metadata
+        )
         
-        # Send bot response using conversation_id if available
-        if conversation_id:
-            send_bot_message(user_auth, conversation_id, bot_response)
-            
         return bot_response
             
     except Exception as e:
         error_response = f"متأسفانه مشکلی در پردازش پیام شما پیش آمد"
-        if conversation_id:
-            send_bot_message(user_auth, conversation_id, error_response)
         return error_response
 
 
+def _divar_chat_request(user_auth, conversation_id, message_text):
+    """Build the Divar Chat API url, headers and body for a bot message"""
+    # Get user's access token
+    access_token = user_auth.access_token
+    oauth_settings = settings.OAUTH_APPS_SETTINGS['khodroyar']
+    
+    # Prepare headers for Divar API calls
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'X-API-Key': oauth_settings['api_key'],
+        'Content-Type': 'application/json'
+    }
+    
+    # Prepare message data for Divar Chat API
+    message_data = {
+        "conversation_id": conversation_id,
+        "text_message": message_text
+    }
+    
+    chat_api_url = settings.DIVAR_CHAT_API_URL.format(conversation_id=conversation_id)
+    return chat_api_url, headers, message_data
+
+
 def send_bot_message(user_auth, conversation_id, message_text):
     """Send a bot message using the conversation_id"""
     try:
-        # Get user's access token
-        access_token = user_auth.access_token
-        oauth_settings = settings.OAUTH_APPS_SETTINGS['khodroyar']
-        
-        # Prepare headers for Divar API calls
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'X-API-Key': oauth_settings['api_key'],
-            'Content-Type': 'application/json'
-        }
-        
-        # Prepare message data for Divar Chat API
-        message_data = {
-            "conversation_id": conversation_id,
-            "text_message": message_text
-        }
+        chat_api_url, headers, message_data = _divar_chat_request(user_auth, conversation_id, message_text)
         
         # Send message using Divar Chat API
-        chat_api_url = settings.DIVAR_CHAT_API_URL.format(conversation_id=conversation_id)
-        
-        response = requests.post(
+        response = get_divar_client().post(
             chat_api_url,
+            endpoint='chat_message',
             headers=headers,
             json=message_data
         )
@@ -698,25 +827,19 @@ def send_bot_message(user_auth, conversation_id, message_text):
         return False
 
 
-def send_welcome_message_after_payment(user_auth, payment):
-    """
-    Send a welcome message to the user after successful payment using Divar Chat API
-    First sends message using user_id to get conversation_id, then creates conversation in database
-    """
-    try:
-        # Get user's access token
-        access_token = user_auth.access_token
-        oauth_settings = settings.OAUTH_APPS_SETTINGS['khodroyar']
-        
-        # Prepare headers for Divar API calls
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'X-API-Key': oauth_settings['api_key'],
-            'Content-Type': 'application/json'
-        }
-        
-        # Prepare welcome message
-        welcome_message = f"""🎉 تبریک! اشتراک خودرویار شما با موفقیت فعال شد!
+@staff_member_required
+@require_http_methods(["GET"])
+def llm_status(request):
+    """Current state of the shared LLM limiter (slots in use and queue depth) and of this process's circuit breakers"""
+    return JsonResponse({
+        **get_llm_limiter().stats(),
+        'circuit_breakers': circuit_breaker_stats()
+    }, status=200)
+
+
+def build_welcome_message(payment):
+    """Welcome message text for a completed (or admin mock) payment"""
+    return f"""🎉 تبریک! اشتراک خودرویار شما با موفقیت فعال شد!
 
 ✅ پرداخت شما تایید شد
 💰 مبلغ: {format_amount_in_toman(payment.amount)}
@@ -732,7 +855,29 @@ def send_welcome_message_after_payment(user_auth, payment):
 
 برای شروع، پیام خود را بنویسید! (مثلا: سلام)"""
 
-        # First, send welcome message using user_id to get conversation_id
+
+def deliver_welcome_message(user_auth, welcome_message):
+    """
+    Send a welcome message to a user through the Divar Chat API
+    
+    The message is addressed by user_id, and Divar answers with the id of the
+    conversation it was posted to.
+    
+    Returns:
+        The conversation_id, or None if the message could not be sent
+    """
+    try:
+        # Get user's access token
+        access_token = user_auth.access_token
+        oauth_settings = settings.OAUTH_APPS_SETTINGS['khodroyar']
+        
+        # Prepare headers for Divar API calls
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'X-API-Key': oauth_settings['api_key'],
+            'Content-Type': 'application/json'
+        }
+        
         # Use a different endpoint that accepts user_id instead of conversation_id
         initial_message_data = {
             "user_id": user_auth.user_id,
@@ -742,52 +887,61 @@ def send_welcome_message_after_payment(user_auth, payment):
         # Use the experimental endpoint for initial message with user_id
         initial_chat_api_url = f'https://open-api.divar.ir/v1/open-platform/chat/bot/users/{user_auth.user_id}/messages'
         
-        response = requests.post(
+        response = get_divar_client().post(
             initial_chat_api_url,
+            endpoint='chat_user_message',
             headers=headers,
             json=initial_message_data
         )
         
-        if response.status_code == 200:
-            response_data = response.json()
-            
-            # Extract conversation_id from the response
-            conversation_id = response_data.get('conversation_id')
-            
-            if conversation_id:
-                # Create conversation in our database with the received conversation_id
-                conversation = Conversation.objects.get_or_create(
-                    user_auth=user_auth,
-                    conversation_id=conversation_id,
-                    title='خودرویار - اشتراک جدید',
-                    is_active=True
-                )
-                
-                # Save the bot message to our database
-                Message.objects.create(
-                    conversation=conversation,
-                    message_type='bot',
-                    content=welcome_message,
-                    metadata={
-                        'sent_at': datetime.now().isoformat(),
-                        'timestamp': datetime.now().isoformat(),
-                        'payment_ref_id': payment.ref_id,
-                        'subscription_start': payment.subscription_start.isoformat(),
-                        'subscription_end': payment.subscription_end.isoformat(),
-                        'conversation_id': conversation_id
-                    }
-                )
-                
-                print(f"Welcome message sent successfully to user {user_auth.user_id} with conversation_id: {conversation_id}")
-                return True
-            else:
-                print(f"Failed to get conversation_id from response: {response_data}")
-                return False
-        else:
+        if response.status_code != 200:
             print(f"Failed to send welcome message. Status: {response.status_code}, Response: {response.text}")
-            return False
+            return None
+        
+        response_data = response.json()
+        
+        # Extract conversation_id from the response
+        conversation_id = response_data.get('conversation_id')
+        if not conversation_id:
+            print(f"Failed to get conversation_id from response: {response_data}")
+            return None
+        
+        return conversation_id
             
     except Exception as e:
         print(f"Error sending welcome message: {str(e)}")
-        return False
+        return None
 
+
+def welcome_message_metadata(payment, conversation_id):
+    """Metadata stored on the welcome Message"""
+    return {
+        'sent_at': datetime.now().isoformat(),
+        'timestamp': datetime.now().isoformat(),
+        'payment_ref_id': payment.ref_id,
+        'subscription_start': payment.subscription_start.isoformat() if payment.subscription_start else None,
+        'subscription_end': payment.subscription_end.isoformat() if payment.subscription_end else None,
+        'conversation_id': conversation_id
+    }
+
+
+def save_welcome_message(user_auth, payment, conversation_id, welcome_message):
+    """Create the conversation Divar posted the welcome message to and save the message in it"""
+    with transaction.atomic():
+        # Create conversation in our database with the received conversation_id
+        conversation, _ = Conversation.objects.get_or_create(
+            conversation_id=conversation_id,
+            defaults={
+                'user_auth': user_auth,
+                'title': 'خودرویار - اشتراک جدید',
+                'is_active': True
+            }
+        )
+        
+        # Save the bot message to our database
+        return Message.objects.create(
+            conversation=conversation,
+            message_type='bot',
+            content=welcome_message,
+            metadata=welcome_message_metadata(payment, conversation_id)
+        )
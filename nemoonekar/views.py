@@ -7,6 +7,7 @@ from django.contrib import messages
 from functools import wraps
 from .models import UserAuth, PostImage, SampleWork, Payment, PostAddon
 from .forms import SampleWorkForm, SampleWorkImageForm 
+from data_line.divar_client import get_divar_client
 import json
 from django.http import JsonResponse
 import os
@@ -134,9 +135,11 @@ def oauth_callback(request):
         'grant_type': 'authorization_code',
     }
     
+    divar_client = get_divar_client()
+    
     try:
         # First try to get access token
-        response = requests.post(settings.OAUTH_TOKEN_URL, data=token_data)
+        response = divar_client.post(settings.OAUTH_TOKEN_URL, endpoint='oauth_token', data=token_data)
         response.raise_for_status()
         token_info = response.json()
         
@@ -154,8 +157,9 @@ def oauth_callback(request):
                 'Authorization': f'Bearer {access_token}',
                 'X-API-Key': oauth_settings['api_key']
             }
-            user_info_response = requests.get(
+            user_info_response = divar_client.get(
                 settings.OAUTH_USER_INFO_URL,
+                endpoint='user_info',
                 headers=headers
             )
             user_info_response.raise_for_status()
@@ -746,11 +750,11 @@ def create_post_addon(sample_work):
         }
         
         # Make API request to create addon
-        response = requests.post(
+        response = get_divar_client().post(
             settings.DIVAR_ADDON_CREATE_URL.format(post_token=sample_work.post_token),
+            endpoint='post_addon',
             json=addon_data,
-            headers=headers,
-            timeout=30
+            headers=headers
         )
         
         response.raise_for_status()
@@ -4,6 +4,7 @@ from django.http import HttpResponse
 from django.conf import settings
 import requests
 from urllib.parse import urlencode
+from data_line.divar_client import get_divar_client
 
 def home(request):
     return render(request, 'resumeyar/home.html')
@@ -46,7 +47,7 @@ def oauth_callback(request):
     }
     
     try:
-        response = requests.post(settings.OAUTH_TOKEN_URL, data=token_data)
+        response = get_divar_client().post(settings.OAUTH_TOKEN_URL, endpoint='oauth_token', data=token_data)
         response.raise_for_status()
         token_info = response.json()
         